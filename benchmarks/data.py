@@ -0,0 +1,92 @@
+"""Synthetic social graph generator with power-law follower counts.
+
+Followed accounts are drawn from a Zipf distribution over users, so a few accounts get
+a large share of all followers while most get a handful, as on real social networks;
+the number of accounts each user follows is drawn from a Pareto distribution. Output
+is the record format of `manage.py export_data`, so it can be written to a file and
+loaded with `manage.py import_data`, or loaded directly with load().
+
+    python -m benchmarks.data --users 10000 --output data.ndjson
+"""
+import argparse
+import bisect
+import datetime
+import itertools
+import json
+import random
+
+WORDS = ('coffee', 'launch', 'django', 'weekend', 'music', 'travel', 'python', 'photo', 'news', 'game', 'recipe', 'run')
+
+
+def zipf_weights(count, exponent):
+    # Cumulative weights of ranks 1..count with P(rank) proportional to rank ** -exponent
+    return list(itertools.accumulate((rank ** -exponent for rank in range(1, count + 1))))
+
+
+def generate(users=1000, posts_per_user=20, mean_following=30, exponent=1.1, seed=42):
+    """Yield user, profile, post and follow records (source ids start at 1)."""
+    rng = random.Random(seed)
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+    for user_id in range(1, users + 1):
+        yield {'type': 'user', 'id': user_id, 'username': f'user{user_id}', 'email': '', 'date_joined': start.isoformat()}
+        yield {'type': 'profile', 'user': user_id, 'bio': f'Into {rng.choice(WORDS)} and {rng.choice(WORDS)}.'}
+
+    post_id = 0
+    for user_id in range(1, users + 1):
+        for _ in range(max(0, int(rng.expovariate(1 / posts_per_user)))):
+            post_id += 1
+            timestamp = start + datetime.timedelta(seconds=rng.randrange(365 * 24 * 3600))
+            content = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+            yield {'type': 'post', 'id': post_id, 'user': user_id, 'content': content, 'timestamp': timestamp.isoformat()}
+
+    # Popularity ranks are shuffled so that popular accounts are not simply the lowest ids
+    ranked_users = list(range(1, users + 1))
+    rng.shuffle(ranked_users)
+    weights = zipf_weights(users, exponent)
+    total = weights[-1]
+    pareto_shape = 2.0  # Mean of a Pareto(shape) variable scaled by m is m * shape / (shape - 1)
+    scale = mean_following * (pareto_shape - 1) / pareto_shape
+    for follower_id in range(1, users + 1):
+        wanted = min(users - 1, int(scale * rng.paretovariate(pareto_shape)))
+        following = set()
+        for _ in range(wanted * 3):  # Bounded retries for the duplicate draws of popular accounts
+            if len(following) >= wanted:
+                break
+            candidate = ranked_users[bisect.bisect_left(weights, rng.random() * total)]
+            if candidate != follower_id:
+                following.add(candidate)
+        for following_id in sorted(following):
+            yield {'type': 'follow', 'follower': follower_id, 'following': following_id}
+
+
+def load(records, batch_size=5000):
+    """Load records into the configured database (Django must be set up) and rebuild derived data."""
+    from social.counters import repair_counters
+    from social.importer import Importer
+    from social.timeline import rebuild_timelines
+
+    counts = Importer(batch_size=batch_size).run(records)
+    repair_counters(batch_size=batch_size)
+    rebuild_timelines(batch_size=batch_size)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts-per-user', type=int, default=20, help='Mean number of posts per user.')
+    parser.add_argument('--mean-following', type=int, default=30, help='Mean number of accounts each user follows.')
+    parser.add_argument('--exponent', type=float, default=1.1, help='Zipf exponent of the follower distribution.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', required=True, help='NDJSON file to write.')
+    args = parser.parse_args()
+
+    records = generate(args.users, args.posts_per_user, args.mean_following, args.exponent, args.seed)
+    with open(args.output, 'w', encoding='utf-8') as handle:
+        for record in records:
+            handle.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+
+if __name__ == '__main__':
+    main()
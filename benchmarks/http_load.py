@@ -0,0 +1,104 @@
+"""Concurrent HTTP load test comparing the WSGI (DRF) and ASGI (async) endpoints.
+
+Start both servers against the same database, for example:
+
+    gunicorn social_media_api.wsgi -w 4 -b 127.0.0.1:8000
+    gunicorn social_media_api.asgi:application -k uvicorn.workers.UvicornWorker -w 4 -b 127.0.0.1:8001
+
+then run:
+
+    python -m benchmarks.http_load --sessionid <session cookie> \\
+        --target wsgi=http://127.0.0.1:8000/api/api/posts/ \\
+        --target asgi=http://127.0.0.1:8001/api/api/async/posts/
+
+Each target receives the same number of requests from the same number of concurrent
+clients; the script prints requests/sec and latency percentiles for each.
+
+The DRF endpoints limit each user to THROTTLE_RATES['read']: raise it in the settings of
+the servers under test, or the throttled requests are counted as errors.
+"""
+import argparse
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def fetch(url, headers):
+    request = urllib.request.Request(url, headers=headers)
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as error:
+        status = error.code
+    except urllib.error.URLError:
+        status = 0
+    return time.perf_counter() - start, status
+
+
+def run_target(url, headers, requests, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # Warm up connections, caches and lazy imports before measuring
+        list(pool.map(lambda _: fetch(url, headers), range(concurrency)))
+        start = time.perf_counter()
+        results = list(pool.map(lambda _: fetch(url, headers), range(requests)))
+        elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, status in results if status == 200)
+    return {
+        'requests': requests,
+        'errors': sum(1 for _, status in results if status != 200),
+        'requests_per_second': round(requests / elapsed, 1),
+        'latency_ms': {
+            'mean': round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+            'p50': round(percentile(latencies, 0.50) * 1000, 2),
+            'p99': round(percentile(latencies, 0.99) * 1000, 2),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', action='append', required=True, help='name=url of an endpoint to load (repeatable).')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests sent to each target.')
+    parser.add_argument('--concurrency', type=int, default=50, help='Number of concurrent clients.')
+    parser.add_argument('--sessionid', help='Session cookie of a logged-in user.')
+    parser.add_argument('--token', help='Bearer token of a user (alternative to --sessionid).')
+    parser.add_argument('--output', help='Also write the results to this JSON file.')
+    args = parser.parse_args()
+
+    headers = {'Accept': 'application/json'}
+    if args.sessionid:
+        headers['Cookie'] = f'sessionid={args.sessionid}'
+    if args.token:
+        headers['Authorization'] = f'Bearer {args.token}'
+
+    report = {}
+    for target in args.target:
+        name, url = target.split('=', 1)
+        report[name] = run_target(url, headers, args.requests, args.concurrency)
+        result = report[name]
+        print(
+            f"{name:>8}: {result['requests_per_second']:>8} req/s  "
+            f"p50 {result['latency_ms']['p50']:>7} ms  p99 {result['latency_ms']['p99']:>7} ms  "
+            f"errors {result['errors']}"
+        )
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+
+
+if __name__ == '__main__':
+    main()
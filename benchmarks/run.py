@@ -0,0 +1,221 @@
+"""In-process API benchmark with synthetic data.
+
+Generates a power-law social graph (see benchmarks.data) in a dedicated database, then
+drives the DRF endpoints through Django's test client and reports, for every scenario,
+throughput, latency percentiles and database queries per request:
+
+    python -m benchmarks.run --users 5000 --output before.json
+    ... change something ...
+    python -m benchmarks.run --users 5000 --reuse --output after.json --compare before.json
+
+Scenarios: feed reads at page depths 1, 5 and 20 (PostViewSet.list, following the
+cursor links), post creation (PostViewSet.create), single follows and follow/unfollow
+bursts (FollowViewSet), and profile reads (ProfileViewSet.list). Requests run one at a
+time in this process, so they measure server-side cost without network or worker
+effects; use benchmarks.http_load for concurrent load against running servers.
+
+The database is a SQLite file (--database) unless DB_ENGINE and the other DB_*
+variables are set, in which case that database is used and must be a disposable one.
+Set TASKS_EAGER=0 to measure writes with their side effects queued instead of inline.
+Throttling is turned off for the run: a single user's bursts (a bulk request takes one
+token per item) would otherwise measure the 429 path instead of the writes.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import tempfile
+import time
+
+from .http_load import percentile
+
+SCENARIOS = ['feed_page_1', 'feed_page_5', 'feed_page_20', 'post_create', 'follow', 'follow_burst', 'unfollow_burst', 'profile_read']
+
+
+def setup(database, reuse):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'social_media_api.settings')
+    if os.environ.get('DB_ENGINE', 'sqlite') == 'sqlite':
+        if not reuse and os.path.exists(database):
+            os.remove(database)
+        os.environ['DB_NAME'] = database
+    import django
+    django.setup()
+    from django.conf import settings
+    settings.THROTTLE_RATES = {}  # No scope is limited
+    from django.core.management import call_command
+    from django.test.utils import setup_test_environment
+    setup_test_environment()  # Allows the test client's host
+    call_command('migrate', verbosity=0)
+
+
+class Recorder:
+    def __init__(self, clear_cache):
+        self.samples = {name: [] for name in SCENARIOS}
+        self.clear_cache = clear_cache
+
+    def request(self, scenario, client, method, url, **kwargs):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from social.cache import get_cache
+
+        if self.clear_cache:
+            get_cache().clear()  # Measure the database path rather than cached pages
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(client, method)(url, HTTP_ACCEPT='application/json', **kwargs)
+            elapsed = time.perf_counter() - start
+        if scenario is not None:
+            self.samples[scenario].append((elapsed, len(queries), response.status_code))
+        return response
+
+    def summary(self, scenario):
+        samples = self.samples[scenario]
+        if not samples:
+            return None
+        latencies = sorted(elapsed for elapsed, _, _ in samples)
+        queries = [count for _, count, _ in samples]
+        return {
+            'requests': len(samples),
+            'errors': sum(1 for _, _, status in samples if status >= 400),
+            'requests_per_second': round(len(samples) / sum(latencies), 1),
+            'latency_ms': {
+                'mean': round(statistics.fmean(latencies) * 1000, 2),
+                'p50': round(percentile(latencies, 0.50) * 1000, 2),
+                'p90': round(percentile(latencies, 0.90) * 1000, 2),
+                'p99': round(percentile(latencies, 0.99) * 1000, 2),
+            },
+            'queries': {'mean': round(statistics.fmean(queries), 2), 'max': max(queries)},
+        }
+
+
+def make_client(user, auth):
+    from rest_framework.test import APIClient
+    from social.authentication import SocialTokenObtainPairSerializer
+
+    client = APIClient()
+    if auth == 'jwt':
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {SocialTokenObtainPairSerializer.get_token(user).access_token}')
+    else:
+        client.force_login(user)
+    return client
+
+
+def run_scenarios(recorder, rng, samples, auth):
+    from django.contrib.auth.models import User
+    from django.urls import reverse
+    from social.models import Follow
+
+    readers = list(User.objects.filter(id__in=Follow.objects.values('follower_id')).order_by('?')[:samples])
+    user_ids = list(User.objects.values_list('id', flat=True))
+
+    for user in readers:
+        client = make_client(user, auth)
+
+        # Feed pages: walk the cursor links and measure the page at each depth
+        url, depth = reverse('post-list'), 1
+        while url and depth <= 20:
+            scenario = f'feed_page_{depth}' if f'feed_page_{depth}' in SCENARIOS else None
+            response = recorder.request(scenario, client, 'get', url)
+            url, depth = response.json().get('next') if response.status_code == 200 else None, depth + 1
+
+        recorder.request('post_create', client, 'post', reverse('post-list'), data={'content': 'benchmark post about coffee'})
+        recorder.request('profile_read', client, 'get', reverse('profile-list'))
+
+        following = set(Follow.objects.filter(follower_id=user.id).values_list('following_id', flat=True))
+        candidates = [user_id for user_id in rng.sample(user_ids, min(len(user_ids), 60))
+                      if user_id != user.id and user_id not in following]
+        if candidates:
+            recorder.request('follow', client, 'post', reverse('follows-list'), data={'following': candidates[0]})
+            burst = candidates[1:51]
+            for scenario, name in [('follow_burst', 'follows-bulk-follow'), ('unfollow_burst', 'follows-bulk-unfollow')]:
+                response = recorder.request(scenario, client, 'post', reverse(name), data={'following': burst}, format='json')
+                if response.status_code != 200:
+                    raise SystemExit(f"{scenario} returned {response.status_code}: the scenario would not measure the bulk write")
+
+
+def dataset_stats():
+    from django.db import connection
+    from django.db.models import Max
+    from social.models import Follow, Post, Profile
+
+    return {
+        'database': connection.vendor,
+        'users': Profile.objects.count(),
+        'posts': Post.objects.count(),
+        'follows': Follow.objects.count(),
+        'max_followers': Profile.objects.aggregate(top=Max('followers_count'))['top'] or 0,
+    }
+
+
+def compare(report, previous):
+    print(f"\n{'scenario':<16}{'p50 ms':>18}{'p99 ms':>18}{'queries':>16}{'req/s':>20}")
+    for name, result in report['scenarios'].items():
+        old = previous.get('scenarios', {}).get(name)
+        if not result or not old:
+            continue
+
+        def cell(new_value, old_value):
+            return f"{old_value}->{new_value}"
+        print(f"{name:<16}{cell(result['latency_ms']['p50'], old['latency_ms']['p50']):>18}"
+              f"{cell(result['latency_ms']['p99'], old['latency_ms']['p99']):>18}"
+              f"{cell(result['queries']['mean'], old['queries']['mean']):>16}"
+              f"{cell(result['requests_per_second'], old['requests_per_second']):>20}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default=os.path.join(tempfile.gettempdir(), 'social-benchmark.sqlite3'),
+                        help='SQLite file used for the benchmark (recreated unless --reuse).')
+    parser.add_argument('--reuse', action='store_true', help='Keep the existing database and its data.')
+    parser.add_argument('--users', type=int, default=2000, help='Number of users generated.')
+    parser.add_argument('--posts-per-user', type=int, default=20)
+    parser.add_argument('--mean-following', type=int, default=30)
+    parser.add_argument('--exponent', type=float, default=1.1, help='Zipf exponent of the follower distribution.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--samples', type=int, default=50, help='Number of users running every scenario.')
+    parser.add_argument('--auth', choices=['jwt', 'session'], default='jwt')
+    parser.add_argument('--warm-cache', action='store_true', help='Keep the list cache between requests.')
+    parser.add_argument('--output', help='Write the report to this JSON file.')
+    parser.add_argument('--compare', help='Previous report to compare against.')
+    args = parser.parse_args()
+
+    setup(args.database, args.reuse)
+    from .data import generate, load
+    from social.models import Profile
+
+    if not Profile.objects.exists():
+        started = time.perf_counter()
+        load(generate(args.users, args.posts_per_user, args.mean_following, args.exponent, args.seed))
+        print(f"Generated data in {time.perf_counter() - started:.1f}s")
+
+    recorder = Recorder(clear_cache=not args.warm_cache)
+    run_scenarios(recorder, random.Random(args.seed), args.samples, args.auth)
+
+    from django.conf import settings
+    report = {
+        'meta': {
+            **dataset_stats(),
+            'auth': args.auth,
+            'warm_cache': args.warm_cache,
+            'tasks_eager': settings.TASKS_EAGER,
+            'python': platform.python_version(),
+        },
+        'scenarios': {name: recorder.summary(name) for name in SCENARIOS},
+    }
+    for name, result in report['scenarios'].items():
+        if result:
+            print(f"{name:<16}{result['requests_per_second']:>9} req/s  p50 {result['latency_ms']['p50']:>7} ms  "
+                  f"p99 {result['latency_ms']['p99']:>7} ms  queries {result['queries']['mean']:>6}  errors {result['errors']}")
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2, sort_keys=True)
+            handle.write('\n')
+    if args.compare:
+        with open(args.compare) as handle:
+            compare(report, json.load(handle))
+
+
+if __name__ == '__main__':
+    main()
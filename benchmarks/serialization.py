@@ -0,0 +1,92 @@
+"""Micro-benchmark of the list serialization paths.
+
+Compares, for feed pages of posts, the DRF path (model instances through PostSerializer,
+rendered by JSONRenderer) with the fast path (values() rows through
+social.fastpath.post_rows, rendered by FastJSONRenderer), and reports rows/sec for both
+at each page size:
+
+    python -m benchmarks.serialization --page-sizes 10 100 --output serialization.json
+
+Each page is read from the database once; only serialization and rendering are timed,
+so the numbers are the CPU cost per row that the queries do not hide. Both paths must
+render the same bytes, otherwise the benchmark stops with an error. The data is the
+synthetic graph of benchmarks.data, in the same database as benchmarks.run.
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+
+from .run import setup
+
+
+def measure(function, rows, min_seconds):
+    # Repeat until min_seconds have passed; returns rows/sec
+    iterations, elapsed = 0, 0.0
+    while elapsed < min_seconds:
+        start = time.perf_counter()
+        function()
+        elapsed += time.perf_counter() - start
+        iterations += 1
+    return round(rows * iterations / elapsed)
+
+
+def run_page(page_size, min_seconds):
+    from rest_framework.renderers import JSONRenderer
+    from social.fastpath import FastJSONRenderer, post_rows
+    from social.models import Post
+    from social.serializers import PostSerializer
+
+    # A page of posts with media variants when the data has some, as in the feed
+    posts = Post.objects.order_by('-timestamp', '-id')
+    instances = list(posts.select_related('user', 'asset')[:page_size])
+    rows = list(post_rows.values(posts)[:page_size])
+    serializer_path = lambda: JSONRenderer().render(PostSerializer(instances, many=True).data)
+    fast_path = lambda: FastJSONRenderer().render(post_rows.many(rows))
+    if serializer_path() != fast_path():
+        raise SystemExit(f"The fast path renders different bytes at page size {page_size}")
+
+    serializer_rate, fast_rate = measure(serializer_path, len(rows), min_seconds), measure(fast_path, len(rows), min_seconds)
+    return {
+        'rows': len(rows),
+        'serializer_rows_per_second': serializer_rate,
+        'fast_rows_per_second': fast_rate,
+        'speedup': round(fast_rate / serializer_rate, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default=os.path.join(tempfile.gettempdir(), 'social-benchmark.sqlite3'),
+                        help='SQLite file used for the benchmark (created with synthetic data if empty).')
+    parser.add_argument('--users', type=int, default=200, help='Number of users generated for a new database.')
+    parser.add_argument('--page-sizes', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--seconds', type=float, default=1.0, help='Minimum time measured per path and page size.')
+    parser.add_argument('--output', help='Write the report to this JSON file.')
+    args = parser.parse_args()
+
+    setup(args.database, reuse=True)
+    from .data import generate, load
+    from social.fastpath import orjson
+    from social.models import Profile
+
+    if not Profile.objects.exists():
+        load(generate(args.users))
+
+    report = {
+        'meta': {'orjson': orjson is not None, 'python': platform.python_version()},
+        'page_sizes': {str(page_size): run_page(page_size, args.seconds) for page_size in args.page_sizes},
+    }
+    for page_size, result in report['page_sizes'].items():
+        print(f"page size {page_size:>4}  serializer {result['serializer_rows_per_second']:>9} rows/s  "
+              f"fast {result['fast_rows_per_second']:>9} rows/s  x{result['speedup']}")
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2, sort_keys=True)
+            handle.write('\n')
+
+
+if __name__ == '__main__':
+    main()
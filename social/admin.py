@@ -1,21 +1,144 @@
+from itertools import groupby
+from operator import itemgetter
+
 from django.contrib import admin
+from django.contrib.admin.views.main import PAGE_VAR
+from django.contrib.auth.models import User
+from django.core.paginator import Paginator
+from django.conf import settings
+from django.db import connection
+from django.utils.functional import cached_property
 from .models import Post, Follow, Profile
+from .signals import follows_removed
 from django.core.exceptions import ValidationError
+from django.db import transaction
+
+# Admin changelists for tables with millions of rows: counts are bounded or estimated
+# from the planner statistics instead of running COUNT(*) over the whole table, users
+# are filtered by a typed username instead of a sidebar listing every username, list
+# rows are joined to their users in the same query, and user fields use raw id inputs
+# instead of a <select> with every user.
+
+
+# Estimated number of rows in the model's table, from the database statistics (None if unavailable)
+def estimate_table_rows(model):
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)", [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute("SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s", [table])
+        elif connection.vendor == 'sqlite':
+            # sqlite_stat1 exists once ANALYZE has run; its stat column starts with the row count
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    return estimate if estimate >= 0 else None  # Postgres reports -1 for tables never analyzed
+
+
+# Paginator counting at most ADMIN_COUNT_LIMIT rows, or up to the requested page if it is further:
+# past that, an unfiltered list uses the table estimate (or the largest primary key) and a filtered
+# one counts one row more than it read, so the next page can be opened and the count shows as "N+"
+class EstimatedCountPaginator(Paginator):
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, page_number=1):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+        self.page_number = page_number
+        self.lower_bound = None  # Rows counted, when the list has more
+
+    @cached_property
+    def count(self):
+        limit = max(getattr(settings, 'ADMIN_COUNT_LIMIT', 10000), self.page_number * self.per_page)
+        bounded = self.object_list.order_by()[:limit + 1].count()  # COUNT over a LIMIT subquery reads at most limit + 1 rows
+        if bounded <= limit:
+            return bounded
+        if self.object_list.query.where:
+            self.lower_bound = limit
+            return bounded
+        estimate = estimate_table_rows(self.object_list.model)
+        if estimate is None:
+            # An index lookup; deleted rows make it an overestimate, at worst leaving the last pages empty
+            estimate = self.object_list.model._default_manager.order_by('-pk').values_list('pk', flat=True).first() or 0
+        return max(estimate, bounded)
+
+
+# Filter by a typed username; subclasses set the title, the parameter name and the user field
+class UsernameFilter(admin.SimpleListFilter):
+    template = 'admin/social/username_filter.html'
+    field = 'user'
+
+    def lookups(self, request, model_admin):
+        return [('', '')]  # Never listed; a non-empty list is what keeps the filter shown
+
+    def queryset(self, request, queryset):
+        if self.value():
+            # Resolve the username first so the foreign key index is used
+            return queryset.filter(**{f'{self.field}_id__in': User.objects.filter(username=self.value()).values('id')})
+        return queryset
+
+    def choices(self, changelist):
+        yield {
+            'parameter_name': self.parameter_name,
+            'value': self.value(),
+            'query_parts': [(name, value) for name, value in changelist.params.items() if name != self.parameter_name],
+            'clear_query_string': changelist.get_query_string(remove=[self.parameter_name]),
+        }
+
+
+class UserFilter(UsernameFilter):
+    title = 'user'
+    parameter_name = 'username'
+
+
+class FollowerFilter(UsernameFilter):
+    title = 'follower'
+    parameter_name = 'follower_username'
+    field = 'follower'
+
+
+class FollowingFilter(UsernameFilter):
+    title = 'following'
+    parameter_name = 'following_username'
+    field = 'following'
+
+
+# Settings shared by the changelists of the large tables
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False  # No second COUNT(*) of the whole table on filtered lists
+    show_facets = admin.ShowFacets.NEVER  # Facets count every filter choice
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        try:
+            page_number = max(int(request.GET.get(PAGE_VAR, 1)), 1)
+        except ValueError:
+            page_number = 1  # The changelist shows the first page too
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, page_number=page_number)
 
 # Admin configuration for the Profile model
 @admin.register(Profile)
-class ProfileAdmin(admin.ModelAdmin):
+class ProfileAdmin(LargeTableAdmin):
     list_display = ('user', 'bio', 'profile_picture')  # Display user, bio, and profile picture
     search_fields = ('user__username', 'bio')  # Enable search by username and bio
-    list_filter = ('user__username',)  # Filter by username
+    list_filter = (UserFilter,)  # Filter by username
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
 
 # Admin configuration for the Post model
 @admin.register(Post)
-class PostAdmin(admin.ModelAdmin):
+class PostAdmin(LargeTableAdmin):
     list_display = ('user', 'content', 'timestamp', 'media', 'media_type')  # Display media URL and type
     search_fields = ('content', 'user__username')  # Enable search by content and username
-    list_filter = ('timestamp', 'media_type')  # Filter by timestamp and media type
-    ordering = ('-timestamp',)  # Order posts by latest timestamp
+    list_filter = (UserFilter, 'timestamp', 'media_type')  # Filter by username, timestamp and media type
+    ordering = ('-timestamp',)  # Order posts by latest timestamp (read from the timestamp index)
+    list_select_related = ('user',)
+    raw_id_fields = ('user', 'asset')
 
     # Override save_model to add logic for post updates
     def save_model(self, request, obj, form, change):
@@ -26,10 +149,12 @@ class PostAdmin(admin.ModelAdmin):
 
 # Admin configuration for the Follow model
 @admin.register(Follow)
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(LargeTableAdmin):
     list_display = ('follower', 'following')  # Display the follower and following users
     search_fields = ('follower__username', 'following__username')  # Search by usernames
-    list_filter = ('follower__username', 'following__username')  # Filter by follower and following usernames
+    list_filter = (FollowerFilter, FollowingFilter)  # Filter by follower and following usernames
+    list_select_related = ('follower', 'following')
+    raw_id_fields = ('follower', 'following')
 
     # Override save_model to prevent users from following themselves
     def save_model(self, request, obj, form, change):
@@ -41,7 +166,22 @@ class FollowAdmin(admin.ModelAdmin):
     actions = ['unfollow_selected_users']
 
     def unfollow_selected_users(self, request, queryset):
-        count = queryset.count()
-        queryset.delete()  # Perform bulk unfollow
+        # Delete in primary key chunks, each in its own transaction together with the side effects
+        # of its follows (as the bulk unfollow endpoint does), so selecting millions of follows
+        # neither loads them all nor holds one long transaction
+        chunk_size = getattr(settings, 'ADMIN_DELETE_CHUNK_SIZE', 1000)
+        queryset = queryset.order_by('pk')
+        count = last_id = 0
+        while True:
+            with transaction.atomic():
+                rows = list(queryset.filter(pk__gt=last_id).select_for_update().values_list('pk', 'follower_id', 'following_id')[:chunk_size])
+                if not rows:
+                    break
+                chunk = Follow.objects.filter(pk__in=[pk for pk, _, _ in rows])
+                chunk._raw_delete(chunk.db)  # No per-row post_delete signals; follows_removed handles the chunk
+                for follower_id, follows in groupby(sorted(rows, key=itemgetter(1)), key=itemgetter(1)):
+                    follows_removed(follower_id, [following_id for _, _, following_id in follows])
+            last_id = rows[-1][0]
+            count += len(rows)
         self.message_user(request, f"Successfully unfollowed {count} users.")
     unfollow_selected_users.short_description = "Unfollow selected users"
@@ -9,3 +9,7 @@ class SocialConfig(AppConfig):
     def ready(self):
         """Import signals to register them when the app is ready."""
         import social.signals  # Ensure that your signals are loaded
+        import social.metrics  # Install the query timer on database connections as they open
+        import social.media  # Register the media background jobs
+        import social.tags  # Register the hashtag background jobs
+        import social.routers  # Register the replica pin cache check
@@ -0,0 +1,190 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from rest_framework.exceptions import AuthenticationFailed, NotFound, Throttled
+from rest_framework.request import Request
+from .models import Follow, Post, Profile
+from .fastpath import FastJSONRenderer, post_rows, profile_rows
+from .timeline import aload_posts, feed_sources, on_read_author_ids
+from .cache import get_cache, page_key
+from .views import FeedPagination, get_user_id
+from .authentication import StatelessJWTAuthentication
+from .realtime import stream_events
+from .throttling import consume_token
+
+# Async versions of the feed, follow and profile endpoints for the ASGI application.
+#
+# They run on the event loop and use the async ORM, so a request waiting on the
+# database does not hold a worker thread. Permission, ownership and throttle checks
+# match the DRF viewsets in social/views.py (the token buckets are shared with them),
+# and lists are built with the same values() fast path and rendered with the same
+# renderer, so both paths return the same bytes.
+
+
+def render(data, status=200):
+    return HttpResponse(FastJSONRenderer().render(data), status=status, content_type='application/json')
+
+
+jwt_authentication = StatelessJWTAuthentication()
+
+
+# Return (the authenticated user, None), or (None, the error response) as the IsAuthenticated check of
+# the DRF viewsets. A bearer token is checked first, like the API's authentication classes, and needs
+# no query; an invalid or revoked one is a 401, without falling back to the session. The views are
+# exempt from CsrfViewMiddleware, which would reject bearer token writes; as with DRF's
+# SessionAuthentication, the CSRF check applies to session-authenticated requests only.
+async def authenticate(request):
+    try:
+        authenticated = jwt_authentication.authenticate(request)
+    except AuthenticationFailed as error:
+        response = render(error.detail if isinstance(error.detail, dict) else {"detail": error.detail}, status=401)
+        response['WWW-Authenticate'] = jwt_authentication.authenticate_header(request)
+        return None, response
+    if authenticated is not None:
+        return authenticated[0], None
+    user = await request.auser()
+    if not user.is_authenticated:
+        return None, render({"detail": "Authentication credentials were not provided."}, status=403)
+    check = CsrfViewMiddleware(lambda request: None)  # Lets safe methods through
+    check.process_request(request)
+    if check.process_view(request, None, (), {}) is not None:
+        return None, render({"detail": "CSRF Failed: the CSRF token is missing or incorrect."}, status=403)
+    return user, None
+
+
+# Return None, or the 429 response of TokenBucketThrottle when the user's bucket for the scope is empty
+def throttle(user, scope):
+    wait = consume_token(scope, f'user:{user.id}')
+    if not wait:
+        return None
+    error = Throttled(wait)
+    response = render({"detail": error.detail}, status=429)
+    response['Retry-After'] = '%d' % error.wait
+    return response
+
+
+def read_json(request):
+    try:
+        return json.loads(request.body or b'{}'), None
+    except ValueError:
+        return None, render({"detail": "JSON parse error."}, status=400)
+
+
+# Home feed (same as PostViewSet.list)
+@csrf_exempt
+@require_http_methods(['GET'])
+async def feed(request):
+    user, error = await authenticate(request)
+    if error:
+        return error
+    error = throttle(user, 'read')
+    if error:
+        return error
+
+    cache = get_cache()
+    key = page_key('feed', user.id, request.build_absolute_uri())
+    data = cache.get(key)
+    if data is None:
+        on_read_ids = [author_id async for author_id in on_read_author_ids(user.id)]
+        rows = post_rows.values(Post.objects.all(), 'updated_at')
+        paginator = FeedPagination()
+        try:
+            page = await paginator.apaginate_sources(feed_sources(user.id, on_read_ids), Request(request),  # For query_params
+                                                     lambda keys: aload_posts(rows, keys))
+        except NotFound as error:
+            return render({"detail": error.detail}, status=404)
+        data = paginator.get_paginated_response(post_rows.many(page)).data
+        cache.set(key, data)
+    return render(data)
+
+
+# Followed usernames, or follow a user (same as FollowViewSet.list and create)
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+async def follows(request):
+    user, error = await authenticate(request)
+    if error:
+        return error
+    error = throttle(user, 'read' if request.method == 'GET' else 'follow')
+    if error:
+        return error
+
+    if request.method == 'GET':
+        usernames = Follow.objects.filter(follower_id=user.id).values_list('following__username', flat=True)
+        return render({"following": [username async for username in usernames]})
+
+    body, error = read_json(request)
+    if error:
+        return error
+    following_user_id, error = get_user_id(body.get('following') if isinstance(body, dict) else None)
+    if error:
+        return render({"error": error}, status=400)
+    if following_user_id == user.id:
+        return render({"error": "You cannot follow yourself."}, status=400)
+    following_user = await User.objects.filter(id=following_user_id).only('id', 'username').afirst()
+    if following_user is None:
+        return render({"error": "User not found."}, status=404)
+
+    follow, created = await Follow.objects.aget_or_create(follower_id=user.id, following_id=following_user.id)
+    if created:
+        return render({"message": f"You are now following {following_user.username}."}, status=201)
+    return render({"message": f"You are already following {following_user.username}."})
+
+
+# Unfollow (same as FollowViewSet.destroy: only the follower can delete a follow)
+@csrf_exempt
+@require_http_methods(['DELETE'])
+async def unfollow(request, pk):
+    user, error = await authenticate(request)
+    if error:
+        return error
+    error = throttle(user, 'follow')
+    if error:
+        return error
+
+    follow = await Follow.objects.filter(id=pk, follower_id=user.id).afirst()
+    if follow is None:
+        return render({"error": "You are not following this user."}, status=404)
+    await follow.adelete()
+    return render({"message": "You have unfollowed the user."}, status=204)
+
+
+# The user's own profile (same as ProfileViewSet.list)
+@csrf_exempt
+@require_http_methods(['GET'])
+async def profiles(request):
+    user, error = await authenticate(request)
+    if error:
+        return error
+    error = throttle(user, 'read')
+    if error:
+        return error
+
+    queryset = profile_rows.values(Profile.objects.filter(user_id=user.id))
+    return render(profile_rows.many([profile async for profile in queryset]))
+
+
+# Server-Sent Events stream of new posts by the users you follow (see social/realtime.py)
+@csrf_exempt
+@require_http_methods(['GET'])
+async def feed_stream(request):
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI each open stream would hold a worker thread (and the async generator would be drained synchronously)
+        return render({"detail": "The event stream is only served by the ASGI application."}, status=501)
+    user, error = await authenticate(request)
+    if error:
+        return error
+    error = throttle(user, 'read')
+    if error:
+        return error
+
+    following_ids = [author_id async for author_id in Follow.objects.filter(follower_id=user.id).values_list('following_id', flat=True)]
+    response = StreamingHttpResponse(stream_events(user.id, following_ids), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the events
+    return response
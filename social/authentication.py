@@ -0,0 +1,82 @@
+import threading
+import time
+
+from django.contrib.auth.models import User
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from .cache import get_cache
+
+# Stateless JWT authentication.
+#
+# Access tokens carry the user id and username, so the request user is built from the
+# token claims (a rest_framework_simplejwt TokenUser) without reading the session or
+# user tables. Revoked tokens are kept in a denylist keyed by their "jti" claim until
+# they expire: in a local dict, which the LRU page cache can never evict, and in the
+# SOCIAL_CACHE backend so that other processes sharing it see the revocation too.
+
+_denylist = {}  # jti -> expiry (Unix time)
+_denylist_lock = threading.Lock()
+
+
+def _denylist_key(jti):
+    return f'jwt-revoked:{jti}'
+
+
+# Deny the given token until it expires
+def revoke_token(token):
+    jti, expires_at = token[api_settings.JTI_CLAIM], token['exp']
+    now = time.time()
+    with _denylist_lock:
+        for expired in [key for key, value in _denylist.items() if value <= now]:
+            del _denylist[expired]  # Expired tokens are rejected anyway
+        _denylist[jti] = expires_at
+    get_cache().set(_denylist_key(jti), True, timeout=max(int(expires_at - now), 1))
+
+
+def is_revoked(token):
+    jti = token.get(api_settings.JTI_CLAIM)
+    if jti in _denylist:
+        return True
+    return get_cache().get(_denylist_key(jti)) is not None
+
+
+def clear_denylist():
+    with _denylist_lock:
+        _denylist.clear()
+
+
+# The Django user for a request user, built from the token claims when the request was authenticated with a JWT
+def get_user_instance(user):
+    if isinstance(user, User):
+        return user
+    return User(id=user.id, username=user.username)  # Unsaved copy, enough to assign foreign keys and serialize
+
+
+# Authentication class for the API: the user comes from the token, the denylist is the only lookup
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        if is_revoked(token):
+            raise InvalidToken({"detail": "Token has been revoked.", "code": "token_revoked"})
+        return token
+
+
+# Token endpoint serializer: adds the claims TokenUser reads to the refresh token (and so to its access tokens)
+class SocialTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['username'] = user.username
+        if user.is_staff:
+            token['is_staff'] = True
+        return token
+
+
+# Refresh endpoint serializer: revoked refresh tokens cannot issue new access tokens
+class DenylistTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        if is_revoked(self.token_class(attrs['refresh'])):
+            raise InvalidToken({"detail": "Token has been revoked.", "code": "token_revoked"})
+        return super().validate(attrs)
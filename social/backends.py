@@ -0,0 +1,29 @@
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# Pluggable backends.
+#
+# The page cache (SOCIAL_CACHE), the throttle buckets (THROTTLE_STORE) and the realtime
+# broker (REALTIME_BROKER) are configured like Django's CACHES entries: a BACKEND dotted
+# path and OPTIONS passed to its constructor, plus TIMEOUT for the cache. Each is created
+# once per process, on first use, and shared by all threads.
+
+_backends = {}  # Setting name -> backend instance
+_lock = threading.Lock()
+
+
+# Return the backend configured by the given setting, creating it on first use
+def load_backend(setting, default):
+    backend = _backends.get(setting)
+    if backend is None:
+        with _lock:
+            backend = _backends.get(setting)
+            if backend is None:
+                config = getattr(settings, setting, {})
+                options = dict(config.get('OPTIONS', {}))
+                if 'TIMEOUT' in config:
+                    options['timeout'] = config['TIMEOUT']
+                backend = _backends[setting] = import_string(config.get('BACKEND', default))(**options)
+    return backend
@@ -0,0 +1,255 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from rest_framework.response import Response
+from .backends import load_backend
+
+# Versioned read-through cache for list endpoints.
+#
+# Pages are stored under keys that embed a per-user version counter, e.g.
+# "page:feed:42:<version>:<request hash>". Signals bump the counter whenever the
+# underlying rows change, so stale pages are never read again and simply age out.
+# The backend is chosen with the SOCIAL_CACHE setting.
+
+MISSING = object()
+CACHED_HEADERS = ('ETag', 'Last-Modified')  # Response headers stored with a cached page
+
+
+# Interface shared by all cache backends
+class BaseCacheBackend:
+    shared = False  # Whether every process of the site reads the same entries
+
+    def __init__(self, timeout=300, **options):
+        self.timeout = timeout  # Default time to live in seconds (None keeps entries until evicted)
+
+    def get(self, key, default=None):
+        raise NotImplementedError
+
+    def set(self, key, value, timeout=MISSING):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def incr(self, key):
+        raise NotImplementedError  # Returns None when the key is missing
+
+    def clear(self):
+        raise NotImplementedError
+
+    def _expires_at(self, timeout):
+        timeout = self.timeout if timeout is MISSING else timeout
+        return None if timeout is None else time.monotonic() + timeout
+
+
+# In-process LRU cache with a bounded number of entries
+class LocMemLRUBackend(BaseCacheBackend):
+    def __init__(self, max_entries=10000, **options):
+        super().__init__(**options)
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)  # Mark as most recently used
+            return value
+
+    def set(self, key, value, timeout=MISSING):
+        with self._lock:
+            self._data[key] = (value, self._expires_at(timeout))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)  # Evict the least recently used entry
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            self._data[key] = (value + 1, expires_at)
+            self._data.move_to_end(key)
+            return value + 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# File-based cache shared by every process on the host (a local stand-in for Redis)
+class FileBackend(BaseCacheBackend):
+    shared = True
+
+    def __init__(self, location=None, **options):
+        super().__init__(**options)
+        self.location = location or os.path.join(tempfile.gettempdir(), 'social_cache')
+        os.makedirs(self.location, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.location, hashlib.sha256(key.encode()).hexdigest())
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), 'rb') as handle:
+                value, expires_at = pickle.load(handle)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return MISSING
+        if expires_at is not None and expires_at <= time.time():
+            self.delete(key)
+            return MISSING
+        return value
+
+    def _write(self, key, value, expires_at):
+        # Write to a temporary file and rename it so readers never see a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=self.location)
+        with os.fdopen(fd, 'wb') as handle:
+            pickle.dump((value, expires_at), handle, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self._path(key))
+
+    def _expires_at(self, timeout):
+        timeout = self.timeout if timeout is MISSING else timeout
+        return None if timeout is None else time.time() + timeout  # Wall clock, shared across processes
+
+    def get(self, key, default=None):
+        value = self._read(key)
+        return default if value is MISSING else value
+
+    def set(self, key, value, timeout=MISSING):
+        self._write(key, value, self._expires_at(timeout))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def incr(self, key):
+        with self._lock:
+            value = self._read(key)
+            if value is MISSING:
+                return None
+            self._write(key, value + 1, None)
+            return value + 1
+
+    def clear(self):
+        for name in os.listdir(self.location):
+            try:
+                os.remove(os.path.join(self.location, name))
+            except FileNotFoundError:
+                pass
+
+
+# Adapter for a Django cache alias, e.g. one configured with django.core.cache.backends.redis.RedisCache
+class DjangoCacheBackend(BaseCacheBackend):
+    def __init__(self, alias='default', **options):
+        super().__init__(**options)
+        self.cache = caches[alias]
+
+    @property
+    def shared(self):
+        return not isinstance(self.cache, (LocMemCache, DummyCache))  # Per process, or storing nothing
+
+    def get(self, key, default=None):
+        return self.cache.get(key, default)
+
+    def set(self, key, value, timeout=MISSING):
+        self.cache.set(key, value, self.timeout if timeout is MISSING else timeout)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def incr(self, key):
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            return None
+
+    def clear(self):
+        self.cache.clear()
+
+
+# Return the configured cache backend, creating it on first use
+def get_cache():
+    return load_backend('SOCIAL_CACHE', 'social.cache.LocMemLRUBackend')
+
+
+def _version_key(kind, user_id):
+    return f'version:{kind}:{user_id}'
+
+
+# Current version of one user's cached pages of the given kind ('feed', 'follows', 'profile')
+def get_version(kind, user_id):
+    cache = get_cache()
+    version = cache.get(_version_key(kind, user_id))
+    if version is None:
+        # Start from a fresh value rather than 0, so a counter that was evicted
+        # can never come back to a version that still has pages cached under it
+        version = time.time_ns()
+        cache.set(_version_key(kind, user_id), version, timeout=None)
+    return version
+
+
+# Invalidate every cached page of the given kind for the given users, once the current transaction
+# commits (right away outside one): bumped earlier, a concurrent request could cache the rows it still
+# reads from before the commit under the new version
+def bump_versions(kind, user_ids):
+    transaction.on_commit(lambda: _bump_versions(kind, user_ids))
+
+
+def _bump_versions(kind, user_ids):
+    cache = get_cache()
+    for user_id in user_ids:
+        if cache.incr(_version_key(kind, user_id)) is None:
+            cache.set(_version_key(kind, user_id), time.time_ns(), timeout=None)
+
+
+def page_key(kind, user_id, url):
+    url_hash = hashlib.sha1(url.encode()).hexdigest()
+    return f'page:{kind}:{user_id}:{get_version(kind, user_id)}:{url_hash}'
+
+
+# Cache key of the requested page and its cached (data, headers), or None
+def get_page(kind, request):
+    key = page_key(kind, request.user.id, request.build_absolute_uri())
+    return key, get_cache().get(key)
+
+
+# Store a 200 response's data with its validators
+def set_page(key, response):
+    if response.status_code == 200:
+        headers = {name: response[name] for name in CACHED_HEADERS if response.has_header(name)}
+        get_cache().set(key, (response.data, headers))
+
+
+# Serve a list response from the cache, building and storing it (with its validators) on a miss
+def cached_response(kind, request, build_response):
+    key, entry = get_page(kind, request)
+    if entry is not None:
+        data, headers = entry
+        return Response(data, headers=headers)
+
+    response = build_response()
+    set_page(key, response)
+    return response
@@ -0,0 +1,78 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework.response import Response
+from .cache import get_page, set_page
+
+# HTTP conditional requests (ETag / Last-Modified) for list endpoints.
+#
+# A page is fingerprinted by a summary of the rows it shows: their ids, their count and
+# the newest updated_at. The ETag is a hash of it, so it changes when a row is added,
+# removed or edited, and Last-Modified is the newest updated_at. The validators are
+# computed from the rows a page is built from and cached with it, so while the page is
+# cached a client sending them back in If-None-Match / If-Modified-Since gets a 304
+# from the cache, without a query. Only when the page is not cached does the view run a
+# probe, which reads the page's keys and one aggregate over its rows instead of the
+# rows themselves, and answers 304 if the summary still matches.
+
+
+# (sorted ids, newest updated_at or None, count) of (id, updated_at) rows, in the format the probes return
+def page_summary(rows):
+    return sorted(row_id for row_id, _ in rows), max((updated_at for _, updated_at in rows), default=None), len(rows)
+
+
+# ETag and Last-Modified (a POSIX timestamp, or None for an empty page) of a page with the given summary
+def page_validators(request, summary):
+    fingerprint = repr((request.user.id, request.get_full_path(), request.META.get('HTTP_ACCEPT', ''), summary))
+    etag = f'W/"{hashlib.sha1(fingerprint.encode()).hexdigest()}"'  # Weak: the same content, not the same bytes
+    last_modified = int(summary[1].timestamp()) if summary[1] is not None else None
+    return etag, last_modified
+
+
+def _set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+
+
+def _finish(response):
+    patch_cache_control(response, private=True, no_cache=True)  # Per user, and always revalidated
+    patch_vary_headers(response, ('Authorization', 'Cookie'))
+    return response
+
+
+# 304 response when the request's validators match, else None
+def _not_modified(request, etag, last_modified):
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        return None
+    _set_validators(response, etag, last_modified)
+    return _finish(response)
+
+
+# Serve a GET through the list cache, answering 304 when the client's validators match the cached
+# page's or, on a cache miss, the probed summary; read_rows returns the (id, updated_at) rows
+# build_response read
+def conditional_response(kind, request, probe, build_response, read_rows):
+    revalidating = 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META
+    key, entry = get_page(kind, request)
+    if entry is not None:
+        data, headers = entry
+        if revalidating and 'ETag' in headers:
+            not_modified = _not_modified(request, headers['ETag'], parse_http_date_safe(headers.get('Last-Modified', '')))
+            if not_modified is not None:
+                return not_modified
+        return _finish(Response(data, headers=headers))
+
+    if revalidating:
+        not_modified = _not_modified(request, *page_validators(request, probe()))
+        if not_modified is not None:
+            return not_modified
+
+    response = build_response()
+    if response.status_code != 200:
+        return response
+    _set_validators(response, *page_validators(request, page_summary(read_rows())))
+    set_page(key, response)
+    return _finish(response)
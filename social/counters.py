@@ -0,0 +1,77 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from .models import Follow, Post, Profile
+from .cache import bump_versions
+
+# Denormalized follower, following and post counters on Profile.
+#
+# The counters are updated in place with F() expressions, so concurrent follows and
+# posts never lose an increment, and can be recomputed with the recount_profiles command.
+
+COUNTER_FIELDS = ('followers_count', 'following_count', 'posts_count')
+
+
+# Add delta to one counter of the given users' profiles
+def change_counter(field, user_ids, delta=1):
+    user_ids = list(user_ids)
+    if not user_ids or not delta:
+        return
+    value = F(field) + delta
+    if delta < 0:
+        value = Greatest(value, Value(0))  # Never go negative, even if the counter had drifted
+    Profile.objects.filter(user_id__in=user_ids).update(**{field: value}, updated_at=timezone.now())  # update() skips auto_now
+    bump_versions('profile', user_ids)
+
+
+def _count_of(model, field):
+    rows = model.objects.filter(**{field: OuterRef('user_id')}).order_by().values(field).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(rows, output_field=IntegerField()), 0)
+
+
+# Annotations with the true value of every counter, computed from the source tables
+def actual_counts():
+    return {
+        'actual_followers_count': _count_of(Follow, 'following'),
+        'actual_following_count': _count_of(Follow, 'follower'),
+        'actual_posts_count': _count_of(Post, 'user'),
+    }
+
+
+# Recompute the counters of profiles (all of them in primary key batches, or the given users') and fix the ones that drifted
+def repair_counters(batch_size=1000, user_ids=None):
+    checked = repaired = 0
+    profiles = Profile.objects.only('id', 'user_id', 'updated_at', *COUNTER_FIELDS).annotate(**actual_counts())
+    for batch in _batches(profiles, batch_size, user_ids):
+        checked += len(batch)
+        drifted = []
+        for profile in batch:
+            changed = False
+            for field in COUNTER_FIELDS:
+                actual = getattr(profile, 'actual_' + field)
+                if getattr(profile, field) != actual:
+                    setattr(profile, field, actual)
+                    changed = True
+            if changed:
+                profile.updated_at = timezone.now()
+                drifted.append(profile)
+        if drifted:
+            Profile.objects.bulk_update(drifted, [*COUNTER_FIELDS, 'updated_at'])
+            bump_versions('profile', [profile.user_id for profile in drifted])
+            repaired += len(drifted)
+    return checked, repaired
+
+
+def _batches(profiles, batch_size, user_ids):
+    if user_ids is not None:
+        user_ids = sorted(user_ids)
+        for start in range(0, len(user_ids), batch_size):
+            yield list(profiles.filter(user_id__in=user_ids[start:start + batch_size]))
+        return
+    last_id = 0
+    while True:
+        batch = list(profiles.filter(id__gt=last_id).order_by('id')[:batch_size])
+        if not batch:
+            return
+        last_id = batch[-1].id
+        yield batch
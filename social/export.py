@@ -0,0 +1,90 @@
+import csv
+
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from .models import Follow, Post, Profile
+
+# Streaming export of users, profiles, posts and follows as NDJSON or CSV.
+#
+# Rows are read with values() projections through .iterator(chunk_size=...), so no
+# model instances are built and only one chunk of rows is held at a time (on Postgres
+# the chunks come from a server-side cursor). Each record is an object with a "type"
+# field; CSV files use the union of all record fields as columns, the unused ones empty.
+# The same format is read back by the import_data command.
+
+RECORD_FIELDS = {
+    'user': ('id', 'username', 'email', 'date_joined'),
+    'profile': ('user', 'bio', 'profile_picture'),
+    'post': ('id', 'user', 'content', 'timestamp', 'media', 'media_type'),
+    'follow': ('follower', 'following'),
+}
+CSV_COLUMNS = ['type'] + list(dict.fromkeys(field for fields in RECORD_FIELDS.values() for field in fields))
+LINES_PER_CHUNK = 500  # Records joined into each piece of the response
+
+
+# Every record of one user's data (their account, profile, posts and follows in both directions), or of all users
+def export_records(user_id=None, chunk_size=2000):
+    querysets = {
+        'user': User.objects.all(),
+        'profile': Profile.objects.all(),
+        'post': Post.objects.all(),
+        'follow': Follow.objects.all(),
+    }
+    if user_id is not None:
+        querysets['user'] = querysets['user'].filter(id=user_id)
+        querysets['profile'] = querysets['profile'].filter(user_id=user_id)
+        querysets['post'] = querysets['post'].filter(user_id=user_id)
+        querysets['follow'] = querysets['follow'].filter(Q(follower_id=user_id) | Q(following_id=user_id))
+
+    for record_type, queryset in querysets.items():
+        rows = queryset.order_by('pk').values(*RECORD_FIELDS[record_type]).iterator(chunk_size=chunk_size)
+        for row in rows:
+            row['type'] = record_type
+            yield row
+
+
+class _Echo:
+    # File-like object for csv.writer that returns the line instead of storing it
+    def write(self, value):
+        return value
+
+
+def _chunked(lines):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= LINES_PER_CHUNK:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def ndjson_lines(records):
+    encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    for record in records:
+        yield encoder.encode(record) + '\n'
+
+
+def csv_lines(records):
+    writer = csv.DictWriter(_Echo(), fieldnames=CSV_COLUMNS, extrasaction='ignore')
+    yield writer.writeheader()
+    for record in records:
+        if 'timestamp' in record:
+            record['timestamp'] = record['timestamp'].isoformat()
+        if 'date_joined' in record:
+            record['date_joined'] = record['date_joined'].isoformat()
+        yield writer.writerow(record)
+
+
+FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+    'csv': (csv_lines, 'text/csv'),
+}
+
+
+# Encoded export in pieces of LINES_PER_CHUNK records, for StreamingHttpResponse or a file
+def export_chunks(output_format, user_id=None, chunk_size=2000):
+    encode, _ = FORMATS[output_format]
+    return _chunked(encode(export_records(user_id, chunk_size=chunk_size)))
@@ -0,0 +1,173 @@
+from functools import cached_property
+from operator import itemgetter
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.fields import BooleanField, CharField, ChoiceField, DateTimeField, IntegerField
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from .media import storage_urls
+from .metrics import timed_serialization
+from .serializers import PostSerializer, ProfileSerializer
+
+try:
+    import orjson
+except ImportError:  # Optional: without it FastJSONRenderer renders with the json module, like JSONRenderer
+    orjson = None
+
+# Read-only fast path for the hot list endpoints (feed, follows, profiles).
+#
+# ModelSerializer builds model instances, looks every field up through its source and
+# calls to_representation per field and row. RowSerializer compiles a serializer's
+# readable fields once into a list of (name, getter) pairs over the columns of a
+# values() query: fields whose representation is the database value itself (integers,
+# strings, booleans, choices) are plain itemgetters, datetimes are formatted as
+# DateTimeField does, other fields still go through the DRF field's to_representation,
+# nested serializers read the joined "relation__field" columns and SerializerMethodFields
+# are given a row counterpart. The output has the same keys, order and values as the
+# serializer's, which the tests check byte for byte.
+#
+# FastJSONRenderer encodes with orjson when it is installed. Its output is identical to
+# JSONRenderer's for the data these views return (no floats: orjson and the json module
+# format them differently); anything orjson cannot encode falls back to JSONRenderer.
+
+PLAIN_FIELDS = (IntegerField, CharField, BooleanField, ChoiceField)  # to_representation returns the column value
+
+
+# The compiled fields are getter factories: called with the current time zone, they return a function of the
+# row. Datetimes are the costliest field to represent (DRF looks the time zone up for every value), so the
+# getters are built once per time zone and a batch of rows looks it up once.
+
+def _plain(column):
+    getter = itemgetter(column)
+    return lambda zone: getter
+
+
+# A column passed through the field's to_representation (None stays None, as in Serializer.to_representation)
+def _converter(column, to_representation):
+    def get(row):
+        value = row[column]
+        return None if value is None else to_representation(value)
+    return lambda zone: get
+
+
+# Same as DateTimeField.to_representation in the ISO 8601 format, converting to the given time zone
+def _datetime(column, field):
+    def factory(zone):
+        def get(row):
+            value = row[column]
+            if value is None:
+                return None
+            if zone is None or timezone.is_naive(value):
+                return field.to_representation(value)
+            value = value.astimezone(zone).isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+        return get
+    return factory
+
+
+def _nested(factories, null_column):
+    def factory(zone):
+        getters = [(name, make(zone)) for name, make in factories]
+
+        def get(row):
+            if null_column is not None and row[null_column] is None:
+                return None
+            return {name: field_getter(row) for name, field_getter in getters}
+        return get
+    return factory
+
+
+def _method(function):
+    return lambda zone: function
+
+
+# (name, getter factory) pairs and values() columns for the readable fields of a serializer whose columns start with prefix
+def _compile(serializer, prefix, methods):
+    factories, columns = [], []
+    for field in serializer._readable_fields:
+        name = field.field_name
+        if name in methods:
+            method_columns, function = methods[name]
+            columns.extend(method_columns)
+            factories.append((name, _method(function)))
+        elif field.source == '*' or isinstance(field, (serializers.ListSerializer, serializers.RelatedField,
+                                                        serializers.FileField, serializers.SerializerMethodField)):
+            raise TypeError(f"{type(serializer).__name__}.{name} ({type(field).__name__}) has no row mapping")
+        elif isinstance(field, serializers.BaseSerializer):
+            relation = prefix + field.source.replace('.', '__')
+            nested_factories, nested_columns = _compile(field, relation + '__', {})
+            null_column = None
+            if serializer.Meta.model._meta.get_field(field.source).null:
+                null_column = relation + '__pk'  # Null only when there is no related row
+                nested_columns.append(null_column)
+            columns.extend(nested_columns)
+            factories.append((name, _nested(nested_factories, null_column)))
+        else:
+            column = prefix + field.source.replace('.', '__')
+            columns.append(column)
+            if isinstance(field, PLAIN_FIELDS):
+                factories.append((name, _plain(column)))
+            elif (isinstance(field, DateTimeField) and not hasattr(field, 'timezone')
+                  and getattr(field, 'format', api_settings.DATETIME_FORMAT) == ISO_8601):
+                factories.append((name, _datetime(column, field)))
+            else:
+                factories.append((name, _converter(column, field.to_representation)))
+    return factories, columns
+
+
+# Representation of a serializer built from values() rows; methods maps SerializerMethodField names
+# to (columns, function of the row)
+class RowSerializer:
+    def __init__(self, serializer_class, methods=None):
+        self.serializer_class = serializer_class
+        self.methods = methods or {}
+        self._getters = {}  # Time zone -> (name, getter) pairs
+
+    @cached_property
+    def _compiled(self):
+        return _compile(self.serializer_class(), '', self.methods)  # Once, on first use (the fields need the app registry)
+
+    @property
+    def columns(self):
+        return self._compiled[1]
+
+    # The queryset's rows as dicts holding the columns of the representation, plus the extra ones
+    def values(self, queryset, *extra):
+        return queryset.values(*dict.fromkeys([*self.columns, *extra]))
+
+    def many(self, rows):
+        return timed_serialization(self._many, rows)
+
+    def _many(self, rows):
+        zone = timezone.get_current_timezone() if settings.USE_TZ else None  # DateTimeField's default time zone
+        getters = self._getters.get(zone)
+        if getters is None:
+            getters = self._getters[zone] = [(name, make(zone)) for name, make in self._compiled[0]]
+        return [{name: get(row) for name, get in getters} for row in rows]
+
+
+# Same as PostSerializer.get_variants
+def _post_variants(row):
+    return storage_urls(row['asset__variants']) if row['asset_id'] else None
+
+
+post_rows = RowSerializer(PostSerializer, methods={'variants': (('asset_id', 'asset__variants'), _post_variants)})
+profile_rows = RowSerializer(ProfileSerializer)
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            # Dates, times and dataclasses go through DRF's encoder, which formats them differently from orjson
+            ret = orjson.dumps(data, default=self.encoder_class().default,
+                               option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)  # e.g. integers over 64 bits, non-string keys
+        # JSONRenderer escapes these two line terminators, which are not valid inside JavaScript strings
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
@@ -0,0 +1,99 @@
+import heapq
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from .cache import get_version
+from .models import Follow
+
+# In-memory follow graph.
+#
+# The ids each user follows are kept as a sorted array of 64-bit ints (8 bytes per edge),
+# loaded from the Follow table the first time they are needed and patched in place by
+# the follow signals afterwards. Each adjacency array is tagged with the user's 'follows'
+# cache version, which every follow change bumps, so a process that missed a change
+# (another worker wrote it) reloads that user on the next read instead of serving stale
+# edges. At most GRAPH_MAX_USERS arrays are kept, least recently used first out.
+
+
+def _contains(ids, value):
+    index = bisect_left(ids, value)
+    return index < len(ids) and ids[index] == value
+
+
+class FollowGraph:
+    def __init__(self):
+        self._following = OrderedDict()  # user id -> (version, sorted array of followed ids)
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._following.clear()
+
+    def _store(self, user_id, version, ids):
+        self._following[user_id] = (version, ids)
+        self._following.move_to_end(user_id)
+        while len(self._following) > getattr(settings, 'GRAPH_MAX_USERS', 100000):
+            self._following.popitem(last=False)
+
+    # Sorted arrays of the ids followed by each of the given users, loading the missing ones in one query
+    def following_many(self, user_ids):
+        versions = {user_id: get_version('follows', user_id) for user_id in user_ids}
+        result, missing = {}, []
+        with self._lock:
+            for user_id, version in versions.items():
+                entry = self._following.get(user_id)
+                if entry is not None and entry[0] == version:
+                    self._following.move_to_end(user_id)
+                    result[user_id] = entry[1]
+                else:
+                    missing.append(user_id)
+        if missing:
+            loaded = {user_id: array('q') for user_id in missing}
+            rows = Follow.objects.filter(follower_id__in=missing).order_by('follower_id', 'following_id')
+            for follower_id, following_id in rows.values_list('follower_id', 'following_id').iterator():
+                loaded[follower_id].append(following_id)
+            with self._lock:
+                for user_id, ids in loaded.items():
+                    self._store(user_id, versions[user_id], ids)
+            result.update(loaded)
+        return result
+
+    def following(self, user_id):
+        return self.following_many([user_id])[user_id]
+
+    def follows(self, follower_id, following_id):
+        return _contains(self.following(follower_id), following_id)
+
+    # Follow relation between two users in both directions
+    def relation(self, user_id, other_id):
+        adjacency = self.following_many([user_id, other_id])
+        following = _contains(adjacency[user_id], other_id)
+        followed_by = _contains(adjacency[other_id], user_id)
+        return {"following": following, "followed_by": followed_by, "mutual": following and followed_by}
+
+    # Second-degree connections ranked by the number of followed users who follow them, as (user id, count)
+    def suggestions(self, user_id, limit=10):
+        followed = self.following(user_id)
+        sources = followed[:getattr(settings, 'GRAPH_SUGGESTION_SOURCES', 500)]  # Bounds the work for users following many
+        counts = Counter()
+        for ids in self.following_many(list(sources)).values():
+            counts.update(ids)
+        candidates = ((count, candidate) for candidate, count in counts.items()
+                      if candidate != user_id and not _contains(followed, candidate))
+        return [(candidate, count) for count, candidate in heapq.nsmallest(limit, candidates, key=lambda item: (-item[0], item[1]))]
+
+    # Apply a follow change made by this process, after its 'follows' version was bumped
+    def update(self, follower_id, added=(), removed=()):
+        version = get_version('follows', follower_id)
+        with self._lock:
+            entry = self._following.pop(follower_id, None)
+            if entry is None or entry[0] + 1 != version:
+                return  # Not loaded, or another change happened in between: it will be read fresh
+            ids = sorted(set(entry[1]).union(added).difference(removed))
+            self._store(follower_id, version, array('q', ids))
+
+
+graph = FollowGraph()
@@ -0,0 +1,239 @@
+import csv
+import json
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from . import search, tags
+from .cache import bump_versions
+from .models import Follow, Post, Profile, SearchEntry
+
+# Bulk import of the records written by social.export (NDJSON or CSV).
+#
+# Records are buffered per type and written in batches, one transaction per batch. Users,
+# profiles and follows use bulk_create. Posts, by far the largest table, use a plain
+# multi-row INSERT: it skips the ORM's per-field work, which is most of the cost, writes
+# a batch in as few statements as the database's parameter limit allows, and keeps the
+# timestamps from the file instead of applying auto_now_add. No signals are
+# sent, so each user's profile is created in the same batch as the user, new posts are
+# indexed for search in one statement and for hashtags in batches at the end, and counters and timelines are rebuilt
+# by the import_data command, for the users the import touched only. Ids in the file are
+# source ids: users are mapped to their new ids in memory (existing usernames map to the
+# existing users).
+
+
+# Read records from an NDJSON or CSV file, one at a time
+def read_records(handle, file_format):
+    if file_format == 'ndjson':
+        for line in handle:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        for row in csv.DictReader(handle):
+            yield {field: value for field, value in row.items() if value != ''}  # Empty CSV cells are missing fields
+
+
+class Importer:
+    def __init__(self, batch_size=5000, progress=None, progress_every=100000):
+        self.batch_size = batch_size
+        self.progress = progress  # Called with a progress line every `progress_every` records
+        self.progress_every = progress_every
+        self.user_ids = {}  # Source user id -> id in the database
+        self.pending = {'user': [], 'profile': [], 'post': [], 'follow': []}
+        self.pending_users = {}  # Source id -> buffered User, for profiles that arrive before their user is written
+        self.pending_profiles = {}  # Source user id -> buffered profile fields
+        self.counts = {'user': 0, 'profile': 0, 'post': 0, 'follow': 0, 'skipped': 0}
+        self.followers = set()  # Users whose follows changed, to invalidate their cached pages
+        self.followed = set()
+        self.authors = set()  # Users who got posts
+        self.created_users = set()
+        self.password = make_password(None)  # Imported users cannot log in until they reset their password
+        self.started = time.monotonic()
+        self.read = 0
+        self.timestamp_field = Post._meta.get_field('timestamp')
+        self.post_fields = [Post._meta.get_field(name) for name in ('user', 'content', 'timestamp', 'updated_at', 'media', 'media_type')]
+        self.post_sql = 'INSERT INTO {} ({}) '.format(
+            connection.ops.quote_name(Post._meta.db_table),
+            ', '.join(connection.ops.quote_name(field.column) for field in self.post_fields),
+        )
+
+    def run(self, records):
+        last_post_id = Post.objects.aggregate(last=Max('id'))['last'] or 0
+        for record in records:
+            self.add(record)
+        self.flush()
+        self.index_posts(last_post_id)
+        self.index_tags(last_post_id)
+        bump_versions('follows', self.followers)
+        return self.counts
+
+    def add(self, record):
+        record_type = record.get('type')
+        if record_type not in self.pending:
+            self.counts['skipped'] += 1
+            return
+        getattr(self, f'_add_{record_type}')(record)
+        if len(self.pending[record_type]) >= self.batch_size:
+            self.flush(record_type)
+        self.read += 1
+        if self.progress and self.read % self.progress_every == 0:
+            self.progress(self.report())
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        return f"{self.read} records in {elapsed:.1f}s ({self.read / elapsed if elapsed else 0:.0f}/s)"
+
+    def _user_id(self, source_id):
+        source_id = int(source_id)
+        if source_id in self.pending_users:
+            self.flush('user')  # The user is still buffered: write it first
+        return self.user_ids.get(source_id)
+
+    def _add_user(self, record):
+        user = User(username=record['username'], email=record.get('email') or '', password=self.password)
+        if record.get('date_joined'):
+            user.date_joined = parse_datetime(record['date_joined'])
+        self.pending['user'].append((int(record['id']), user))
+        self.pending_users[int(record['id'])] = user
+
+    def _add_profile(self, record):
+        source_id = int(record['user'])
+        fields = {'bio': record.get('bio'), 'profile_picture': record.get('profile_picture')}
+        if source_id in self.pending_users:
+            self.pending_profiles[source_id] = fields  # Created together with the user
+            return
+        user_id = self.user_ids.get(source_id)
+        if user_id is None:
+            self.counts['skipped'] += 1
+            return
+        self.pending['profile'].append(Profile(user_id=user_id, **fields))
+
+    def _add_post(self, record):
+        user_id = self._user_id(record['user'])
+        if user_id is None:
+            self.counts['skipped'] += 1
+            return
+        timestamp = self.timestamp_field.get_db_prep_save(parse_datetime(record['timestamp']), connection)
+        self.pending['post'].append((user_id, record.get('content', ''), timestamp, timestamp, record.get('media'), record.get('media_type')))
+        self.authors.add(user_id)
+
+    def _add_follow(self, record):
+        follower_id, following_id = self._user_id(record['follower']), self._user_id(record['following'])
+        if follower_id is None or following_id is None or follower_id == following_id:
+            self.counts['skipped'] += 1
+            return
+        self.pending['follow'].append(Follow(follower_id=follower_id, following_id=following_id))
+        self.followers.add(follower_id)
+        self.followed.add(following_id)
+
+    def flush(self, record_type=None):
+        # Users first: the other records refer to them
+        for name in ['user', 'profile', 'post', 'follow'] if record_type is None else [record_type]:
+            if self.pending[name]:
+                with transaction.atomic():
+                    getattr(self, f'_write_{name}s')(self.pending[name])
+                self.pending[name] = []
+
+    def _write_users(self, pending):
+        existing = dict(User.objects.filter(username__in=[user.username for _, user in pending]).values_list('username', 'id'))
+        new, created = [], {}
+        for source_id, user in pending:
+            if user.username not in existing and user.username not in created:
+                new.append((source_id, user))
+                created[user.username] = user
+        User.objects.bulk_create([user for _, user in new], batch_size=self.batch_size)
+        # bulk_create only sets the primary keys on some databases (not MySQL): read them back by username
+        created_ids = dict(User.objects.filter(username__in=list(created)).values_list('username', 'id'))
+        for user in created.values():
+            user.id = created_ids[user.username]
+        self.created_users.update(created_ids.values())
+        for source_id, user in pending:
+            self.user_ids[source_id] = existing[user.username] if user.username in existing else created[user.username].id
+
+        # What the post_save signal does for single users, with the profile record when it was already read
+        profiles = [Profile(user=user, **self.pending_profiles.get(source_id, {})) for source_id, user in new]
+        Profile.objects.bulk_create(profiles, batch_size=self.batch_size)
+        profile_ids = dict(Profile.objects.filter(user_id__in=created_ids.values()).values_list('user_id', 'id'))  # As for users
+        for profile in profiles:
+            profile.id = profile_ids[profile.user_id]
+        search.index_objects('profile', profiles, search.profile_text)
+        self.counts['user'] += len(new)
+        self.counts['profile'] += sum(source_id in self.pending_profiles for source_id, _ in new)
+        for source_id, user in pending:
+            if user.username in existing and source_id in self.pending_profiles:
+                # Existing user: its profile is updated with the next profile batch
+                self.pending['profile'].append(Profile(user_id=existing[user.username], **self.pending_profiles[source_id]))
+        self.counts['skipped'] += len(pending) - len(new)
+        self.pending_users.clear()
+        self.pending_profiles.clear()
+
+    def _write_profiles(self, pending):
+        # Profiles of users that already existed: update them in place
+        profile_ids = dict(Profile.objects.filter(user_id__in=[profile.user_id for profile in pending]).values_list('user_id', 'id'))
+        updates, now = [], timezone.now()
+        for profile in pending:
+            if profile.user_id in profile_ids:
+                profile.id, profile.updated_at = profile_ids[profile.user_id], now
+                updates.append(profile)
+        Profile.objects.bulk_update(updates, ['bio', 'profile_picture', 'updated_at'], batch_size=self.batch_size)
+        profiles = Profile.objects.filter(id__in=[profile.id for profile in updates]).select_related('user').only('id', 'bio', 'user__username')
+        search.index_objects('profile', profiles, search.profile_text)
+        bump_versions('profile', [profile.user_id for profile in updates])
+        self.counts['profile'] += len(updates)
+        self.counts['skipped'] += len(pending) - len(updates)
+
+    def _write_posts(self, pending):
+        chunk_size = max(1, min(self.batch_size, connection.ops.bulk_batch_size(self.post_fields, pending)))
+        with connection.cursor() as cursor:
+            for start in range(0, len(pending), chunk_size):
+                rows = pending[start:start + chunk_size]
+                values = connection.ops.bulk_insert_sql(self.post_fields, [['%s'] * len(self.post_fields)] * len(rows))
+                cursor.execute(self.post_sql + values, [value for row in rows for value in row])
+        self.counts['post'] += len(pending)
+
+    # Add the posts written since the import started to the search index, in one INSERT ... SELECT
+    def index_posts(self, last_post_id):
+        qn = connection.ops.quote_name
+        post_table, entry_table = qn(Post._meta.db_table), qn(SearchEntry._meta.db_table)
+        with transaction.atomic(), connection.cursor() as cursor:
+            # The body is the post content, as in search.post_text
+            cursor.execute(
+                f"INSERT INTO {entry_table} (kind, object_id, body) SELECT 'post', p.id, p.content FROM {post_table} p "
+                f"WHERE p.id > %s AND NOT EXISTS (SELECT 1 FROM {entry_table} e WHERE e.kind = 'post' AND e.object_id = p.id)",
+                [last_post_id],
+            )
+
+    # Index the hashtags of the posts written since the import started, one batch of posts at a time
+    def index_tags(self, last_post_id):
+        while True:
+            rows = list(Post.objects.filter(id__gt=last_post_id).order_by('id').values_list('id', 'content', 'timestamp')[:self.batch_size])
+            if not rows:
+                break
+            tags.index_tags(rows)
+            last_post_id = rows[-1][0]
+
+    # Users whose profile counters the import may have changed
+    def counter_users(self):
+        return self.created_users | self.authors | self.followers | self.followed
+
+    # Users whose timelines miss imported follows or posts: the importing followers, and the followers of the authors
+    def timeline_owners(self):
+        owners = set(self.followers)
+        authors = sorted(self.authors)
+        for start in range(0, len(authors), self.batch_size):
+            followers = Follow.objects.filter(following_id__in=authors[start:start + self.batch_size]).values_list('follower_id', flat=True)
+            owners.update(followers.distinct())
+        return owners
+
+    def _write_follows(self, pending):
+        # Follows that already exist are skipped by the INSERT: count the rows it added (in this batch's transaction)
+        follows = Follow.objects.filter(follower_id__in={follow.follower_id for follow in pending})
+        before = follows.count()
+        Follow.objects.bulk_create(pending, batch_size=self.batch_size, ignore_conflicts=True)
+        inserted = follows.count() - before
+        self.counts['follow'] += inserted
+        self.counts['skipped'] += len(pending) - inserted
@@ -0,0 +1,29 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from social.export import FORMATS, export_chunks
+
+
+class Command(BaseCommand):
+    help = "Stream users, profiles, posts and follows to NDJSON or CSV, for one user or the whole site."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Username whose data is exported (default: every user).')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='ndjson', help='Output format.')
+        parser.add_argument('--output', help='File to write (default: standard output).')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Number of rows read per database fetch.')
+
+    def handle(self, *args, **options):
+        user_id = None
+        if options['user']:
+            user_id = User.objects.filter(username=options['user']).values_list('id', flat=True).first()
+            if user_id is None:
+                raise CommandError(f"User '{options['user']}' does not exist.")
+
+        chunks = export_chunks(options['format'], user_id=user_id, chunk_size=options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(chunks)
+            self.stderr.write(self.style.SUCCESS(f"Exported to {options['output']}."))
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
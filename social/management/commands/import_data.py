@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from social.counters import repair_counters
+from social.importer import Importer, read_records
+from social.timeline import rebuild_timelines
+
+
+class Command(BaseCommand):
+    help = "Import users, profiles, posts and follows from an NDJSON or CSV file written by export_data."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import.')
+        parser.add_argument('--format', choices=['ndjson', 'csv'], help='File format (default: from the file extension).')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of rows written per INSERT.')
+        parser.add_argument('--skip-derived', action='store_true',
+                            help='Do not recompute the profile counters and timelines of the imported users after the import.')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or ('csv' if options['path'].endswith('.csv') else 'ndjson')
+        importer = Importer(batch_size=options['batch_size'], progress=self.stdout.write)
+        try:
+            with open(options['path'], encoding='utf-8', newline='') as handle:
+                counts = importer.run(read_records(handle, file_format))
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError(f"Import failed after {importer.read} records: {error!r}")
+        self.stdout.write(f"Imported {counts['user']} users, {counts['profile']} profiles, {counts['post']} posts "
+                          f"and {counts['follow']} follows; skipped {counts['skipped']} records.")
+        self.stdout.write(importer.report())
+
+        if not options['skip_derived']:
+            started = time.monotonic()
+            checked, repaired = repair_counters(batch_size=options['batch_size'], user_ids=importer.counter_users())
+            follows = rebuild_timelines(batch_size=options['batch_size'], owner_ids=importer.timeline_owners(),
+                                        author_ids=importer.followed | importer.authors)
+            self.stdout.write(f"Repaired {repaired} of {checked} profile counters and rebuilt timelines for "
+                              f"{follows} follows in {time.monotonic() - started:.1f}s.")
+        self.stdout.write(self.style.SUCCESS("Import complete."))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from social import search
+from social.models import Post, Profile, SearchEntry
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of posts and profiles."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows indexed per query.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        SearchEntry.objects.all().delete()
+        sources = [
+            ('post', Post.objects.only('id', 'content'), search.post_text),
+            ('profile', Profile.objects.select_related('user').only('id', 'bio', 'user__username'), search.profile_text),
+        ]
+        for kind, queryset, get_text in sources:
+            indexed = 0
+            batch = []
+            for obj in queryset.iterator(chunk_size=batch_size):
+                batch.append(obj)
+                if len(batch) == batch_size:
+                    search.index_objects(kind, batch, get_text)
+                    indexed += len(batch)
+                    batch = []
+            search.index_objects(kind, batch, get_text)
+            indexed += len(batch)
+            self.stdout.write(f"Indexed {indexed} {kind} entries.")
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt."))
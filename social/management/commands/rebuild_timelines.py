@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from social.timeline import rebuild_timelines
+
+
+class Command(BaseCommand):
+    help = "Rebuild every user's materialized home timeline from the Follow table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of follows read per query.')
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_timelines(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt timelines for {rebuilt} follow relationships."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from social.counters import repair_counters
+
+
+class Command(BaseCommand):
+    help = "Recompute the follower, following and post counters of every profile and repair drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of profiles checked per query.')
+
+    def handle(self, *args, **options):
+        checked, repaired = repair_counters(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} profiles, repaired {repaired}."))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from social.tasks import run_worker
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (timeline fan-out, search indexing, image variants, ...)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help='Number of worker threads.')
+        parser.add_argument('--batch-size', type=int, default=100, help='Maximum number of jobs of the same kind run together.')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty instead of waiting for jobs.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Running background jobs with {options['threads']} threads.")
+        run_worker(threads=options['threads'], batch_size=options['batch_size'],
+                   poll_interval=options['poll_interval'], once=options['once'])
+        self.stdout.write(self.style.SUCCESS("Worker stopped."))
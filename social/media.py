@@ -0,0 +1,183 @@
+import hashlib
+import logging
+import mimetypes
+import os
+
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+from .models import MediaAsset, Post
+from .signals import posts_changed
+from .tasks import enqueue, task
+
+# Media ingestion.
+#
+# Uploads are streamed to a temporary file while their SHA-256 digest is computed, then
+# moved to "originals/<aa>/<digest><ext>" under MEDIA_ROOT. A file whose digest is
+# already known is not stored again: the existing MediaAsset is returned. Resized JPEG
+# variants of images are generated by a background job (see social.tasks), so the
+# upload request only pays for the copy.
+
+logger = logging.getLogger(__name__)
+
+MEDIA_VARIANTS = {'thumbnail': 150, 'small': 480, 'medium': 1080}  # Name -> longest side in pixels
+
+
+# Upload handler that hashes the file as it is written to disk, chunk by chunk
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > getattr(settings, 'MEDIA_MAX_UPLOAD_SIZE', 50 * 1024 * 1024):
+            raise SkipFile()  # Stop writing it; the view reports the missing file
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        upload = super().file_complete(file_size)
+        upload.sha256 = self.sha256.hexdigest()
+        return upload
+
+
+# (media type, content type) of an audio or video file from the signature of its container, or None
+def sniff_container(header):
+    if header[4:8] == b'ftyp':  # ISO base media (MP4, QuickTime, 3GP, M4A)
+        brand = header[8:12]
+        if brand in (b'M4A ', b'M4B ', b'M4P '):
+            return 'audio', 'audio/mp4'
+        if brand == b'qt  ':
+            return 'video', 'video/quicktime'
+        if brand.startswith(b'3g'):
+            return 'video', 'video/3gpp'
+        return 'video', 'video/mp4'
+    if header.startswith(b'\x1a\x45\xdf\xa3'):  # EBML (Matroska, WebM)
+        return 'video', 'video/webm' if b'webm' in header else 'video/x-matroska'
+    if header.startswith(b'RIFF'):
+        return {b'WAVE': ('audio', 'audio/wav'), b'AVI ': ('video', 'video/x-msvideo')}.get(header[8:12])
+    if header.startswith(b'OggS'):
+        return ('video', 'video/ogg') if b'theora' in header else ('audio', 'audio/ogg')
+    if header.startswith(b'ID3') or header[:2] in (b'\xff\xfb', b'\xff\xf3', b'\xff\xf2'):  # MP3, tagged or not
+        return 'audio', 'audio/mpeg'
+    if header.startswith(b'fLaC'):
+        return 'audio', 'audio/flac'
+    if header.startswith(b'\x00\x00\x01\xba'):  # MPEG program stream
+        return 'video', 'video/mpeg'
+    return None
+
+
+# Detect the media type of a stored file from its content: images are recognized by Pillow,
+# audio and video by their container signature; the client's content type is not trusted
+def inspect_file(path, content_type):
+    try:
+        with Image.open(path) as image:
+            image.verify()  # Reads the headers only
+            return 'image', Image.MIME.get(image.format, content_type), image.size
+    except (OSError, SyntaxError, Image.DecompressionBombError):
+        pass
+    with open(path, 'rb') as handle:
+        detected = sniff_container(handle.read(64))
+    if detected is None:
+        return None, content_type or 'application/octet-stream', (None, None)
+    return (*detected, (None, None))
+
+
+# Guess the media type of an external media URL from its extension
+def guess_media_type(url):
+    content_type, _ = mimetypes.guess_type(url or '')
+    media_type = content_type and content_type.split('/')[0]
+    return media_type if media_type in ('image', 'video', 'audio') else None
+
+
+def original_path(sha256, extension):
+    return f'originals/{sha256[:2]}/{sha256}{extension}'
+
+
+def variant_path(sha256, name):
+    return f'variants/{sha256[:2]}/{sha256}/{name}.jpg'
+
+
+# Store an upload received by HashingUploadHandler, returning (asset, created) or raising ValueError
+def store_upload(upload, user_id=None):
+    existing = MediaAsset.objects.filter(sha256=upload.sha256).first()
+    if existing is not None:
+        return existing, False  # Same content already stored: the temporary file is discarded
+
+    media_type, content_type, (width, height) = inspect_file(upload.temporary_file_path(), upload.content_type)
+    if media_type is None:
+        raise ValueError("Only image, video and audio files can be uploaded.")
+
+    extension = mimetypes.guess_extension(content_type) or os.path.splitext(upload.name)[1].lower()[:10]
+    path = original_path(upload.sha256, extension)
+    destination = default_storage.path(path)
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    file_move_safe(upload.temporary_file_path(), destination, allow_overwrite=True)  # Same digest, same bytes
+
+    try:
+        with transaction.atomic():
+            asset = MediaAsset.objects.create(
+                sha256=upload.sha256, media_type=media_type, content_type=content_type, size=upload.size,
+                width=width, height=height, variants={'original': path},
+                status='processing' if media_type == 'image' else 'ready', uploaded_by_id=user_id,
+            )
+            if media_type == 'image':
+                enqueue('media.variants', {'asset_id': asset.id})  # Queued with the asset, so it cannot be lost
+    except IntegrityError:
+        return MediaAsset.objects.get(sha256=upload.sha256), False  # Stored concurrently by another request
+    return asset, True
+
+
+# Storage paths of an asset's variants, as URLs
+def variant_urls(asset):
+    if asset is None:
+        return None
+    return storage_urls(asset.variants)
+
+
+# Variant name -> URL, from MediaAsset.variants (variant name -> storage path)
+def storage_urls(variants):
+    return {name: default_storage.url(path) for name, path in variants.items()}
+
+
+@task('media.variants')
+def generate_variants_task(payloads):
+    for payload in payloads:
+        generate_variants(payload['asset_id'])
+
+
+def generate_variants(asset_id):
+    asset = MediaAsset.objects.get(id=asset_id)
+    variants, status = dict(asset.variants), 'ready'
+    try:
+        with Image.open(default_storage.path(asset.variants['original'])) as image:
+            largest = max(MEDIA_VARIANTS.values())
+            image.draft('RGB', (largest, largest))  # Let JPEG decoding downscale, when the original is a JPEG
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            for name, size in MEDIA_VARIANTS.items():
+                if max(image.size) <= size and name != 'thumbnail':
+                    continue  # Never upscale; the original serves that size
+                variant = image.copy()
+                variant.thumbnail((size, size))
+                path = variant_path(asset.sha256, name)
+                destination = default_storage.path(path)
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                variant.save(destination, 'JPEG', quality=85, optimize=True)
+                variants[name] = path
+    except (OSError, Image.DecompressionBombError):
+        logger.exception("Could not read media asset %s", asset_id)
+        status = 'failed'
+
+    MediaAsset.objects.filter(id=asset_id).update(variants=variants, status=status)
+    Post.objects.filter(asset_id=asset_id).update(updated_at=timezone.now())  # The posts' variant URLs changed
+    # Cached feed pages embed the variant URLs
+    for author_id in Post.objects.filter(asset_id=asset_id).values_list('user_id', flat=True).distinct():
+        posts_changed(author_id)
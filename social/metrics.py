@@ -0,0 +1,225 @@
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Per-route request metrics, exported in the Prometheus text format at /metrics.
+#
+# MetricsMiddleware times every request and names it after the view that served it,
+# e.g. "PostViewSet.list". Database queries are counted and timed by an execute
+# wrapper installed on every connection, and serializer time by TimedSerializerMixin
+# (or timed_serialization for the values() fast path); both record into the
+# RequestMetrics of the current request (a context variable, so queries run by the
+# async ORM in worker threads are attributed correctly).
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Seconds
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)  # Queries per request
+
+slow_request_logger = logging.getLogger('social.slow_requests')
+
+
+# Measurements of the request being served
+class RequestMetrics:
+    def __init__(self, max_sql):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0  # Only the outermost serializer call is timed
+        self.max_sql = max_sql
+        self.sql = []  # First max_sql statements with their duration, for the slow request log
+
+    def record_query(self, sql, duration):
+        self.queries += 1
+        self.db_time += duration
+        if len(self.sql) < self.max_sql:
+            self.sql.append((round(duration * 1000, 2), sql))
+
+
+_current = ContextVar('request_metrics', default=None)
+
+
+def start_request():
+    return _current.set(RequestMetrics(getattr(settings, 'METRICS_SLOW_REQUEST_MAX_SQL', 50)))
+
+
+def finish_request(token):
+    metrics = _current.get()
+    _current.reset(token)
+    return metrics
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.record_query(sql, time.perf_counter() - start)
+
+
+# Time the queries of every database connection as soon as it is opened
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+# Mixin for serializers: adds the time spent in to_representation to the request's serializer time
+class TimedSerializerMixin:
+    def to_representation(self, instance):
+        metrics = _current.get()
+        if metrics is None or metrics.serializer_depth:
+            return super().to_representation(instance)
+        metrics.serializer_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            metrics.serializer_time += time.perf_counter() - start
+            metrics.serializer_depth -= 1
+
+
+# Same as TimedSerializerMixin for representations built without a DRF serializer (social.fastpath)
+def timed_serialization(function, *args):
+    metrics = _current.get()
+    if metrics is None or metrics.serializer_depth:
+        return function(*args)
+    start = time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        metrics.serializer_time += time.perf_counter() - start
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.total += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+# Metrics of one route, accumulated since the process started
+class RouteStats:
+    def __init__(self):
+        self.responses = {}  # (method, status) -> count
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+
+
+class Registry:
+    def __init__(self):
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def record(self, route, method, status, duration, metrics):
+        with self.lock:
+            stats = self.routes.setdefault(route, RouteStats())
+            stats.responses[(method, status)] = stats.responses.get((method, status), 0) + 1
+            stats.duration.observe(duration)
+            stats.queries.observe(metrics.queries)
+            stats.db_time += metrics.db_time
+            stats.serializer_time += metrics.serializer_time
+
+    def clear(self):
+        with self.lock:
+            self.routes.clear()
+
+    def render(self):
+        lines = []
+        with self.lock:
+            routes = sorted(self.routes.items())
+
+            lines += ['# HELP social_http_requests_total Requests served, by route, method and status.',
+                      '# TYPE social_http_requests_total counter']
+            for route, stats in routes:
+                for (method, status), count in sorted(stats.responses.items()):
+                    lines.append(f'social_http_requests_total{_labels(route=route, method=method, status=status)} {count}')
+
+            lines += _histogram_lines('social_http_request_duration_seconds', 'Request latency in seconds.',
+                                      [(route, stats.duration) for route, stats in routes])
+            lines += _histogram_lines('social_db_queries_per_request', 'Database queries run by each request.',
+                                      [(route, stats.queries) for route, stats in routes])
+
+            for name, help_text, attribute in [
+                ('social_db_query_seconds_total', 'Time spent in database queries.', 'db_time'),
+                ('social_serializer_seconds_total', 'Time spent serializing responses.', 'serializer_time'),
+            ]:
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                for route, stats in routes:
+                    lines.append(f'{name}{_labels(route=route)} {_number(getattr(stats, attribute))}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _histogram_lines(name, help_text, histograms):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for route, histogram in histograms:
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            lines.append(f'{name}_bucket{_labels(route=route, le=_number(bound))} {count}')
+        lines.append(f'{name}_bucket{_labels(route=route, le="+Inf")} {histogram.total}')
+        lines.append(f'{name}_sum{_labels(route=route)} {_number(histogram.sum)}')
+        lines.append(f'{name}_count{_labels(route=route)} {histogram.total}')
+    return lines
+
+
+registry = Registry()
+
+
+# Name of the view that served the request, e.g. "PostViewSet.list" or "SearchView.get"
+def get_route(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    view = match.func
+    if hasattr(view, 'cls') and getattr(view, 'actions', None):
+        return f"{view.cls.__name__}.{view.actions.get(request.method.lower(), request.method.lower())}"  # DRF viewset
+    view_class = getattr(view, 'view_class', None) or getattr(view, 'cls', None)
+    if view_class is not None:
+        return f"{view_class.__name__}.{request.method.lower()}"
+    return getattr(view, '__name__', match.view_name)
+
+
+# Record a finished request, and log it with its SQL if it was slow and sampled
+def record_request(request, response, duration, metrics):
+    route = get_route(request)
+    registry.record(route, request.method, response.status_code, duration, metrics)
+
+    threshold = getattr(settings, 'METRICS_SLOW_REQUEST_MS', None)
+    if threshold is None or duration * 1000 < threshold:
+        return
+    if random.random() >= getattr(settings, 'METRICS_SLOW_REQUEST_SAMPLE_RATE', 1.0):
+        return
+    statements = '\n'.join(f'  [{ms} ms] {sql}' for ms, sql in metrics.sql)
+    slow_request_logger.warning(
+        "Slow request %s %s (%s): %.1f ms, %d queries in %.1f ms, serializers %.1f ms\n%s",
+        request.method, request.get_full_path(), route, duration * 1000,
+        metrics.queries, metrics.db_time * 1000, metrics.serializer_time * 1000, statements,
+    )
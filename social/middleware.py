@@ -0,0 +1,94 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from rest_framework.exceptions import AuthenticationFailed
+from .authentication import StatelessJWTAuthentication
+from .routers import begin_request, end_request, pin_user
+from . import metrics
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+jwt_authentication = StatelessJWTAuthentication()
+
+
+# Route every read of a writing request, and of the writer's requests that follow it, to the primary database
+class ReplicaPinningMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = begin_request(request, pinned=True if request.method not in SAFE_METHODS else None)
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(token)
+        if self.is_successful_write(request, response):
+            # DRF copies the user it authenticated (session or token) onto the Django request
+            self.pin(request.user)
+        return response
+
+    async def __acall__(self, request):
+        token = begin_request(request, pinned=True if request.method not in SAFE_METHODS else None)
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(token)
+        if self.is_successful_write(request, response):
+            self.pin(await self.aget_user(request))
+        return response
+
+    # The async views authenticate bearer tokens themselves, without setting the request's user
+    async def aget_user(self, request):
+        try:
+            authenticated = jwt_authentication.authenticate(request)  # No query: the user is read from the token
+        except AuthenticationFailed:
+            authenticated = None
+        if authenticated is not None:
+            return authenticated[0]
+        return await request.auser()
+
+    def is_successful_write(self, request, response):
+        return request.method not in SAFE_METHODS and response.status_code < 400 and hasattr(request, 'user')
+
+    def pin(self, user):
+        if user.is_authenticated:
+            pin_user(user.id)
+
+
+# Record latency, database queries and serializer time of every request per route (exported at /metrics)
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = metrics.start_request()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            request_metrics = metrics.finish_request(token)
+        metrics.record_request(request, response, time.perf_counter() - start, request_metrics)
+        return response
+
+    async def __acall__(self, request):
+        token = metrics.start_request()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_metrics = metrics.finish_request(token)
+        metrics.record_request(request, response, time.perf_counter() - start, request_metrics)
+        return response
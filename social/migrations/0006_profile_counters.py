@@ -0,0 +1,47 @@
+# Generated by Django 5.0.3 on 2026-10-18 15:35
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_existing_rows(apps, schema_editor):
+    Follow = apps.get_model('social', 'Follow')
+    Post = apps.get_model('social', 'Post')
+    Profile = apps.get_model('social', 'Profile')
+
+    def count_of(model, field):
+        rows = model.objects.filter(**{field: OuterRef('user_id')}).order_by().values(field).annotate(total=Count('pk')).values('total')
+        return Coalesce(Subquery(rows, output_field=IntegerField()), 0)
+
+    Profile.objects.update(
+        followers_count=count_of(Follow, 'following'),
+        following_count=count_of(Follow, 'follower'),
+        posts_count=count_of(Post, 'user'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social', '0005_post_user_timestamp_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='posts_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_existing_rows, migrations.RunPython.noop),
+    ]
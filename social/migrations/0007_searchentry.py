@@ -0,0 +1,101 @@
+# Generated by Django 5.0.3 on 2026-10-18 15:38
+
+import itertools
+
+from django.db import migrations, models
+from django.db.utils import OperationalError
+
+# SQLite: an external-content FTS5 table over social_searchentry.body, kept in sync by triggers
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE social_searchentry_fts USING fts5("
+    "body, content='social_searchentry', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER social_searchentry_ai AFTER INSERT ON social_searchentry BEGIN "
+    "INSERT INTO social_searchentry_fts(rowid, body) VALUES (new.id, new.body); END",
+    "CREATE TRIGGER social_searchentry_ad AFTER DELETE ON social_searchentry BEGIN "
+    "INSERT INTO social_searchentry_fts(social_searchentry_fts, rowid, body) VALUES ('delete', old.id, old.body); END",
+    "CREATE TRIGGER social_searchentry_au AFTER UPDATE ON social_searchentry BEGIN "
+    "INSERT INTO social_searchentry_fts(social_searchentry_fts, rowid, body) VALUES ('delete', old.id, old.body); "
+    "INSERT INTO social_searchentry_fts(rowid, body) VALUES (new.id, new.body); END",
+]
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS social_searchentry_ai",
+    "DROP TRIGGER IF EXISTS social_searchentry_ad",
+    "DROP TRIGGER IF EXISTS social_searchentry_au",
+    "DROP TABLE IF EXISTS social_searchentry_fts",
+]
+
+# Postgres: a GIN index over the tsvector of the body
+POSTGRES_CREATE = [
+    "CREATE INDEX social_searchentry_body_gin ON social_searchentry USING GIN (to_tsvector('english', body))",
+]
+POSTGRES_DROP = [
+    "DROP INDEX IF EXISTS social_searchentry_body_gin",
+]
+
+
+def run_statements(schema_editor, statements):
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def create_text_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            run_statements(schema_editor, SQLITE_CREATE)
+        except OperationalError:
+            pass  # SQLite built without FTS5: search falls back to LIKE queries
+    elif vendor == 'postgresql':
+        run_statements(schema_editor, POSTGRES_CREATE)
+
+
+def drop_text_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        run_statements(schema_editor, SQLITE_DROP)
+    elif vendor == 'postgresql':
+        run_statements(schema_editor, POSTGRES_DROP)
+
+
+def backfill_search_entries(apps, schema_editor):
+    # Index the posts and profiles written before the index existed, with the text of
+    # social.search.post_text and profile_text (the triggers above fill the FTS5 table)
+    SearchEntry = apps.get_model('social', 'SearchEntry')
+    Post = apps.get_model('social', 'Post')
+    Profile = apps.get_model('social', 'Profile')
+    if SearchEntry.objects.exists():
+        return  # Already filled
+
+    posts = Post.objects.values_list('id', 'content').order_by('id').iterator(chunk_size=1000)
+    profiles = Profile.objects.values_list('id', 'user__username', 'bio').order_by('id').iterator(chunk_size=1000)
+    entries = itertools.chain(
+        (SearchEntry(kind='post', object_id=post_id, body=content) for post_id, content in posts),
+        (SearchEntry(kind='profile', object_id=profile_id, body=' '.join(filter(None, [username, bio])))
+         for profile_id, username, bio in profiles),
+    )
+    while batch := list(itertools.islice(entries, 1000)):
+        SearchEntry.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social', '0006_profile_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('post', 'Post'), ('profile', 'Profile')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('body', models.TextField()),
+            ],
+            options={
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+        migrations.RunPython(create_text_index, drop_text_index),
+        migrations.RunPython(backfill_search_entries, migrations.RunPython.noop),
+    ]
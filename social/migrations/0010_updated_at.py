@@ -0,0 +1,33 @@
+# Generated by Django 5.0.3 on 2026-10-18 18:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def copy_post_timestamps(apps, schema_editor):
+    # Existing posts were last changed, as far as anyone knows, when they were created
+    Post = apps.get_model('social', 'Post')
+    Post.objects.update(updated_at=models.F('timestamp'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social', '0009_task'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_post_timestamps, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.0.3 on 2026-10-18 16:21
+
+import django.db.models.deletion
+import django.utils.timezone
+import taggit.managers
+import re
+
+from django.db import migrations, models
+
+HASHTAG_RE = re.compile(r'(?<![\w#&])#(\w{1,100})')  # As social.tags.HASHTAG_RE
+
+
+def backfill_tags(apps, schema_editor):
+    # Tag the posts written before hashtags were indexed, as social.tags.index_tags does for new ones
+    Post = apps.get_model('social', 'Post')
+    TaggedPost = apps.get_model('social', 'TaggedPost')
+    Tag = apps.get_model('taggit', 'Tag')
+    if TaggedPost.objects.exists():
+        return  # Already filled
+
+    last_id = 0
+    while rows := list(Post.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'content', 'timestamp')[:1000]):
+        last_id = rows[-1][0]
+        tags_by_post = [(post_id, {tag.lower() for tag in HASHTAG_RE.findall(content or '')}, timestamp)
+                        for post_id, content, timestamp in rows]
+        names = {name for _, tags, _ in tags_by_post for name in tags}
+        Tag.objects.bulk_create([Tag(name=name, slug=name) for name in names], ignore_conflicts=True)
+        tag_ids = dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+        TaggedPost.objects.bulk_create([
+            TaggedPost(content_object_id=post_id, tag_id=tag_ids[name], timestamp=timestamp)
+            for post_id, tags, timestamp in tags_by_post
+            for name in tags
+        ], ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social', '0010_updated_at'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag', models.CharField(max_length=100)),
+                ('bucket', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket'], name='social_tagb_bucket_7df3a9_idx')],
+                'unique_together': {('tag', 'bucket')},
+            },
+        ),
+        migrations.CreateModel(
+            name='TaggedPost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('content_object', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tagged_items', to='social.post')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(app_label)s_%(class)s_items', to='taggit.tag')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='tags',
+            field=taggit.managers.TaggableManager(blank=True, help_text='A comma-separated list of tags.', through='social.TaggedPost', to='taggit.Tag', verbose_name='Tags'),
+        ),
+        migrations.AddIndex(
+            model_name='taggedpost',
+            index=models.Index(fields=['tag', '-timestamp'], name='social_tagg_tag_id_311e7b_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='taggedpost',
+            unique_together={('tag', 'content_object')},
+        ),
+        migrations.RunPython(backfill_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.0.3 on 2026-10-18 16:47
+
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+
+
+def backfill_timelines(apps, schema_editor):
+    # Timelines were only filled by new posts and follows: give every follower the recent posts
+    # of the users they follow, as social.timeline.rebuild_timelines does (without its deletes)
+    TimelineEntry = apps.get_model('social', 'TimelineEntry')
+    Follow = apps.get_model('social', 'Follow')
+    Post = apps.get_model('social', 'Post')
+    Profile = apps.get_model('social', 'Profile')
+    if TimelineEntry.objects.exists() or not Follow.objects.exists():
+        return  # Already built, or nothing to build
+
+    popular = (
+        Follow.objects.values('following_id').order_by()
+        .annotate(total=Count('id')).filter(total__gt=getattr(settings, 'TIMELINE_FANOUT_LIMIT', 10000))
+        .values_list('following_id', flat=True)
+    )
+    Profile.objects.filter(user_id__in=list(popular)).update(fanout_on_read=True)
+    on_read_ids = set(Profile.objects.filter(fanout_on_read=True).values_list('user_id', flat=True))
+    per_author = getattr(settings, 'TIMELINE_BACKFILL_SIZE', 200)
+    per_owner = getattr(settings, 'TIMELINE_MAX_ENTRIES', 1000)
+
+    follows = Follow.objects.values_list('follower_id', 'following_id').order_by('follower_id').iterator(chunk_size=1000)
+    for follower_id, rows in groupby(follows, key=itemgetter(0)):
+        following_ids = [following_id for _, following_id in rows if following_id not in on_read_ids]
+        posts = (
+            Post.objects.filter(user_id__in=following_ids)
+            .annotate(position=Window(RowNumber(), partition_by=F('user_id'), order_by=F('timestamp').desc()))
+            .filter(position__lte=per_author).values_list('id', 'user_id', 'timestamp')
+        )
+        newest = sorted(posts, key=lambda post: (post[2], post[0]), reverse=True)[:per_owner]
+        TimelineEntry.objects.bulk_create([
+            TimelineEntry(owner_id=follower_id, post_id=post_id, author_id=author_id, timestamp=timestamp)
+            for post_id, author_id, timestamp in newest
+        ], batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social', '0012_post_timestamp_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='timelineentry',
+            name='social_time_owner_i_b34ff2_idx',
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['owner', '-timestamp', '-post'], name='social_time_owner_i_d01159_idx'),
+        ),
+        migrations.RunPython(backfill_timelines, migrations.RunPython.noop),
+    ]
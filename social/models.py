@@ -1,13 +1,37 @@
 from django.contrib.auth.models import User
 from django.db import models
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.utils import timezone
+from taggit.managers import TaggableManager
+from taggit.models import TaggedItemBase
+
+# Model for an uploaded media file, stored once per distinct content under its SHA-256 digest
+class MediaAsset(models.Model):
+    STATUSES = [
+        ('processing', 'Processing'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+    sha256 = models.CharField(max_length=64, unique=True)  # Digest of the content, used for deduplication
+    media_type = models.CharField(max_length=10)  # 'image', 'video' or 'audio', detected from the content
+    content_type = models.CharField(max_length=100)  # MIME type of the original
+    size = models.BigIntegerField()  # Size of the original in bytes
+    width = models.PositiveIntegerField(blank=True, null=True)  # Image dimensions (images only)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    variants = models.JSONField(default=dict)  # Variant name ('original', 'thumbnail', ...) -> storage path
+    status = models.CharField(max_length=10, choices=STATUSES, default='processing')  # State of the variant generation
+    uploaded_by = models.ForeignKey(User, related_name='+', on_delete=models.SET_NULL, blank=True, null=True)  # First uploader
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.media_type} {self.sha256[:12]}"
+
 
 # Model for user posts
 class Post(models.Model):
     content = models.TextField()  # The text content of the post
     user = models.ForeignKey(User, on_delete=models.CASCADE)  # The user who created the post
     timestamp = models.DateTimeField(auto_now_add=True)  # Time the post was created
+    updated_at = models.DateTimeField(auto_now=True)  # Time of the last change, used for the ETag of feed pages
     media = models.URLField(blank=True, null=True)  # Optional field for media (image/video) URLs
     MEDIA_TYPES = [
         ('image', 'Image'),
@@ -15,11 +39,50 @@ class Post(models.Model):
         ('audio', 'Audio'),
     ]
     media_type = models.CharField(max_length=10, choices=MEDIA_TYPES, blank=True, null=True)  # Type of media (optional)
+    asset = models.ForeignKey(MediaAsset, related_name='posts', on_delete=models.SET_NULL, blank=True, null=True)  # Uploaded media (optional)
+    tags = TaggableManager(through='TaggedPost', blank=True)  # Hashtags of the content, kept in sync by social.tags
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'timestamp', 'id']),  # Index for keyset slices of an author's posts (fan-out-on-read authors in feeds)
+            models.Index(fields=['timestamp', 'id']),  # Index for the admin changelist, newest posts first
+        ]
 
     def __str__(self):
         return f"{self.user.username}: {self.content[:20]}"  # Returns a string representation of the post
 
 
+# Model linking a post to each hashtag in its content (django-taggit through model)
+class TaggedPost(TaggedItemBase):
+    content_object = models.ForeignKey(Post, related_name='tagged_items', on_delete=models.CASCADE)  # The tagged post
+    timestamp = models.DateTimeField(default=timezone.now)  # Denormalized post timestamp, used to page through a tag's posts
+
+    class Meta:
+        unique_together = ('tag', 'content_object')  # A post has each tag once
+        indexes = [
+            models.Index(fields=['tag', '-timestamp']),  # Index to read a tag's posts newest first
+        ]
+
+    def __str__(self):
+        return f"Post {self.content_object_id} tagged {self.tag_id}"  # Avoids fetching the related rows
+
+
+# Model for the trending counters flushed from memory: hashtag uses per tag and time bucket (see social.trending)
+class TagBucket(models.Model):
+    tag = models.CharField(max_length=100)  # Tag name
+    bucket = models.DateTimeField()  # Start of the time bucket
+    count = models.PositiveIntegerField(default=0)  # Posts using the tag in the bucket
+
+    class Meta:
+        unique_together = ('tag', 'bucket')
+        indexes = [
+            models.Index(fields=['bucket']),  # Index to read and expire the buckets of the window
+        ]
+
+    def __str__(self):
+        return f"#{self.tag} x{self.count} at {self.bucket}"
+
+
 # Model for managing following relationships between users
 class Follow(models.Model):
     follower = models.ForeignKey(User, related_name='following', on_delete=models.CASCADE)  # User who follows another user
@@ -36,19 +99,80 @@ class Follow(models.Model):
         return f"{self.follower.username} follows {self.following.username}"  # Returns a string representation of the follow relationship
 
 
+# Model for the materialized home timeline: one row per (timeline owner, post) pair
+class TimelineEntry(models.Model):
+    owner = models.ForeignKey(User, related_name='timeline_entries', on_delete=models.CASCADE)  # User whose feed this entry belongs to
+    post = models.ForeignKey(Post, related_name='timeline_entries', on_delete=models.CASCADE)  # Post shown in the feed (removed with the post)
+    author = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)  # Denormalized post author, used to clean up on unfollow
+    timestamp = models.DateTimeField()  # Denormalized post timestamp, used to order the feed
+
+    class Meta:
+        unique_together = ('owner', 'post')  # A post appears at most once in a feed
+        indexes = [
+            models.Index(fields=['owner', '-timestamp', '-post']),  # Index to read one feed slice in order (the feed's cursor)
+            models.Index(fields=['owner', 'author']),  # Index to drop an author's posts on unfollow
+        ]
+
+    def __str__(self):
+        return f"Post {self.post_id} in timeline of user {self.owner_id}"  # Avoids fetching the related rows
+
+
+# Model for the full-text search index: one row of searchable text per post or profile.
+# The database-specific text index over `body` (SQLite FTS5 or a Postgres GIN index) is created by migration 0007.
+class SearchEntry(models.Model):
+    KINDS = [
+        ('post', 'Post'),
+        ('profile', 'Profile'),
+    ]
+    kind = models.CharField(max_length=10, choices=KINDS)  # Type of the indexed object
+    object_id = models.BigIntegerField()  # Primary key of the indexed post or profile
+    body = models.TextField()  # Text that is searched
+
+    class Meta:
+        unique_together = ('kind', 'object_id')  # One entry per indexed object
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}"
+
+
+# Model for a background job queued by the signals and run by the run_tasks worker (see social.tasks)
+class Task(models.Model):
+    STATUSES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('failed', 'Failed'),
+    ]
+    name = models.CharField(max_length=100)  # Registered handler, e.g. 'timeline.fan_out'
+    payload = models.JSONField(default=dict)  # Arguments of the job
+    status = models.CharField(max_length=10, choices=STATUSES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)  # Number of times a worker picked the job up
+    run_after = models.DateTimeField(default=timezone.now)  # Not run before this time (retry backoff)
+    locked_until = models.DateTimeField(blank=True, null=True)  # A running job not finished by then is picked up again
+    claimed_by = models.CharField(max_length=64, blank=True)  # Claim of the worker running the job
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),  # Index to find the jobs ready to run
+            models.Index(fields=['claimed_by']),  # Index to read back a claimed batch
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.id} ({self.status})"
+
+
 # Model for user profiles
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)  # One-to-one relationship with User
     bio = models.TextField(blank=True, null=True)  # Optional bio field
     profile_picture = models.URLField(blank=True, null=True)  # Optional field for the profile picture URL
+    fanout_on_read = models.BooleanField(default=False)  # Set once the user has too many followers to fan out their posts on write
+    followers_count = models.PositiveIntegerField(default=0)  # Number of users following this user
+    following_count = models.PositiveIntegerField(default=0)  # Number of users this user follows
+    posts_count = models.PositiveIntegerField(default=0)  # Number of posts written by this user
+    updated_at = models.DateTimeField(auto_now=True)  # Time of the last change, counters included (ETag of the profile)
 
     def __str__(self):
         return f"{self.user.username}'s Profile"  # Returns a string representation of the profile
 
-
-# Signal to automatically create or update a user's profile when the user is created or updated
-@receiver(post_save, sender=User)
-def create_or_update_user_profile(sender, instance, created, **kwargs):
-    if created:
-        Profile.objects.create(user=instance)  # Create profile when a new user is created
-    instance.profile.save()  # Save the profile every time the user is saved
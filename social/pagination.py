@@ -0,0 +1,182 @@
+import datetime
+from base64 import b64decode, b64encode
+from urllib import parse
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+from rest_framework.utils.urls import replace_query_param
+from .search import search
+
+# Keyset ("seek") pagination.
+#
+# DRF's CursorPagination only keys on the first ordering field and falls back to an
+# OFFSET for ties. This variant keys on every ordering field, e.g. (timestamp, id), so
+# each page is a "WHERE (timestamp, id) < (last seen)" index seek: no COUNT(*), no
+# OFFSET scan, and pages stay stable while new rows are inserted at the top.
+#
+# A page can also be merged from several key sources (paginate_sources), e.g. a feed
+# read from a timeline table and from the posts of some authors: each source is read
+# from its own index up to the page size and the keys are merged in memory, so pages
+# still cost the same at any depth.
+
+
+class KeysetPagination(CursorPagination):
+    ordering = ('-timestamp', '-id')  # All fields must sort in the same direction
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        return self._set_page(list(self._get_page_queryset(queryset, request)))
+
+    # Page merged from (queryset, fields) sources, fields naming the source's columns holding the values of
+    # self.ordering; load_rows(keys) returns the rows of the merged keys, in the same order
+    def paginate_sources(self, sources, request, load_rows):
+        return self._set_page(load_rows(self.page_keys(sources, request)))
+
+    async def apaginate_sources(self, sources, request, load_rows):
+        return self._set_page(await load_rows(await self.apage_keys(sources, request)))
+
+    # Keys (values of the ordering fields) of the requested page of the sources, plus the look-ahead key
+    def page_keys(self, sources, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        return self._merge_keys([key for queryset, fields in sources
+                                 for key in self._get_page_queryset(queryset, request, fields).values_list(*fields)])
+
+    async def apage_keys(self, sources, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        return self._merge_keys([key for queryset, fields in sources
+                                 async for key in self._get_page_queryset(queryset, request, fields).values_list(*fields)])
+
+    def _merge_keys(self, keys):
+        descending = (self._reverse(self.ordering) if self._is_reversed() else self.ordering)[0].startswith('-')
+        return sorted(set(keys), reverse=descending)[:self.page_size + 1]  # A row in several sources counts once
+
+    def _get_page_queryset(self, queryset, request, fields=None):
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+
+        # Walking backwards means reading the opposite direction from the cursor
+        ordering = self._reverse(self.ordering) if self._is_reversed() else self.ordering
+        if fields is not None:  # The source's names for the ordering fields
+            ordering = tuple(order[:len(order) - len(order.lstrip('-'))] + field for order, field in zip(ordering, fields))
+        queryset = queryset.order_by(*ordering)
+        if self.cursor is not None:
+            try:
+                queryset = queryset.filter(self._after(ordering, self.cursor.position))
+            except (ValidationError, ValueError, TypeError):
+                raise NotFound(self.invalid_cursor_message)
+
+        # Fetch one extra row to know whether there is another page
+        return queryset[:self.page_size + 1]
+
+    def _set_page(self, results):
+        self.rows = results  # Every row read, look-ahead included, in query order
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self._is_reversed():
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        return self.page
+
+    def _is_reversed(self):
+        return self.cursor is not None and self.cursor.reverse
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if self.page:
+            position = self._get_position_from_instance(self.page[-1], self.ordering)
+        else:
+            position = self.cursor.position  # Nothing newer than the cursor: continue from it
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.page:
+            position = self._get_position_from_instance(self.page[0], self.ordering)
+        else:
+            position = self.cursor.position  # Paged past the end: step back from the cursor
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            querystring = b64decode(encoded.encode('ascii')).decode('ascii')
+            tokens = parse.parse_qs(querystring, keep_blank_values=True)
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+            position = tokens['p']
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return Cursor(offset=0, reverse=reverse, position=position)
+
+    def encode_cursor(self, cursor):
+        tokens = {'p': cursor.position}
+        if cursor.reverse:
+            tokens['r'] = '1'
+        querystring = parse.urlencode(tokens, doseq=True)
+        encoded = b64encode(querystring.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def _get_position_from_instance(self, instance, ordering):
+        position = []
+        for order in ordering:
+            field_name = order.lstrip('-')
+            value = instance[field_name] if isinstance(instance, dict) else getattr(instance, field_name)
+            position.append(value.isoformat() if isinstance(value, datetime.datetime) else str(value))
+        return position
+
+    @staticmethod
+    def _reverse(ordering):
+        return tuple(order[1:] if order.startswith('-') else '-' + order for order in ordering)
+
+    @staticmethod
+    def _after(ordering, position):
+        # Lexicographic "comes after" filter: (a < x) OR (a = x AND b < y) OR ...
+        condition = Q()
+        equal = {}
+        for order, value in zip(ordering, position):
+            field_name = order.lstrip('-')
+            lookup = '__lt' if order.startswith('-') else '__gt'
+            condition |= Q(**equal, **{field_name + lookup: value})
+            equal[field_name] = value
+        return condition
+
+
+# Keyset pagination over ranked full-text search results (see social.search), forward only
+class SearchPagination(KeysetPagination):
+    ordering = ('rank', 'id')  # Best matches first, entry id to break ties
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_search(self, kind, query, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is not None and self.cursor.reverse:
+            raise NotFound(self.invalid_cursor_message)
+
+        try:
+            matches = search(kind, query, position=self.cursor and self.cursor.position, limit=self.page_size + 1)
+        except (ValueError, TypeError):
+            raise NotFound(self.invalid_cursor_message)
+
+        self.page = matches[:self.page_size]
+        self.has_next, self.has_previous = len(matches) > self.page_size, False
+        return self.page
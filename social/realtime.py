@@ -0,0 +1,257 @@
+import asyncio
+import queue
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+from .backends import load_backend
+
+# Real-time feed push (Server-Sent Events at /api/stream/posts/).
+#
+# Each connected client subscribes to one channel per followed author ("posts:<id>")
+# plus a control channel with its own follow changes ("follows:<id>"). New posts are
+# serialized once per publish, whatever the number of subscribers, and appended to each
+# subscriber's pending list; the stream wakes up once per batch window and sends every
+# pending post in one event. A subscriber that falls more than REALTIME_MAX_PENDING
+# messages behind is not buffered further: its pending posts are dropped and it gets a
+# "resync" event, telling the client to reload the feed from the list endpoint. Control
+# messages (its follow changes) are never dropped, so the stream keeps listening to the
+# right authors after a resync.
+#
+# The stream holds its connection open for as long as the client stays, which only
+# scales on the event loop: it is served by the ASGI application and refused under WSGI.
+#
+# Publishing never delivers in the writer's thread: InProcessBroker queues the message
+# and a delivery thread hands it to the subscribers, so a write costs the same however
+# many followers are connected. The queue is bounded; when it is full, messages are
+# dropped and the subscribers of their channels are told to resync.
+#
+# The broker is chosen with the REALTIME_BROKER setting. InProcessBroker only reaches
+# clients connected to the same process as the writer; deployments with several
+# processes plug in a broker backed by a shared pub/sub (e.g. Redis) with the same
+# interface.
+
+
+def posts_channel(author_id):
+    return f'posts:{author_id}'
+
+
+def follows_channel(user_id):
+    return f'follows:{user_id}'
+
+
+# Messages waiting for one connected client, filled from any thread and read on its event loop
+class Subscription:
+    def __init__(self, channels, max_pending):
+        self.channels = set(channels)
+        self.max_pending = max_pending
+        self.loop = asyncio.get_running_loop()
+        self.ready = asyncio.Event()
+        self._pending = []
+        self._overflowed = False
+        self._wake_scheduled = False  # One wake-up per batch, however many messages arrive
+        self._lock = threading.Lock()
+
+    def deliver(self, message):
+        with self._lock:
+            if message['type'] != 'posts':
+                self._pending.append(message)  # Control messages are kept, even after an overflow
+            elif self._overflowed:
+                return
+            elif len(self._pending) >= self.max_pending:
+                self._overflow()  # Too slow: stop buffering posts and resync
+            else:
+                self._pending.append(message)
+            wake, self._wake_scheduled = not self._wake_scheduled, True
+        self._wake(wake)
+
+    # Drop the pending posts and tell the client to resync, e.g. when the broker lost some of its messages
+    def overflow(self):
+        with self._lock:
+            self._overflow()
+            wake, self._wake_scheduled = not self._wake_scheduled, True
+        self._wake(wake)
+
+    def _overflow(self):
+        self._pending = [pending for pending in self._pending if pending['type'] != 'posts']
+        self._overflowed = True
+
+    def _wake(self, wake):
+        if wake:
+            try:
+                self.loop.call_soon_threadsafe(self.ready.set)
+            except RuntimeError:
+                pass  # The client's event loop is gone
+
+    # Wait up to timeout seconds for messages, then return (messages, overflowed)
+    async def receive(self, timeout, batch_seconds=0):
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return [], False
+        if batch_seconds:
+            await asyncio.sleep(batch_seconds)  # Let the rest of a burst arrive and send it as one event
+        with self._lock:
+            messages, overflowed = self._pending, self._overflowed
+            self._pending, self._overflowed, self._wake_scheduled = [], False, False
+            self.ready.clear()
+        return messages, overflowed
+
+
+# Interface shared by all brokers
+class BaseBroker:
+    def __init__(self, max_pending=100, **options):
+        self.max_pending = max_pending
+
+    def subscribe(self, channels):
+        raise NotImplementedError  # Returns a Subscription
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+    def update(self, subscription, add=(), remove=()):
+        raise NotImplementedError
+
+    def publish(self, channel, message):
+        raise NotImplementedError
+
+    def has_subscribers(self, channel):
+        return True  # Brokers that cannot tell always publish
+
+    def flush(self):
+        pass  # Wait until the published messages are delivered, for brokers that deliver later
+
+
+# Pub/sub between the threads and event loop of a single process
+class InProcessBroker(BaseBroker):
+    def __init__(self, queue_size=10000, **options):
+        super().__init__(**options)
+        self._subscribers = defaultdict(set)  # Channel -> subscriptions
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)  # (channel, message) waiting for the delivery thread
+        self._lost = set()  # Channels whose messages were dropped with the queue full
+        self._thread = None
+
+    def subscribe(self, channels):
+        subscription = Subscription(channels, self.max_pending)
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.update(subscription, remove=list(subscription.channels))
+
+    def update(self, subscription, add=(), remove=()):
+        with self._lock:
+            for channel in add:
+                self._subscribers[channel].add(subscription)
+                subscription.channels.add(channel)
+            for channel in remove:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+                subscription.channels.discard(channel)
+
+    def publish(self, channel, message):
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait((channel, message))
+        except queue.Full:
+            with self._lock:
+                self._lost.add(channel)
+
+    def has_subscribers(self, channel):
+        return channel in self._subscribers
+
+    def flush(self):
+        self._queue.join()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._deliver, name='realtime-delivery', daemon=True)
+                self._thread.start()
+
+    def _deliver(self):
+        while True:
+            channel, message = self._queue.get()
+            try:
+                with self._lock:
+                    subscribers = list(self._subscribers.get(channel, ()))
+                    lost = [subscription for lost_channel in self._lost for subscription in self._subscribers.get(lost_channel, ())]
+                    self._lost.clear()
+                for subscription in lost:
+                    subscription.overflow()
+                for subscription in subscribers:  # Outside the lock: subscribing never waits on a large fan-out
+                    subscription.deliver(message)
+            finally:
+                self._queue.task_done()
+
+    def clear(self):
+        with self._lock:
+            self._subscribers.clear()
+            self._lost.clear()
+
+
+# Return the configured broker, creating it on first use
+def get_broker():
+    return load_backend('REALTIME_BROKER', 'social.realtime.InProcessBroker')
+
+
+# Push newly created posts to the followers of their authors who are connected (serialized once per
+# author here; the broker delivers them to the subscribers outside the writer's thread)
+def publish_posts(posts):
+    from .serializers import PostSerializer  # Not at module level: serializers -> media -> signals -> realtime
+
+    broker = get_broker()
+    by_author = defaultdict(list)
+    for post in posts:
+        if broker.has_subscribers(posts_channel(post.user_id)):  # Nobody listening: skip the serialization
+            by_author[post.user_id].append(post)
+    for author_id, author_posts in by_author.items():
+        broker.publish(posts_channel(author_id), {'type': 'posts', 'posts': PostSerializer(author_posts, many=True).data})
+
+
+# Tell the follower's open streams to start or stop listening to the given authors
+def publish_follows(follower_id, added=(), removed=()):
+    broker = get_broker()
+    if broker.has_subscribers(follows_channel(follower_id)):
+        broker.publish(follows_channel(follower_id), {'type': 'follows', 'added': list(added), 'removed': list(removed)})
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {JSONRenderer().render(data).decode()}\n\n"
+
+
+# Server-Sent Events for one connected user, until the client disconnects
+async def stream_events(user_id, following_ids):
+    broker = get_broker()
+    heartbeat = getattr(settings, 'REALTIME_HEARTBEAT_SECONDS', 15)
+    batch_seconds = getattr(settings, 'REALTIME_BATCH_SECONDS', 0.25)
+    subscription = broker.subscribe([follows_channel(user_id)] + [posts_channel(author_id) for author_id in following_ids])
+    try:
+        yield 'retry: 5000\n: connected\n\n'  # Reconnect delay for EventSource clients
+        while True:
+            messages, overflowed = await subscription.receive(heartbeat, batch_seconds)
+            if not messages and not overflowed:
+                yield ': keepalive\n\n'  # Keeps proxies from closing an idle connection
+                continue
+            posts = []
+            for message in messages:
+                if message['type'] == 'follows':
+                    broker.update(subscription, add=[posts_channel(author_id) for author_id in message['added']],
+                                  remove=[posts_channel(author_id) for author_id in message['removed']])
+                else:
+                    posts.extend(message['posts'])
+            if overflowed:
+                yield format_event('resync', {})  # The posts since the last event are incomplete
+            elif posts:
+                posts.sort(key=lambda post: (post['timestamp'], post['id']), reverse=True)  # Newest first, as in the feed
+                yield format_event('posts', posts)
+    finally:
+        broker.unsubscribe(subscription)
@@ -0,0 +1,83 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core import checks
+from .cache import get_cache
+
+# Primary/replica database routing.
+#
+# Reads of the social app's tables (feeds, profiles, follow lists) are spread over the
+# aliases in REPLICA_DATABASES and every write goes to the primary ("default"). A user
+# who has just written is "pinned" to the primary for REPLICA_PIN_SECONDS, so they read
+# their own post or follow even while the replicas are catching up.
+# ReplicaPinningMiddleware sets the per-request state read here. Pins are kept in
+# SOCIAL_CACHE, which must then be shared by every process: a write served by one
+# worker has to pin the user's reads in all of them.
+
+ROUTED_APPS = {'social'}
+
+# Per-request routing state: {'request': request, 'pinned': True/False, or None until known}
+_request_state = ContextVar('replica_request_state', default=None)
+
+
+@checks.register(checks.Tags.caches)
+def check_pin_cache(app_configs, **kwargs):
+    if getattr(settings, 'REPLICA_DATABASES', []) and not get_cache().shared:
+        return [checks.Error(
+            'REPLICA_DATABASES requires a SOCIAL_CACHE backend shared by every process.',
+            hint="Replica pins stored in a per-process cache are missed by the other workers; "
+                 "use social.cache.DjangoCacheBackend with a shared cache such as Redis.",
+            id='social.E001',
+        )]
+    return []
+
+
+def pin_key(user_id):
+    return f'replica-pin:{user_id}'
+
+
+# Send the user's reads to the primary for the next REPLICA_PIN_SECONDS
+def pin_user(user_id):
+    get_cache().set(pin_key(user_id), True, timeout=getattr(settings, 'REPLICA_PIN_SECONDS', 5))
+
+
+def begin_request(request, pinned=None):
+    return _request_state.set({'request': request, 'pinned': pinned})
+
+
+def end_request(token):
+    _request_state.reset(token)
+
+
+# Whether reads must go to the primary: always outside of a request (management
+# commands, signal side effects run by workers), and in requests that write or follow a recent write
+def use_primary():
+    state = _request_state.get()
+    if state is None:
+        return True
+    if state['pinned'] is None:
+        # Resolved on the first routed read, once authentication has identified the user
+        user = getattr(state['request'], 'user', None)
+        state['pinned'] = bool(user is not None and user.is_authenticated and get_cache().get(pin_key(user.id)))
+    return state['pinned']
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'REPLICA_DATABASES', [])
+        if not replicas or model._meta.app_label not in ROUTED_APPS or use_primary():
+            return 'default'
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {'default', *getattr(settings, 'REPLICA_DATABASES', [])}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True  # Every alias holds the same data
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'  # Replicas receive the schema through replication
@@ -0,0 +1,108 @@
+import re
+
+from django.db import connection
+from .models import SearchEntry
+
+# Full-text search over posts and profiles.
+#
+# SearchEntry holds the searchable text of every post and profile. On SQLite it is
+# indexed by an FTS5 table ranked with bm25(); on Postgres by a GIN index over
+# to_tsvector() ranked with ts_rank(). Other databases fall back to LIKE matching.
+# Results are ordered by (rank, entry id) ascending, lower ranks being better matches,
+# so they can be paged with a keyset cursor on those two values.
+
+SQLITE_SEARCH = """
+    SELECT * FROM (
+        SELECT e.id, e.object_id, bm25(social_searchentry_fts) AS rank
+        FROM social_searchentry_fts JOIN social_searchentry e ON e.id = social_searchentry_fts.rowid
+        WHERE social_searchentry_fts MATCH %s AND e.kind = %s
+    ) AS matches
+    {after}
+    ORDER BY rank, id
+    LIMIT %s
+"""
+
+POSTGRES_SEARCH = """
+    SELECT * FROM (
+        SELECT e.id, e.object_id, -ts_rank(to_tsvector('english', e.body), query) AS rank
+        FROM social_searchentry e, plainto_tsquery('english', %s) query
+        WHERE to_tsvector('english', e.body) @@ query AND e.kind = %s
+    ) AS matches
+    {after}
+    ORDER BY rank, id
+    LIMIT %s
+"""
+
+AFTER = "WHERE rank > %s OR (rank = %s AND id > %s)"
+
+_has_fts = None
+
+
+def _sqlite_has_fts():
+    global _has_fts
+    if _has_fts is None:
+        _has_fts = 'social_searchentry_fts' in connection.introspection.table_names()
+    return _has_fts
+
+
+def get_terms(query):
+    return re.findall(r'\w+', query.lower())
+
+
+# Searchable text of posts and profiles
+def post_text(post):
+    return post.content
+
+
+def profile_text(profile):
+    return ' '.join(filter(None, [profile.user.username, profile.bio]))
+
+
+# Insert or replace the index entries of the given objects
+def index_objects(kind, objects, get_text):
+    entries = [SearchEntry(kind=kind, object_id=obj.pk, body=get_text(obj)) for obj in objects]
+    if not entries:
+        return
+    unique_fields = ['kind', 'object_id'] if connection.features.supports_update_conflicts_with_target else None
+    SearchEntry.objects.bulk_create(entries, update_conflicts=True, unique_fields=unique_fields, update_fields=['body'])
+
+
+def remove_objects(kind, object_ids):
+    SearchEntry.objects.filter(kind=kind, object_id__in=list(object_ids)).delete()
+
+
+# Return up to `limit` matches as dicts with id, object_id and rank, starting after `position` (rank, id)
+def search(kind, query, position=None, limit=20):
+    terms = get_terms(query)
+    if not terms:
+        return []
+
+    vendor = connection.vendor
+    if vendor == 'sqlite' and _sqlite_has_fts():
+        sql, match = SQLITE_SEARCH, ' '.join(f'"{term}"' for term in terms)  # Quoted terms, all required
+    elif vendor == 'postgresql':
+        sql, match = POSTGRES_SEARCH, ' '.join(terms)
+    else:
+        return _search_like(kind, terms, position, limit)
+
+    params = [match, kind]
+    if position is not None:
+        rank, entry_id = float(position[0]), int(position[1])
+        params += [rank, rank, entry_id]
+    params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql.format(after=AFTER if position is not None else ''), params)
+        return [{'id': row[0], 'object_id': row[1], 'rank': row[2]} for row in cursor.fetchall()]
+
+
+def _search_like(kind, terms, position, limit):
+    # Unranked fallback: every term must appear in the text
+    entries = SearchEntry.objects.filter(kind=kind)
+    for term in terms:
+        entries = entries.filter(body__icontains=term)
+    if position is not None:
+        entries = entries.filter(id__gt=int(position[1]))
+    return [
+        {'id': entry_id, 'object_id': object_id, 'rank': 0.0}
+        for entry_id, object_id in entries.order_by('id').values_list('id', 'object_id')[:limit]
+    ]
@@ -1,6 +1,8 @@
 from rest_framework import serializers
-from .models import Post, Follow, Profile
+from .models import Post, Follow, Profile, MediaAsset
 from django.contrib.auth.models import User
+from .metrics import TimedSerializerMixin
+from .media import guess_media_type, variant_urls
 
 # Serializer for displaying user data
 class UserSerializer(serializers.ModelSerializer):
@@ -9,15 +11,30 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['id', 'username']
 
 # Serializer for Posts
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)  # Display username instead of user ID
+    media_asset = serializers.PrimaryKeyRelatedField(source='asset', queryset=MediaAsset.objects.all(), write_only=True,
+                                                     required=False, allow_null=True)  # Id returned by the upload endpoint
+    variants = serializers.SerializerMethodField()  # URLs of the uploaded media, e.g. {"original": ..., "thumbnail": ...}
 
     class Meta:
         model = Post
-        fields = ['id', 'content', 'user', 'timestamp', 'media']
+        fields = ['id', 'content', 'user', 'timestamp', 'media', 'media_type', 'media_asset', 'variants']
+        read_only_fields = ['media_type']  # Detected from the upload or the media URL
+
+    def get_variants(self, post):
+        return variant_urls(post.asset) if post.asset_id else None
+
+    def validate(self, attrs):
+        asset = attrs.get('asset')
+        if asset is not None:
+            attrs['media_type'] = asset.media_type
+        elif 'media' in attrs:
+            attrs['media_type'] = guess_media_type(attrs['media'])
+        return attrs
 
 # Serializer for Follow relationships
-class FollowSerializer(serializers.ModelSerializer):
+class FollowSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     follower = UserSerializer(read_only=True)
     following = UserSerializer(read_only=True)
 
@@ -25,10 +42,30 @@ class FollowSerializer(serializers.ModelSerializer):
         model = Follow
         fields = ['follower', 'following']
 
+# Serializer for uploaded media
+class MediaAssetSerializer(serializers.ModelSerializer):
+    variants = serializers.SerializerMethodField()
+
+    class Meta:
+        model = MediaAsset
+        fields = ['id', 'sha256', 'media_type', 'content_type', 'size', 'width', 'height', 'status', 'variants']
+
+    def get_variants(self, asset):
+        return variant_urls(asset)
+
 # Serializer for User Profile
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)  # To include user data with profile
 
     class Meta:
         model = Profile
-        fields = ['user', 'bio', 'profile_picture']
+        fields = ['user', 'bio', 'profile_picture', 'followers_count', 'following_count', 'posts_count']
+        read_only_fields = ['followers_count', 'following_count', 'posts_count']  # Maintained by signals
+
+    def update(self, instance, validated_data):
+        # Write the edited columns only: a full save would write back the counters as they were read,
+        # undoing the F() updates of follows and posts made since
+        for name, value in validated_data.items():
+            setattr(instance, name, value)
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        return instance
@@ -1,13 +1,173 @@
-from django.db.models.signals import post_save
+from collections import Counter
+from itertools import groupby
+from operator import attrgetter
+
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_init, post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Profile
+from django.utils import timezone
+from .models import Profile, Post, Follow
+from . import realtime, search, timeline
+from .cache import bump_versions
+from .counters import change_counter
+from .graph import graph
+from .tasks import enqueue, task
+
+# Profile lifecycle: the profile is created once, with the user (signup wraps both in one
+# transaction). Later user saves never rewrite it; only a username change, which shows in
+# the profile's search entry and cached pages (the user's profile, and the feeds and follow
+# lists of their followers), has side effects. A change is detected by comparing with the
+# username the instance was loaded (or last saved) with.
+
+# Read from __dict__ so that a deferred username is not loaded by a query
+@receiver(post_init, sender=User)
+def remember_username(sender, instance, **kwargs):
+    instance._saved_username = instance.__dict__.get('username')
 
 @receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
+def handle_user_saved(sender, instance, created, update_fields=None, **kwargs):
     if created:
         Profile.objects.create(user=instance)
+    elif update_fields is not None and 'username' not in update_fields:
+        return  # e.g. the last_login update done on login
+    elif instance.username != instance._saved_username:  # Not e.g. a password change or an admin save of other fields
+        enqueue('search.index', {'kind': 'profile', 'user_ids': [instance.id]})
+        enqueue('user.renamed', {'user_id': instance.id})  # Followers' pages, which can be many
+        Profile.objects.filter(user_id=instance.id).update(updated_at=timezone.now())  # The profile shows the username
+        bump_versions('profile', [instance.id])
+    instance._saved_username = instance.username
 
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.profile.save()
+
+# Side effects of writes to Post and Follow. The receivers below run them for single
+# rows; the bulk endpoints, whose bulk_create/raw deletes send no signals, call them
+# directly with whole batches. Cheap updates (counters, the user's own cache versions)
+# run inline; work that grows with the number of followers or posts is queued as
+# background jobs (see social.tasks) so write latency does not depend on it.
+
+def posts_created(posts):
+    post_ids = [post.id for post in posts]
+    enqueue('timeline.fan_out', {'post_ids': post_ids})  # Copy into the followers' timelines
+    enqueue('search.index', {'kind': 'post', 'ids': post_ids})
+    enqueue('tags.index', {'post_ids': post_ids, 'created': True})  # Hashtags, counted as trending
+    for author_id, count in Counter(post.user_id for post in posts).items():
+        change_counter('posts_count', [author_id], count)
+    transaction.on_commit(lambda: realtime.publish_posts(posts))  # Push to connected followers
+
+def posts_removed(posts):
+    # Timeline entries are removed by the cascade on TimelineEntry.post
+    search.remove_objects('post', [post.id for post in posts])
+    for author_id, count in Counter(post.user_id for post in posts).items():
+        change_counter('posts_count', [author_id], -count)
+        posts_changed(author_id)
+
+def posts_changed(author_id):
+    # Invalidate the cached feeds of the author's followers
+    enqueue('feed.invalidate', {'author_id': author_id})
+
+def follows_created(follower_id, following_ids):
+    enqueue('timeline.backfill', {'follower_id': follower_id, 'following_ids': list(following_ids)})  # Add the followed users' recent posts
+    change_counter('following_count', [follower_id], len(following_ids))
+    change_counter('followers_count', following_ids, 1)
+    bump_versions('follows', [follower_id])
+    transaction.on_commit(lambda: graph.update(follower_id, added=following_ids))  # Not rolled back with the transaction
+    transaction.on_commit(lambda: realtime.publish_follows(follower_id, added=following_ids))
+
+def follows_removed(follower_id, following_ids):
+    timeline.remove_follows(follower_id, following_ids)  # Drop the unfollowed users' posts (one indexed DELETE)
+    change_counter('following_count', [follower_id], -len(following_ids))
+    change_counter('followers_count', following_ids, -1)
+    bump_versions('feed', [follower_id])
+    bump_versions('follows', [follower_id])
+    transaction.on_commit(lambda: graph.update(follower_id, removed=following_ids))
+    transaction.on_commit(lambda: realtime.publish_follows(follower_id, removed=following_ids))
+
+
+# Invalidate the given kinds of cached pages of the authors' followers
+def invalidate_feeds(author_ids, kinds=('feed',)):
+    follower_ids = list(Follow.objects.filter(following_id__in=author_ids).values_list('follower_id', flat=True).distinct())
+    for kind in kinds:
+        bump_versions(kind, follower_ids)
+
+
+# Background job handlers, each called with the payloads of a batch of jobs
+
+@task('timeline.fan_out')
+def fan_out_task(payloads):
+    post_ids = [post_id for payload in payloads for post_id in payload['post_ids']]
+    posts = Post.objects.filter(id__in=post_ids).only('id', 'user_id', 'timestamp').order_by('user_id')  # Deleted posts are skipped
+    by_author = {author_id: list(author_posts) for author_id, author_posts in groupby(posts, attrgetter('user_id'))}
+    for author_id, author_posts in by_author.items():
+        timeline.fan_out_posts(author_id, author_posts)
+    invalidate_feeds(list(by_author))
+
+@task('timeline.backfill')
+def backfill_task(payloads):
+    for payload in payloads:
+        # Skip users unfollowed since the job was queued
+        following_ids = list(Follow.objects.filter(follower_id=payload['follower_id'], following_id__in=payload['following_ids'])
+                             .values_list('following_id', flat=True))
+        if following_ids:
+            timeline.backfill_follows(payload['follower_id'], following_ids)
+    bump_versions('feed', {payload['follower_id'] for payload in payloads})
+
+@task('feed.invalidate')
+def invalidate_feeds_task(payloads):
+    invalidate_feeds({payload['author_id'] for payload in payloads})
+
+@task('user.renamed')
+def renamed_task(payloads):
+    # The username shows on the user's posts in their followers' feeds, and in their follow lists
+    invalidate_feeds({payload['user_id'] for payload in payloads}, kinds=('feed', 'follows'))
+
+@task('search.index')
+def index_task(payloads):
+    ids = {'post': set(), 'profile': set()}
+    user_ids = set()  # Profiles can also be given by user id
+    for payload in payloads:
+        ids[payload['kind']].update(payload.get('ids', []))
+        user_ids.update(payload.get('user_ids', []))
+    if ids['post']:
+        search.index_objects('post', Post.objects.filter(id__in=ids['post']).only('id', 'content'), search.post_text)
+    if ids['profile'] or user_ids:
+        profiles = Profile.objects.filter(Q(id__in=ids['profile']) | Q(user_id__in=user_ids))
+        search.index_objects('profile', profiles.select_related('user').only('id', 'bio', 'user__username'), search.profile_text)
+
+
+@receiver(post_save, sender=Post)
+def handle_post_saved(sender, instance, created, **kwargs):
+    if created:
+        posts_created([instance])
+    else:
+        enqueue('search.index', {'kind': 'post', 'ids': [instance.id]})
+        enqueue('tags.index', {'post_ids': [instance.id]})
+        posts_changed(instance.user_id)
+
+@receiver(post_delete, sender=Post)
+def handle_post_deleted(sender, instance, **kwargs):
+    posts_removed([instance])
+
+@receiver(post_save, sender=Follow)
+def handle_follow_saved(sender, instance, created, **kwargs):
+    if created:
+        follows_created(instance.follower_id, [instance.following_id])
+
+@receiver(post_delete, sender=Follow)
+def handle_follow_deleted(sender, instance, **kwargs):
+    follows_removed(instance.follower_id, [instance.following_id])
+
+# Invalidate the user's cached profile when it changes
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_profile_on_profile_change(sender, instance, **kwargs):
+    bump_versions('profile', [instance.user_id])
+
+# Keep the profile's search entry in sync
+@receiver(post_save, sender=Profile)
+def index_profile(sender, instance, **kwargs):
+    enqueue('search.index', {'kind': 'profile', 'ids': [instance.id]})
+
+@receiver(post_delete, sender=Profile)
+def unindex_profile(sender, instance, **kwargs):
+    search.remove_objects('profile', [instance.id])
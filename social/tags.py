@@ -0,0 +1,57 @@
+import re
+
+from django.db import transaction
+from taggit.models import Tag
+from .models import Post, TaggedPost
+from .tasks import task
+from .trending import trending
+
+# Hashtag indexing.
+#
+# The hashtags of a post's content are written to TaggedPost (django-taggit's through
+# table for Post.tags) by the 'tags.index' background job, queued by the post signals
+# when a post is created or edited. Tags are stored lower case and matched exactly, and
+# each row carries the post timestamp so a tag's posts are read newest first from the
+# (tag, timestamp) index. New posts also count towards the trending tags.
+
+HASHTAG_RE = re.compile(r'(?<![\w#&])#(\w{1,100})')  # Not inside words, "##" runs or HTML entities
+
+
+def extract_hashtags(text):
+    return sorted({tag.lower() for tag in HASHTAG_RE.findall(text or '')})
+
+
+# Ids of the tags with the given names, creating the missing ones
+def get_tag_ids(names):
+    names = set(names)
+    ids = dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+    missing = names.difference(ids)
+    if missing:
+        # \w+ names are valid unicode slugs, so the name is used as the slug
+        Tag.objects.bulk_create([Tag(name=name, slug=name) for name in missing], ignore_conflicts=True)
+        ids.update(Tag.objects.filter(name__in=missing).values_list('name', 'id'))
+    return ids
+
+
+# Replace the tags of the given posts, from (post id, content, timestamp) rows; returns post id -> tags
+def index_tags(rows):
+    tags_by_post = {post_id: (extract_hashtags(content), timestamp) for post_id, content, timestamp in rows}
+    tag_ids = get_tag_ids(tag for tags, _ in tags_by_post.values() for tag in tags)
+    with transaction.atomic():
+        TaggedPost.objects.filter(content_object_id__in=list(tags_by_post)).delete()
+        TaggedPost.objects.bulk_create([
+            TaggedPost(content_object_id=post_id, tag_id=tag_ids[tag], timestamp=timestamp)
+            for post_id, (tags, timestamp) in tags_by_post.items()
+            for tag in tags
+        ], batch_size=1000)
+    return {post_id: tags for post_id, (tags, _) in tags_by_post.items()}
+
+
+@task('tags.index')
+def index_tags_task(payloads):
+    post_ids = {post_id for payload in payloads for post_id in payload['post_ids']}
+    created_ids = {post_id for payload in payloads if payload.get('created') for post_id in payload['post_ids']}
+    tags_by_post = index_tags(Post.objects.filter(id__in=post_ids).values_list('id', 'content', 'timestamp'))  # Deleted posts are skipped
+    for post_id, tags in tags_by_post.items():
+        if post_id in created_ids and tags:
+            trending.add(tags)
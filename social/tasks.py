@@ -0,0 +1,144 @@
+import logging
+import threading
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Task
+
+# Durable background jobs backed by the Task table.
+#
+# Write paths call enqueue(), which inserts a row in the same transaction as the write,
+# so a job exists exactly when its write committed. The run_tasks command claims ready
+# jobs in batches of the same name and passes all their payloads to the handler in one
+# call, so e.g. a hundred fan-out jobs become one pass over the followers. A failed batch
+# is split in halves that run on their own, down to single jobs, so the jobs that fail
+# alone are isolated and the others complete; those are retried with exponential backoff,
+# up to TASKS_MAX_ATTEMPTS times. Jobs run at least once, so handlers must be idempotent.
+# With TASKS_EAGER (the default under DEBUG) jobs run inline instead, without a worker.
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+
+
+# Register a handler: a function taking the list of payloads of a batch of jobs
+def task(name):
+    def register(handler):
+        _handlers[name] = handler
+        return handler
+    return register
+
+
+def enqueue(name, payload):
+    enqueue_many(name, [payload])
+
+
+def enqueue_many(name, payloads):
+    if not payloads:
+        return
+    if getattr(settings, 'TASKS_EAGER', False):
+        _handlers[name](payloads)
+        return
+    Task.objects.bulk_create([Task(name=name, payload=payload) for payload in payloads])
+
+
+def _ready(now):
+    # Queued jobs whose backoff has elapsed, and running jobs whose worker died
+    return Q(status='queued', run_after__lte=now) | Q(status='running', locked_until__lt=now)
+
+
+# Claim up to batch_size ready jobs with the same name, oldest first
+def claim_batch(batch_size):
+    now = timezone.now()
+    name = Task.objects.filter(_ready(now)).order_by('id').values_list('name', flat=True).first()
+    if name is None:
+        return []
+    ids = list(Task.objects.filter(_ready(now), name=name).order_by('id').values_list('id', flat=True)[:batch_size])
+    # The conditional UPDATE is the claim: of several workers racing for a job, only one matches it
+    claim = uuid.uuid4().hex
+    Task.objects.filter(_ready(now), id__in=ids).update(
+        status='running', claimed_by=claim, attempts=F('attempts') + 1,
+        locked_until=now + timedelta(seconds=getattr(settings, 'TASKS_LOCK_SECONDS', 300)),
+    )
+    return list(Task.objects.filter(claimed_by=claim, status='running').order_by('id'))
+
+
+# Run claimed jobs in one handler call; returns whether they all succeeded
+def run_batch(tasks):
+    handler = _handlers.get(tasks[0].name)
+    try:
+        if handler is None:
+            raise LookupError(f"No handler registered for task '{tasks[0].name}'.")
+        with transaction.atomic():
+            handler([task.payload for task in tasks])
+    except Exception:
+        if handler is not None and len(tasks) > 1:
+            # Bisect: a bad payload only costs attempts of its own job, the rest of the batch still runs
+            logger.warning("Task batch %s failed (%d jobs), retrying it in halves", tasks[0].name, len(tasks))
+            middle = len(tasks) // 2
+            first, second = run_batch(tasks[:middle]), run_batch(tasks[middle:])
+            return first and second
+        logger.exception("Task batch %s failed (%d jobs)", tasks[0].name, len(tasks))
+        error = traceback.format_exc()
+        max_attempts = getattr(settings, 'TASKS_MAX_ATTEMPTS', 5)
+        now = timezone.now()
+        for task in tasks:
+            task.last_error = error
+            if handler is None or task.attempts >= max_attempts:
+                task.status = 'failed'
+            else:
+                task.status, task.run_after = 'queued', now + timedelta(seconds=2 ** task.attempts)
+        Task.objects.bulk_update(tasks, ['status', 'run_after', 'last_error'])
+        return False
+    Task.objects.filter(id__in=[task.id for task in tasks]).delete()
+    return True
+
+
+# Run ready jobs in the current thread until none are left; returns the number of jobs run
+def run_pending(batch_size=100):
+    processed = 0
+    while True:
+        tasks = claim_batch(batch_size)
+        if not tasks:
+            return processed
+        run_batch(tasks)
+        processed += len(tasks)
+
+
+def _work(batch_size, poll_interval, once, stop):
+    try:
+        while not stop.is_set():
+            close_old_connections()
+            tasks = claim_batch(batch_size)
+            if tasks:
+                run_batch(tasks)
+            elif once:
+                return
+            else:
+                stop.wait(poll_interval)
+    finally:
+        connections.close_all()  # This thread's connections
+
+
+# Run jobs with `threads` worker threads until stopped (or, with once=True, until the queue is empty)
+def run_worker(threads=4, batch_size=100, poll_interval=1.0, once=False, stop=None):
+    stop = stop or threading.Event()
+    workers = [
+        threading.Thread(target=_work, args=(batch_size, poll_interval, once, stop), name=f'tasks-{index}', daemon=True)
+        for index in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        stop.set()
+        for worker in workers:
+            worker.join()
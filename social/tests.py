@@ -1,3 +1,1342 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import json
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+from PIL import Image
+from .admin import PostAdmin
+from .models import MediaAsset, Post, Follow, Profile, SearchEntry, TagBucket, TaggedPost, Task, TimelineEntry
+from .tasks import enqueue_many, run_pending, task
+from .graph import graph
+from .search import search
+from .timeline import feed_queryset, rebuild_timelines
+from .views import FeedPagination, ProfileViewSet
+from .cache import get_cache
+from .metrics import registry
+from .middleware import SAFE_METHODS
+from .routers import PrimaryReplicaRouter, begin_request, check_pin_cache, end_request, pin_key, pin_user
+from .authentication import clear_denylist
+from .realtime import InProcessBroker, follows_channel, get_broker, posts_channel
+from .fastpath import FastJSONRenderer, RowSerializer, post_rows
+from .serializers import PostSerializer, ProfileSerializer
+from .throttling import TokenBucketThrottle, get_store, take_token
+from .trending import trending
+from rest_framework_simplejwt.tokens import AccessToken
+
+
+# Create users (and their profiles) without going through the post_save signals
+def make_users(*usernames):
+    password = make_password('password')
+    users = User.objects.bulk_create([User(username=username, password=password) for username in usernames])
+    Profile.objects.bulk_create([Profile(user=user) for user in users])
+    return users
+
+
+make_users_async = sync_to_async(make_users)
+
+
+# Regression harness for N+1 queries: every list endpoint must run the same,
+# fixed number of queries whatever the number of rows it returns.
+class QueryCountTests(APITestCase):
+    # Queries per request, including the session and user lookups done by authentication
+    EXPECTED_QUERIES = {
+        'post-list': 5,  # + fan-out-on-read authors, timeline slice, posts of the page
+        'follows-list': 3,  # + followed usernames
+        'profile-list': 3,  # + profile joined to its user
+    }
+
+    def setUp(self):
+        get_cache().clear()
+        self.viewer, = make_users('viewer')
+        self.client.login(username='viewer', password='password')
+
+    def add_rows(self, count):
+        # Each new author is followed by the viewer and writes one post
+        start = User.objects.count()
+        authors = make_users(*[f'author{start + index}' for index in range(count)])
+        for author in authors:
+            Follow.objects.create(follower=self.viewer, following=author)
+            Post.objects.create(user=author, content=f'Post by {author.username}')
+
+    def count_queries(self, url_name):
+        get_cache().clear()  # Measure the database path, not a cached page
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse(url_name), {'page_size': 50}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def assert_constant_queries(self, url_name):
+        self.add_rows(1)
+        small = self.count_queries(url_name)
+        self.add_rows(20)
+        large = self.count_queries(url_name)
+        self.assertEqual(small, large, f"{url_name} runs more queries as the page grows")
+        self.assertEqual(large, self.EXPECTED_QUERIES[url_name])
+
+    def test_post_list(self):
+        self.assert_constant_queries('post-list')
+
+    def test_follow_list(self):
+        self.assert_constant_queries('follows-list')
+        response = self.client.get(reverse('follows-list'), HTTP_ACCEPT='application/json')
+        self.assertEqual(len(response.json()['following']), 21)
+
+    def test_profile_list(self):
+        self.assert_constant_queries('profile-list')
+
+
+# Fan-out-on-write timelines: entries follow posts and follows, and popular authors are read at feed time
+class TimelineTests(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.viewer, self.other, self.author = make_users('viewer', 'other', 'author')
+        self.client.force_authenticate(self.viewer)
+
+    def feed(self):
+        return [post['content'] for post in self.client.get(reverse('post-list'), HTTP_ACCEPT='application/json').json()['results']]
+
+    def entries(self, owner):
+        return list(TimelineEntry.objects.filter(owner=owner).order_by('-timestamp', '-post_id').values_list('post__content', flat=True))
+
+    def test_posts_are_fanned_out_to_followers(self):
+        Follow.objects.create(follower=self.viewer, following=self.author)
+        Post.objects.create(user=self.author, content='Hello')
+        self.assertEqual(self.entries(self.viewer), ['Hello'])
+        self.assertEqual(self.entries(self.other), [])
+        self.assertEqual(self.feed(), ['Hello'])
+
+    def test_follow_backfills_and_unfollow_cleans_up(self):
+        Post.objects.create(user=self.author, content='Before')
+        follow = Follow.objects.create(follower=self.viewer, following=self.author)
+        self.assertEqual(self.entries(self.viewer), ['Before'])
+        follow.delete()
+        self.assertEqual(self.entries(self.viewer), [])
+        self.assertEqual(self.feed(), [])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_popular_authors_switch_to_fanout_on_read(self):
+        Follow.objects.create(follower=self.viewer, following=self.author)
+        Follow.objects.create(follower=self.other, following=self.author)
+        Post.objects.create(user=self.author, content='First')
+        self.assertTrue(Profile.objects.get(user=self.author).fanout_on_read)
+        Post.objects.create(user=self.author, content='Second')
+        self.assertEqual(self.entries(self.viewer), [])
+        self.assertEqual(self.feed(), ['Second', 'First'])
+
+    @override_settings(TIMELINE_MAX_ENTRIES=2, TIMELINE_TRIM_INTERVAL=1)
+    def test_timelines_are_trimmed(self):
+        Follow.objects.create(follower=self.viewer, following=self.author)
+        for index in range(4):
+            Post.objects.create(user=self.author, content=f'Post {index}')
+        self.assertEqual(self.entries(self.viewer), ['Post 3', 'Post 2'])
+
+    def test_rebuild_timelines(self):
+        Follow.objects.create(follower=self.viewer, following=self.author)
+        Follow.objects.create(follower=self.other, following=self.author)
+        Post.objects.create(user=self.author, content='Hello')
+        TimelineEntry.objects.all().delete()
+        with override_settings(TIMELINE_FANOUT_LIMIT=1):
+            self.assertEqual(rebuild_timelines(), 2)
+        self.assertTrue(Profile.objects.get(user=self.author).fanout_on_read)
+        self.assertEqual(self.feed(), ['Hello'])
+        self.assertEqual(rebuild_timelines(), 2)
+        self.assertFalse(Profile.objects.get(user=self.author).fanout_on_read)
+        self.assertEqual(self.entries(self.viewer), ['Hello'])
+
+
+# Keyset cursors of the feed: stable pages in both directions, ties broken by id, bad cursors rejected
+class FeedPaginationTests(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.viewer, self.author, self.popular = make_users('viewer', 'author', 'popular')
+        Follow.objects.create(follower=self.viewer, following=self.author)
+        Follow.objects.create(follower=self.viewer, following=self.popular)
+        Profile.objects.filter(user=self.popular).update(fanout_on_read=True)  # Merged into the feed at read time
+        posts = [Post.objects.create(user=self.popular if index % 3 else self.author, content=f'Post {index}') for index in range(25)]
+        # Every third post shares its timestamp with the next ones, so pages split ties
+        for index, post in enumerate(posts):
+            timestamp = timezone.now().replace(microsecond=0) + timezone.timedelta(seconds=index // 3)
+            Post.objects.filter(id=post.id).update(timestamp=timestamp)
+            TimelineEntry.objects.filter(post=post).update(timestamp=timestamp)
+        self.expected = list(Post.objects.order_by('-timestamp', '-id').values_list('id', flat=True))
+        self.client.force_authenticate(self.viewer)
+
+    def get_page(self, url, **params):
+        response = self.client.get(url, params, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return [post['id'] for post in data['results']], data['next'], data['previous']
+
+    def test_forward_and_backward_cursors(self):
+        pages, url = [], reverse('post-list') + '?page_size=10'
+        while url:
+            ids, url, previous = self.get_page(url)
+            pages.append((ids, previous))
+        self.assertEqual([len(ids) for ids, _ in pages], [10, 10, 5])
+        self.assertEqual([post_id for ids, _ in pages for post_id in ids], self.expected)
+        self.assertIsNone(pages[0][1])
+        # Walking back from the last page returns the same pages
+        ids, _, previous = self.get_page(pages[2][1])
+        self.assertEqual(ids, pages[1][0])
+        ids, _, previous = self.get_page(previous)
+        self.assertEqual(ids, pages[0][0])
+        self.assertIsNone(previous)
+
+    def test_page_size_is_bounded(self):
+        self.assertEqual(len(self.get_page(reverse('post-list'))[0]), FeedPagination.page_size)
+        self.assertEqual(len(self.get_page(reverse('post-list'), page_size=3)[0]), 3)
+        with mock.patch.object(FeedPagination, 'max_page_size', 20):
+            self.assertEqual(len(self.get_page(reverse('post-list'), page_size=500)[0]), 20)
+
+    def test_invalid_cursors_are_not_found(self):
+        encode = lambda querystring: base64.b64encode(querystring.encode()).decode()
+        for cursor in ['garbage', encode('p=1'), encode('p=yesterday&p=1'), encode('p=2024-01-01T00:00:00Z&p=x'), encode('r=1')]:
+            response = self.client.get(reverse('post-list'), {'cursor': cursor}, HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 404, cursor)
+
+    @skipUnless(connection.vendor == 'sqlite', 'Reads the SQLite query plan')
+    def test_deep_pages_are_index_seeks(self):
+        url = reverse('post-list') + '?page_size=5'
+        for _ in range(3):
+            url = self.get_page(url)[1]
+        get_cache().clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.get_page(url)
+        slices = [query['sql'] for query in queries if 'ORDER BY' in query['sql']]
+        self.assertEqual(len(slices), 2)  # The timeline, the on-read author's posts
+        with connection.cursor() as cursor:
+            for sql in slices:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = ' '.join(row[-1] for row in cursor.fetchall())
+                self.assertIn('INDEX', plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+
+# Cached list pages are served without data queries and invalidated by signals
+class ListCacheTests(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.viewer, self.author = make_users('viewer', 'author')
+        Follow.objects.create(follower=self.viewer, following=self.author)
+        self.client.login(username='viewer', password='password')
+
+    def get_feed(self):
+        return self.client.get(reverse('post-list'), HTTP_ACCEPT='application/json').json()['results']
+
+    def test_feed_is_served_from_cache(self):
+        Post.objects.create(user=self.author, content='First')
+        self.get_feed()
+        with self.assertNumQueries(2):  # Session and user lookups only
+            self.assertEqual([post['content'] for post in self.get_feed()], ['First'])
+
+    def test_new_post_invalidates_feed(self):
+        Post.objects.create(user=self.author, content='First')
+        self.get_feed()
+        with self.captureOnCommitCallbacks(execute=True):  # Versions are bumped once the write commits
+            Post.objects.create(user=self.author, content='Second')
+        self.assertEqual([post['content'] for post in self.get_feed()], ['Second', 'First'])
+
+    def test_versions_are_bumped_after_commit(self):
+        Post.objects.create(user=self.author, content='First')
+        self.get_feed()
+        with self.captureOnCommitCallbacks() as callbacks:
+            Post.objects.create(user=self.author, content='Second')
+            self.assertEqual([post['content'] for post in self.get_feed()], ['First'])  # Another request, before the commit
+        for callback in callbacks:
+            callback()
+        self.assertEqual([post['content'] for post in self.get_feed()], ['Second', 'First'])
+
+    def test_unfollow_invalidates_feed_and_follow_list(self):
+        Post.objects.create(user=self.author, content='First')
+        self.get_feed()
+        self.client.get(reverse('follows-list'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.filter(follower=self.viewer).delete()
+        self.assertEqual(self.get_feed(), [])
+        response = self.client.get(reverse('follows-list'), HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()['following'], [])
+
+    def test_rename_invalidates_followers_pages(self):
+        Post.objects.create(user=self.author, content='First')
+        self.get_feed()
+        self.client.get(reverse('follows-list'))
+        self.author.username = 'renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.save()
+        self.assertEqual(self.get_feed()[0]['user']['username'], 'renamed')
+        response = self.client.get(reverse('follows-list'), HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()['following'], ['renamed'])
+
+
+# Denormalized profile counters follow Follow and Post writes
+class ProfileCounterTests(APITestCase):
+    def setUp(self):
+        self.alice, self.bob = make_users('alice', 'bob')
+
+    def counts(self, user):
+        profile = Profile.objects.get(user=user)
+        return profile.followers_count, profile.following_count, profile.posts_count
+
+    def test_follow_and_post_update_counters(self):
+        follow = Follow.objects.create(follower=self.alice, following=self.bob)
+        Post.objects.create(user=self.bob, content='Hello')
+        self.assertEqual(self.counts(self.alice), (0, 1, 0))
+        self.assertEqual(self.counts(self.bob), (1, 0, 1))
+
+        follow.delete()
+        Post.objects.filter(user=self.bob).delete()
+        self.assertEqual(self.counts(self.bob), (0, 0, 0))
+
+    def test_recount_repairs_drift(self):
+        Follow.objects.create(follower=self.alice, following=self.bob)
+        Profile.objects.filter(user=self.bob).update(followers_count=7, posts_count=3)
+        call_command('recount_profiles', batch_size=1, stdout=StringIO())
+        self.assertEqual(self.counts(self.bob), (1, 0, 0))
+
+    def test_profile_edit_keeps_concurrent_counter_updates(self):
+        self.client.force_login(self.bob)
+        profile = Profile.objects.get(user=self.bob)
+        get_object = ProfileViewSet.get_object
+
+        def read_then_follow(view):
+            instance = get_object(view)
+            Follow.objects.create(follower=self.alice, following=self.bob)  # Between the read and the save
+            return instance
+
+        with mock.patch.object(ProfileViewSet, 'get_object', read_then_follow), CaptureQueriesContext(connection) as context:
+            response = self.client.patch(reverse('profile-detail', args=[profile.id]), {'bio': 'Hi'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Profile.objects.get(user=self.bob).bio, 'Hi')
+        self.assertEqual(self.counts(self.bob), (1, 0, 0))
+        update = next(query['sql'] for query in context if query['sql'].startswith('UPDATE "social_profile" SET "bio"'))
+        self.assertNotIn('followers_count', update)
+
+
+# Bulk endpoints validate and write whole lists in a fixed number of queries
+class BulkEndpointTests(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        get_store().clear()  # Bulk requests take a throttle token per item
+        self.viewer, = make_users('viewer')
+        self.client.login(username='viewer', password='password')
+
+    def bulk_follow(self, user_ids):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('follows-bulk-follow'), {'following': user_ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(context)
+
+    def test_bulk_follow_reports_each_item(self):
+        first, second = make_users('first', 'second')
+        Follow.objects.create(follower=self.viewer, following=first)
+        body, _ = self.bulk_follow([first.id, second.id, self.viewer.id, 999999])
+        self.assertEqual(
+            [result['status'] for result in body['results']],
+            ['already_following', 'followed', 'cannot_follow_self', 'not_found'],
+        )
+        self.assertEqual(Profile.objects.get(user=self.viewer).following_count, 2)
+        self.assertEqual(Profile.objects.get(user=second).followers_count, 1)
+
+    def test_single_follow_validates_the_id(self):
+        other, = make_users('other')
+        for following, expected in [(str(self.viewer.id), 400), ('abc', 400), ('', 400), ('999999', 404), (str(other.id), 201)]:
+            response = self.client.post(reverse('follows-list'), {'following': following})  # Form data: ids are strings
+            self.assertEqual(response.status_code, expected, following)
+        self.assertEqual(list(Follow.objects.values_list('follower_id', 'following_id')), [(self.viewer.id, other.id)])
+
+    @override_settings(THROTTLE_RATES={**settings.THROTTLE_RATES, 'follow': {'rate': '60/min', 'burst': 100}})
+    def test_bulk_follow_query_count_does_not_grow(self):
+        small = make_users(*[f'small{index}' for index in range(2)])
+        large = make_users(*[f'large{index}' for index in range(40)])
+        _, small_queries = self.bulk_follow([user.id for user in small])
+        _, large_queries = self.bulk_follow([user.id for user in large])
+        self.assertEqual(small_queries, large_queries)
+        self.assertEqual(Follow.objects.filter(follower=self.viewer).count(), 42)
+
+    def test_bulk_unfollow(self):
+        users = make_users('first', 'second')
+        self.bulk_follow([user.id for user in users])
+        response = self.client.post(reverse('follows-bulk-unfollow'), {'following': [users[0].id, 999999]}, format='json')
+        self.assertEqual([result['status'] for result in response.json()['results']], ['unfollowed', 'not_following'])
+        self.assertEqual(Profile.objects.get(user=self.viewer).following_count, 1)
+
+    def test_bulk_post_create(self):
+        response = self.client.post(reverse('post-bulk-create'), {'posts': [{'content': 'One'}, {'content': ''}]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], ['created', 'invalid'])
+        self.assertEqual(results[0]['post']['user']['username'], 'viewer')
+        self.assertEqual(Profile.objects.get(user=self.viewer).posts_count, 1)
+
+    def test_bulk_post_create_without_returned_primary_keys(self):
+        posts = [{'content': 'Same'}, {'content': 'Same'}, {'content': 'Other'}]
+        # As on MySQL, where bulk_create does not set the primary keys of the rows it inserts
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            response = self.client.post(reverse('post-bulk-create'), {'posts': posts}, format='json')
+        self.assertEqual(response.status_code, 201)
+        ids = [result['post']['id'] for result in response.json()['results']]
+        self.assertEqual(ids, list(Post.objects.order_by('id').values_list('id', flat=True)))
+        self.assertEqual(SearchEntry.objects.filter(kind='post', object_id__in=ids).count(), 3)  # Indexed by id
+
+
+# Full-text search is kept in sync by signals and paged with a cursor
+class SearchTests(APITestCase):
+    def setUp(self):
+        self.viewer, self.author = make_users('viewer', 'author')
+        self.client.login(username='viewer', password='password')
+
+    def search(self, params):
+        response = self.client.get(reverse('search'), params, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_ranked_cursor_pages(self):
+        for index in range(3):
+            Post.objects.create(user=self.author, content=f'Gardening tips number {index}')
+        Post.objects.create(user=self.author, content='Gardening gardening gardening')
+        Post.objects.create(user=self.author, content='Something else entirely')
+
+        first = self.search({'q': 'gardening', 'page_size': 2})
+        self.assertEqual(first['results'][0]['content'], 'Gardening gardening gardening')
+        second = self.client.get(first['next'], HTTP_ACCEPT='application/json').json()
+        contents = [post['content'] for page in (first, second) for post in page['results']]
+        self.assertEqual(len(set(contents)), 4)
+        self.assertIsNone(second['next'])
+
+    def test_edit_and_delete_update_the_index(self):
+        post = Post.objects.create(user=self.author, content='Old words')
+        post.content = 'New words'
+        post.save()
+        self.assertEqual(self.search({'q': 'old'})['results'], [])
+        self.assertEqual(len(self.search({'q': 'new'})['results']), 1)
+        post.delete()
+        self.assertEqual(self.search({'q': 'new'})['results'], [])
+
+    def test_profile_search(self):
+        Profile.objects.filter(user=self.author).get().save()  # Index the profile created without signals
+        results = self.search({'q': 'author', 'type': 'profiles'})['results']
+        self.assertEqual([profile['user']['username'] for profile in results], ['author'])
+
+
+# The async endpoints return the same responses as the DRF viewsets
+class AsyncEndpointTests(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.viewer, self.author = make_users('viewer', 'author')
+        Follow.objects.create(follower=self.viewer, following=self.author)
+        for index in range(3):
+            Post.objects.create(user=self.author, content=f'Post {index}')
+        self.client.force_login(self.viewer)
+
+    async def test_feed_matches_sync_endpoint(self):
+        await self.async_client.aforce_login(self.viewer)
+        sync_response = await self.async_client.get(reverse('post-list'), {'page_size': 2}, HTTP_ACCEPT='application/json')
+        get_cache().clear()
+        async_response = await self.async_client.get(reverse('async-feed'), {'page_size': 2})
+        self.assertEqual(async_response.status_code, 200)
+        self.assertEqual(
+            async_response.content.replace(b'/async/posts/', b'/posts/'),
+            sync_response.content,
+        )
+
+    async def test_follow_and_unfollow(self):
+        other, = await make_users_async('other')
+        await self.async_client.aforce_login(self.viewer)
+        response = await self.async_client.post(reverse('async-follows'), {'following': other.id}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        follow = await Follow.objects.aget(follower=self.viewer, following=other)
+        response = await self.async_client.delete(reverse('async-unfollow', args=[follow.id]))
+        self.assertEqual(response.status_code, 204)
+        response = await self.async_client.get(reverse('async-follows'))
+        self.assertEqual(response.json(), {'following': ['author']})
+
+    async def test_requires_authentication(self):
+        response = await self.async_client.get(reverse('async-feed'))
+        self.assertEqual(response.status_code, 403)
+
+    async def test_follow_validates_the_body(self):
+        await self.async_client.aforce_login(self.viewer)
+        for body, expected in [({'following': 'abc'}, 400), ({'following': [1]}, 400), ([1, 2], 400), ({}, 400),
+                               ({'following': self.viewer.id}, 400), ({'following': 999999}, 404), ({'following': 2 ** 70}, 404)]:
+            response = await self.async_client.post(reverse('async-follows'), body, content_type='application/json')
+            self.assertEqual(response.status_code, expected, body)
+
+    async def test_invalid_bearer_token_is_rejected(self):
+        await self.async_client.aforce_login(self.viewer)  # Not used instead of the token
+        response = await self.async_client.get(reverse('async-feed'), headers={'Authorization': 'Bearer not-a-token'})
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Bearer', response['WWW-Authenticate'])
+        sync_response = await self.async_client.get(reverse('post-list'), headers={'Authorization': 'Bearer not-a-token'})
+        self.assertEqual(sync_response.status_code, 401)
+
+    async def test_csrf_applies_to_session_writes_only(self):
+        other, = await make_users_async('other')
+        client = AsyncClient(enforce_csrf_checks=True)
+        response = await client.post(reverse('async-follows'), {'following': other.id}, content_type='application/json',
+                                     headers={'Authorization': f'Bearer {AccessToken.for_user(self.viewer)}'})
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(get_cache().get(pin_key(self.viewer.id)))  # The token's user is pinned to the primary
+        await client.aforce_login(self.viewer)
+        follow = await Follow.objects.aget(follower=self.viewer, following=other)
+        response = await client.delete(reverse('async-unfollow', args=[follow.id]))  # Session cookie without a CSRF token
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(await Follow.objects.filter(id=follow.id).aexists())
+        self.assertEqual((await client.get(reverse('async-follows'))).status_code, 200)
+
+
+# Reads go to the replicas unless the request writes or the user wrote recently
+@override_settings(REPLICA_DATABASES=['replica_1'])
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+
+    def route_read(self, request, model=Post):
+        token = begin_request(request, pinned=True if request.method not in SAFE_METHODS else None)
+        try:
+            return self.router.db_for_read(model)
+        finally:
+            end_request(token)
+
+    def request(self, method='get', user_id=None):
+        request = getattr(self.factory, method)('/')
+        request.user = User(id=user_id) if user_id else AnonymousUser()
+        return request
+
+    def test_reads_go_to_replica_and_writes_to_primary(self):
+        self.assertEqual(self.route_read(self.request()), 'replica_1')
+        self.assertEqual(self.router.db_for_write(Post), 'default')
+
+    def test_only_social_tables_are_routed(self):
+        self.assertEqual(self.route_read(self.request(), model=User), 'default')
+
+    def test_writing_request_reads_from_primary(self):
+        self.assertEqual(self.route_read(self.request('post', user_id=1)), 'default')
+
+    def test_user_is_pinned_after_a_write(self):
+        pin_user(1)
+        self.assertEqual(self.route_read(self.request(user_id=1)), 'default')
+        self.assertEqual(self.route_read(self.request(user_id=2)), 'replica_1')
+
+    @override_settings(REPLICA_DATABASES=[])
+    def test_without_replicas_everything_uses_primary(self):
+        self.assertEqual(self.route_read(self.request()), 'default')
+
+    def test_replicas_require_a_shared_pin_cache(self):
+        self.assertEqual([error.id for error in check_pin_cache(None)], ['social.E001'])  # LocMemLRUBackend
+        with mock.patch.object(type(get_cache()), 'shared', True):
+            self.assertEqual(check_pin_cache(None), [])
+        with override_settings(REPLICA_DATABASES=[]):
+            self.assertEqual(check_pin_cache(None), [])
+
+
+# Per-route metrics are exported in the Prometheus text format
+class MetricsTests(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        registry.clear()
+        self.viewer, = make_users('viewer')
+        self.client.login(username='viewer', password='password')
+
+    def test_routes_are_timed_with_queries_and_serializers(self):
+        self.client.get(reverse('post-list'), HTTP_ACCEPT='application/json')
+        self.client.get(reverse('profile-list'), HTTP_ACCEPT='application/json')
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('social_http_requests_total{route="PostViewSet.list",method="GET",status="200"} 1', body)
+        self.assertIn('social_http_request_duration_seconds_count{route="ProfileViewSet.list"} 1', body)
+        self.assertIn('social_db_queries_per_request_sum{route="PostViewSet.list"} 4', body)
+        self.assertIn('social_serializer_seconds_total{route="ProfileViewSet.list"}', body)
+
+    @override_settings(METRICS_SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_sql(self):
+        with self.assertLogs('social.slow_requests', level='WARNING') as logs:
+            self.client.get(reverse('follows-list'), HTTP_ACCEPT='application/json')
+        self.assertIn('FollowViewSet.list', logs.output[0])
+        self.assertIn('social_follow', logs.output[0])
+
+
+# Bearer tokens authenticate API requests without session or user queries, and can be revoked
+class JWTAuthenticationTests(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        clear_denylist()
+        self.viewer, self.author = make_users('viewer', 'author')
+        Follow.objects.create(follower=self.viewer, following=self.author)
+        Post.objects.create(user=self.author, content='Hello')
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'viewer', 'password': 'password'})
+        self.tokens = response.json()
+
+    def get_feed(self, access):
+        return self.client.get(reverse('post-list'), HTTP_ACCEPT='application/json', HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    def test_feed_runs_no_authentication_queries(self):
+        with self.assertNumQueries(3):  # Fan-out-on-read authors, timeline slice, posts of the page
+            response = self.get_feed(self.tokens['access'])
+        self.assertEqual([post['content'] for post in response.json()['results']], ['Hello'])
+        with self.assertNumQueries(0):  # Cached page
+            self.assertEqual(self.get_feed(self.tokens['access']).status_code, 200)
+
+    def test_create_post_with_token(self):
+        response = self.client.post(reverse('post-list'), {'content': 'From a token'},
+                                    HTTP_AUTHORIZATION=f"Bearer {self.tokens['access']}")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['user'], {'id': self.viewer.id, 'username': 'viewer'})
+        self.assertTrue(Post.objects.filter(user=self.viewer, content='From a token').exists())
+
+    def test_revoked_tokens_are_rejected(self):
+        response = self.client.post(reverse('token_revoke'), {'refresh': self.tokens['refresh']},
+                                    HTTP_AUTHORIZATION=f"Bearer {self.tokens['access']}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_feed(self.tokens['access']).status_code, 401)
+        response = self.client.post(reverse('token_refresh'), {'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, 401)
+
+    def test_refresh_keeps_username_claim(self):
+        access = self.client.post(reverse('token_refresh'), {'refresh': self.tokens['refresh']}).json()['access']
+        self.assertEqual(AccessToken(access)['username'], 'viewer')
+        self.assertEqual(self.get_feed(access).status_code, 200)
+
+
+# Uploads are stored once per content digest, and images get resized variants
+class MediaUploadTests(APITestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        get_cache().clear()
+        self.viewer, = make_users('viewer')
+        self.client.login(username='viewer', password='password')
+
+    def upload(self, content, name='photo.png'):
+        return self.client.post(reverse('media-upload'), {'file': SimpleUploadedFile(name, content)}, format='multipart')
+
+    def image(self, size=(1600, 1200)):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def test_image_upload_creates_variants(self):
+        response = self.upload(self.image())
+        self.assertEqual(response.status_code, 201)
+        asset = MediaAsset.objects.get(id=response.json()['id'])
+        self.assertEqual((asset.media_type, asset.status), ('image', 'ready'))
+        self.assertEqual(set(asset.variants), {'original', 'thumbnail', 'small', 'medium'})
+        with Image.open(default_storage.path(asset.variants['thumbnail'])) as thumbnail:
+            self.assertEqual(thumbnail.size, (150, 113))
+
+    def test_same_content_is_stored_once(self):
+        first = self.upload(self.image()).json()
+        response = self.upload(self.image(), name='copy.png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], first['id'])
+        self.assertEqual(MediaAsset.objects.count(), 1)
+
+    def test_other_files_are_rejected(self):
+        response = self.upload(b'not media', name='notes.txt')
+        self.assertEqual(response.status_code, 400)
+        # The declared content type is not trusted
+        fake_video = SimpleUploadedFile('clip.mp4', b'not a video at all', content_type='video/mp4')
+        response = self.client.post(reverse('media-upload'), {'file': fake_video}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(MediaAsset.objects.exists())
+
+    def test_audio_and_video_are_detected_from_the_container(self):
+        for content, expected in [
+            (b'\x00\x00\x00\x18ftypisom\x00\x00\x02\x00isomiso2' + bytes(32), ('video', 'video/mp4')),
+            (b'\x1a\x45\xdf\xa3\x9f\x42\x86\x81\x01\x42\x82\x84webm' + bytes(32), ('video', 'video/webm')),
+            (b'RIFF\x24\x00\x00\x00WAVEfmt ' + bytes(32), ('audio', 'audio/wav')),
+            (b'ID3\x04\x00\x00\x00\x00\x00\x00' + bytes(32), ('audio', 'audio/mpeg')),
+        ]:
+            upload = SimpleUploadedFile('upload.bin', content, content_type='application/octet-stream')
+            response = self.client.post(reverse('media-upload'), {'file': upload}, format='multipart')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual((response.json()['media_type'], response.json()['content_type']), expected)
+
+    def test_post_returns_variant_urls(self):
+        asset_id = self.upload(self.image(size=(300, 200))).json()['id']
+        response = self.client.post(reverse('post-list'), {'content': 'Look', 'media_asset': asset_id})
+        self.assertEqual(response.status_code, 201)
+        post = response.json()
+        self.assertEqual(post['media_type'], 'image')
+        self.assertEqual(set(post['variants']), {'original', 'thumbnail'})  # Smaller than the other sizes
+        self.assertTrue(post['variants']['thumbnail'].startswith('/media/variants/'))
+
+
+# Side effects of writes are queued as jobs and run in batches by the worker
+@override_settings(TASKS_EAGER=False)
+class TaskQueueTests(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.viewer, self.author = make_users('viewer', 'author')
+        Follow.objects.create(follower=self.viewer, following=self.author)
+        self.client.login(username='viewer', password='password')
+        run_pending()
+
+    def get_feed(self):
+        return [post['content'] for post in self.client.get(reverse('post-list'), HTTP_ACCEPT='application/json').json()['results']]
+
+    def test_post_side_effects_are_queued(self):
+        Post.objects.create(user=self.author, content='First')
+        Post.objects.create(user=self.author, content='Second')
+        self.assertEqual(self.get_feed(), [])
+        self.assertEqual(Task.objects.filter(name='timeline.fan_out').count(), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(run_pending(), 6)  # Fan-out, search and hashtag jobs of both posts
+        self.assertFalse(Task.objects.exists())
+        self.assertEqual(self.get_feed(), ['Second', 'First'])
+        self.assertEqual(Profile.objects.get(user=self.author).posts_count, 2)  # Counters are updated inline
+
+    def test_write_cost_does_not_grow_with_followers(self):
+        def create_post_queries():
+            with CaptureQueriesContext(connection) as context:
+                Post.objects.create(user=self.author, content='Post')
+            return len(context)
+
+        few = create_post_queries()
+        for follower in make_users(*[f'follower{index}' for index in range(20)]):
+            Follow.objects.create(follower=follower, following=self.author)
+        self.assertEqual(create_post_queries(), few)
+
+    def test_failed_batches_are_retried_then_marked_failed(self):
+        calls = []
+
+        @task('test.flaky')
+        def flaky(payloads):
+            calls.append(payloads)
+            raise RuntimeError("boom")
+
+        enqueue_many('test.flaky', [{'n': 1}, {'n': 2}])
+        with self.assertLogs('social.tasks', level='ERROR'):
+            run_pending()
+        self.assertEqual(calls, [[{'n': 1}, {'n': 2}], [{'n': 1}], [{'n': 2}]])  # The whole batch, then each half
+        job = Task.objects.get(payload={'n': 1})
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertIn('boom', job.last_error)
+
+        Task.objects.update(run_after=timezone.now(), attempts=4)  # Skip the backoff, last attempt left
+        with self.assertLogs('social.tasks', level='ERROR'):
+            run_pending()
+        self.assertEqual(set(Task.objects.values_list('status', flat=True)), {'failed'})
+
+    def test_failing_job_does_not_fail_its_batch(self):
+        calls = []
+
+        @task('test.poisoned')
+        def poisoned(payloads):
+            calls.append(len(payloads))
+            if {'n': 3} in payloads:
+                raise ValueError("bad payload")
+            done.extend(payloads)
+
+        done = []
+        enqueue_many('test.poisoned', [{'n': n} for n in range(8)])
+        with self.assertLogs('social.tasks', level='ERROR'):
+            self.assertEqual(run_pending(), 8)
+        self.assertEqual(sorted(payload['n'] for payload in done), [0, 1, 2, 4, 5, 6, 7])
+        self.assertEqual(calls, [8, 4, 2, 2, 1, 1, 4])  # Halves down to the bad job
+        job = Task.objects.get()  # The others are done and deleted
+        self.assertEqual((job.payload, job.status, job.attempts), ({'n': 3}, 'queued', 1))
+
+        Task.objects.update(run_after=timezone.now(), attempts=4)  # Last attempt left
+        with self.assertLogs('social.tasks', level='ERROR'):
+            run_pending()
+        self.assertEqual(Task.objects.get().status, 'failed')
+
+
+# The profile is created once at signup, and logging in never touches it
+@override_settings(TASKS_EAGER=False)
+class ProfileLifecycleTests(APITestCase):
+    def profile_queries(self, context):
+        return [query['sql'] for query in context if 'social_profile' in query['sql']]
+
+    def test_signup_creates_profile_once(self):
+        data = {'username': 'newcomer', 'password1': 'A-long-passphrase-1', 'password2': 'A-long-passphrase-1'}
+        # Username checks, user and profile INSERTs with the search job (in one transaction), then the login queries
+        with self.assertNumQueries(15) as context:
+            response = self.client.post(reverse('signup'), data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(self.profile_queries(context)), 1)  # The INSERT
+        self.assertTrue(Profile.objects.filter(user__username='newcomer').exists())
+
+    def test_login_does_not_touch_profile(self):
+        User.objects.create_user(username='member', password='password')
+        Task.objects.all().delete()  # The profile's search job
+        # User lookup, session INSERT, last_login UPDATE, session UPDATE (with their savepoints)
+        with self.assertNumQueries(9) as context:
+            response = self.client.post(reverse('login'), {'username': 'member', 'password': 'password'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.profile_queries(context), [])
+        self.assertFalse(Task.objects.exists())
+
+    def test_only_username_changes_touch_profile(self):
+        user = User.objects.create_user(username='member', password='password')
+        Task.objects.all().delete()
+        user.set_password('Another-passphrase-2')
+        user.save()  # A full save with the same username
+        user = User.objects.get(id=user.id)
+        user.first_name = 'Member'
+        user.save()
+        self.assertFalse(Task.objects.exists())
+
+        user.username = 'renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        jobs = [{'kind': 'profile', 'user_ids': [user.id]}, {'user_id': user.id}]  # Search entry, followers' pages
+        self.assertEqual(list(Task.objects.order_by('id').values_list('payload', flat=True)), jobs)
+        user.save()  # Saved with the new username already
+        self.assertEqual(Task.objects.count(), 2)
+
+
+# Follow suggestions and mutual checks are answered from the in-memory follow graph
+class FollowGraphTests(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        graph.clear()
+        self.viewer, self.alice, self.bob, self.carol, self.dave = make_users('viewer', 'alice', 'bob', 'carol', 'dave')
+        for follower, following in [(self.viewer, self.alice), (self.viewer, self.bob), (self.alice, self.carol),
+                                    (self.bob, self.carol), (self.bob, self.dave), (self.alice, self.viewer)]:
+            Follow.objects.create(follower=follower, following=following)
+        self.client.login(username='viewer', password='password')
+
+    def test_suggestions_rank_second_degree_connections(self):
+        response = self.client.get(reverse('follows-suggestions'), HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()['suggestions'], [
+            {'id': self.carol.id, 'username': 'carol', 'mutual_count': 2},
+            {'id': self.dave.id, 'username': 'dave', 'mutual_count': 1},
+        ])
+
+    def test_mutual_follow_check(self):
+        response = self.client.get(reverse('follows-mutual', args=[self.alice.id]), HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json(), {'user': self.alice.id, 'following': True, 'followed_by': True, 'mutual': True})
+        response = self.client.get(reverse('follows-mutual', args=[self.bob.id]), HTTP_ACCEPT='application/json')
+        self.assertFalse(response.json()['mutual'])
+        response = self.client.get(reverse('follows-mutual', args=[2 ** 70]), HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_graph_is_kept_current_without_reloading(self):
+        graph.following_many([user.id for user in User.objects.all()])  # Load every user's follows
+        with self.captureOnCommitCallbacks(execute=True):  # The graph is updated once the writes commit
+            Follow.objects.create(follower=self.viewer, following=self.carol)
+            Follow.objects.filter(follower=self.bob, following=self.dave).delete()
+        with self.assertNumQueries(0):
+            self.assertTrue(graph.follows(self.viewer.id, self.carol.id))
+            self.assertEqual(graph.suggestions(self.viewer.id), [])
+
+
+# Exports stream every record of the user's data
+class ExportTests(APITestCase):
+    def setUp(self):
+        self.viewer, self.author = make_users('viewer', 'author')
+        Follow.objects.create(follower=self.viewer, following=self.author)
+        Post.objects.create(user=self.viewer, content='Mine, with "quotes"')
+        Post.objects.create(user=self.author, content='Not mine')
+        self.client.login(username='viewer', password='password')
+
+    def test_ndjson_export(self):
+        response = self.client.get(reverse('export'))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([record['type'] for record in records], ['user', 'profile', 'post', 'follow'])
+        self.assertEqual(records[2]['content'], 'Mine, with "quotes"')
+        self.assertEqual(records[3], {'type': 'follow', 'follower': self.viewer.id, 'following': self.author.id})
+
+    def test_csv_export(self):
+        response = self.client.get(reverse('export'), {'output': 'csv'})
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([row['type'] for row in rows], ['user', 'profile', 'post', 'follow'])
+        self.assertEqual(rows[2]['content'], 'Mine, with "quotes"')
+
+    def test_export_command_streams_everything(self):
+        output = StringIO()
+        call_command('export_data', stdout=output)
+        types = [json.loads(line)['type'] for line in output.getvalue().splitlines()]
+        self.assertEqual(types.count('post'), 2)
+        self.assertEqual(types.count('user'), 2)
+
+
+# Imports read the export format back with bulk writes
+class ImportTests(APITestCase):
+    def write_export(self):
+        viewer, author = make_users('viewer', 'author')
+        Profile.objects.filter(user=author).update(bio='Writes things')
+        Follow.objects.create(follower=viewer, following=author)
+        Post.objects.create(user=author, content='Old post')
+        Post.objects.filter(user=author).update(timestamp=timezone.make_aware(timezone.datetime(2020, 1, 2)))
+        path = tempfile.NamedTemporaryFile(suffix='.ndjson', delete=False).name
+        self.addCleanup(os.remove, path)
+        call_command('export_data', output=path, stderr=StringIO())
+        # Import into an empty site
+        User.objects.all().delete()
+        return path
+
+    def test_import_round_trip(self):
+        path = self.write_export()
+        output = StringIO()
+        call_command('import_data', path, batch_size=2, stdout=output)
+        self.assertIn('Imported 2 users, 2 profiles, 1 posts and 1 follows', output.getvalue())
+
+        author = Profile.objects.select_related('user').get(user__username='author')
+        self.assertEqual((author.bio, author.followers_count, author.posts_count), ('Writes things', 1, 1))
+        post = Post.objects.get()
+        self.assertEqual(post.timestamp.year, 2020)  # Not replaced by auto_now_add
+        self.assertEqual(post.user_id, author.user_id)
+        viewer = User.objects.get(username='viewer')
+        self.assertEqual(list(feed_queryset(viewer.id)), [post])
+        self.assertEqual(search('post', 'old')[0]['object_id'], post.id)
+
+    def test_import_without_returned_primary_keys(self):
+        path = self.write_export()
+        # As on MySQL, where bulk_create does not set the primary keys of the rows it inserts
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            call_command('import_data', path, stdout=StringIO())
+        self.assertEqual(search('profile', 'writes')[0]['object_id'], Profile.objects.get(user__username='author').id)
+        self.assertFalse(SearchEntry.objects.filter(object_id=None).exists())
+
+    def test_repeated_import_reports_inserted_follows(self):
+        path = self.write_export()
+        call_command('import_data', path, stdout=StringIO())
+        output = StringIO()
+        call_command('import_data', path, stdout=output)
+        self.assertIn('0 follows; skipped', output.getvalue())
+        self.assertEqual(Follow.objects.count(), 1)
+
+    def test_derived_data_is_rebuilt_for_imported_users_only(self):
+        path = self.write_export()
+        bystander, star = make_users('bystander', 'star')
+        Follow.objects.create(follower=bystander, following=star)
+        Post.objects.create(user=star, content='Untouched')
+        entry_ids = list(TimelineEntry.objects.filter(owner=bystander).values_list('id', flat=True))
+        Profile.objects.filter(user=star).update(posts_count=5)  # Drift the import has nothing to do with
+        output = StringIO()
+        call_command('import_data', path, stdout=output)
+        self.assertIn('rebuilt timelines for 1 follows', output.getvalue())
+        self.assertEqual(list(TimelineEntry.objects.filter(owner=bystander).values_list('id', flat=True)), entry_ids)
+        self.assertEqual(Profile.objects.get(user=star).posts_count, 5)
+        self.assertEqual([post.content for post in feed_queryset(User.objects.get(username='viewer').id)], ['Old post'])
+
+    def test_profiles_are_created_without_per_user_queries(self):
+        path = self.write_export()
+        with CaptureQueriesContext(connection) as context:
+            call_command('import_data', path, skip_derived=True, stdout=StringIO())
+        self.assertEqual(len([query for query in context if query['sql'].startswith('INSERT INTO "social_profile"')]), 1)
+
+    def test_posts_are_written_in_multi_row_inserts(self):
+        path = self.write_export()
+        with open(path) as handle:
+            source_id = next(record['user'] for record in map(json.loads, handle) if record['type'] == 'post')
+        with open(path, 'a') as handle:
+            for index in range(4):
+                handle.write(json.dumps({'type': 'post', 'user': source_id, 'content': f'Extra {index}',
+                                         'timestamp': '2021-03-04T05:06:07Z'}) + '\n')
+        with CaptureQueriesContext(connection) as context:
+            call_command('import_data', path, skip_derived=True, stdout=StringIO())
+        inserts = [query['sql'] for query in context if query['sql'].startswith('INSERT INTO "social_post"')]
+        self.assertEqual(len(inserts), 1)  # One statement for the five posts, not one round trip per row
+        self.assertEqual(Post.objects.count(), 5)
+        self.assertEqual(Post.objects.filter(timestamp__year=2021).count(), 4)
+
+
+# List pages carry ETag / Last-Modified validators, and matching revalidations get a 304 from the cache or a cheap probe
+class ConditionalRequestTests(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.viewer, self.author = make_users('viewer', 'author')
+        Follow.objects.create(follower=self.viewer, following=self.author)
+        self.post = Post.objects.create(user=self.author, content='Hello')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.viewer)}', HTTP_ACCEPT='application/json')
+
+    def test_unchanged_feed_returns_304_from_the_cache(self):
+        response = self.client.get(reverse('post-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        with self.assertNumQueries(0):  # The cached page's validators
+            not_modified = self.client.get(reverse('post-list'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('post-list'), HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        # Cached pages keep their validators
+        self.assertEqual(self.client.get(reverse('post-list'))['ETag'], response['ETag'])
+
+    def test_unchanged_feed_returns_304_after_probe_on_a_cache_miss(self):
+        response = self.client.get(reverse('post-list'))
+        get_cache().clear()
+        with self.assertNumQueries(3):  # Fan-out-on-read authors, timeline slice, one aggregate over its posts
+            not_modified = self.client.get(reverse('post-list'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        Post.objects.filter(id=self.post.id).update(updated_at=timezone.now())  # An edit the cache was not told about
+        self.assertEqual(self.client.get(reverse('post-list'), HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_feed_etag_changes_on_edits_and_new_posts(self):
+        etag = self.client.get(reverse('post-list'))['ETag']
+        self.post.content = 'Hello again'
+        with self.captureOnCommitCallbacks(execute=True):  # Cached pages are invalidated once the write commits
+            self.post.save()
+        response = self.client.get(reverse('post-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['content'], 'Hello again')
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(user=self.author, content='New')
+        self.assertEqual(self.client.get(reverse('post-list'), HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_profile_validators_follow_counters(self):
+        response = self.client.get(reverse('profile-list'))
+        self.assertEqual(self.client.get(reverse('profile-list'), HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(reverse('profile-list'), HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.create(follower=self.author, following=self.viewer)  # Bumps the viewer's followers_count
+        response = self.client.get(reverse('profile-list'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['followers_count'], 1)
+
+
+# New posts are pushed to connected followers as Server-Sent Events
+@override_settings(REALTIME_BATCH_SECONDS=0)
+class RealtimeTests(APITestCase):
+    def setUp(self):
+        get_broker().clear()
+        self.viewer, self.author, self.other = make_users('viewer', 'author', 'other')
+        Follow.objects.create(follower=self.viewer, following=self.author)
+
+    def write(self, function, *args, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):  # Posts are published once committed
+            return function(*args, **kwargs)
+
+    async def next_event(self, events):
+        return (await asyncio.wait_for(anext(events), timeout=5)).decode()
+
+    async def test_followers_receive_new_posts(self):
+        await self.async_client.aforce_login(self.viewer)
+        response = await self.async_client.get(reverse('feed-stream'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = aiter(response.streaming_content)
+        self.assertIn(': connected', await self.next_event(events))
+
+        write = sync_to_async(self.write)
+        await write(Post.objects.create, user=self.other, content='Not followed')
+        await write(Post.objects.create, user=self.author, content='Followed')
+        event = await self.next_event(events)
+        self.assertTrue(event.startswith('event: posts\n'))
+        posts = json.loads(event.split('data: ', 1)[1])
+        self.assertEqual([post['content'] for post in posts], ['Followed'])
+
+        # Following someone while connected subscribes the open stream to them
+        await write(Follow.objects.create, follower=self.viewer, following=self.other)
+        next_event = asyncio.ensure_future(self.next_event(events))
+        await asyncio.sleep(0.1)  # Let the stream apply the follow
+        await write(Post.objects.create, user=self.other, content='Now followed')
+        event = await next_event
+        self.assertIn('Now followed', event)
+        await events.aclose()
+
+    async def test_slow_clients_are_told_to_resync(self):
+        subscription = get_broker().subscribe([posts_channel(self.author.id)])
+        for index in range(subscription.max_pending + 1):
+            get_broker().publish(posts_channel(self.author.id), {'type': 'posts', 'posts': [{'id': index}]})
+        get_broker().flush()
+        self.assertEqual(await subscription.receive(timeout=1), ([], True))
+        get_broker().unsubscribe(subscription)
+        self.assertFalse(get_broker().has_subscribers(posts_channel(self.author.id)))
+
+    async def test_follow_changes_survive_an_overflow(self):
+        subscription = get_broker().subscribe([posts_channel(self.author.id), follows_channel(self.viewer.id)])
+        follows = {'type': 'follows', 'added': [self.other.id], 'removed': []}
+        get_broker().publish(follows_channel(self.viewer.id), follows)
+        for index in range(subscription.max_pending + 1):
+            get_broker().publish(posts_channel(self.author.id), {'type': 'posts', 'posts': [{'id': index}]})
+        unfollows = {'type': 'follows', 'added': [], 'removed': [self.author.id]}
+        get_broker().publish(follows_channel(self.viewer.id), unfollows)
+        get_broker().flush()
+        self.assertEqual(await subscription.receive(timeout=1), ([follows, unfollows], True))
+        get_broker().unsubscribe(subscription)
+        self.assertFalse(get_broker().has_subscribers(posts_channel(self.author.id)))
+
+    async def test_publishing_does_not_deliver_in_the_writer_thread(self):
+        subscription = get_broker().subscribe([posts_channel(self.author.id)])
+        delivered_in = []
+        deliver = subscription.deliver
+        subscription.deliver = lambda message: (delivered_in.append(threading.get_ident()), deliver(message))
+        get_broker().publish(posts_channel(self.author.id), {'type': 'posts', 'posts': [{'id': 1}]})
+        get_broker().flush()
+        self.assertNotIn(threading.get_ident(), delivered_in)
+        self.assertEqual(await subscription.receive(timeout=1), ([{'type': 'posts', 'posts': [{'id': 1}]}], False))
+        get_broker().unsubscribe(subscription)
+
+    async def test_messages_dropped_with_the_queue_full_make_subscribers_resync(self):
+        broker = InProcessBroker(queue_size=1)
+        subscription = broker.subscribe([posts_channel(self.author.id)])
+        delivering, release = threading.Event(), threading.Event()
+        deliver = subscription.deliver
+        subscription.deliver = lambda message: (delivering.set(), release.wait(5), deliver(message))
+        broker.publish(posts_channel(self.author.id), {'type': 'posts', 'posts': [{'id': 1}]})
+        delivering.wait(5)  # The delivery thread is busy with the first message
+        broker.publish(posts_channel(self.author.id), {'type': 'posts', 'posts': [{'id': 2}]})
+        broker.publish(posts_channel(self.author.id), {'type': 'posts', 'posts': [{'id': 3}]})  # Dropped
+        release.set()
+        broker.flush()
+        self.assertEqual(await subscription.receive(timeout=1), ([], True))
+
+    async def test_requires_authentication(self):
+        response = await self.async_client.get(reverse('feed-stream'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_refused_under_wsgi(self):
+        self.client.force_login(self.viewer)
+        response = self.client.get(reverse('feed-stream'))
+        self.assertEqual(response.status_code, 501)
+        self.assertFalse(response.streaming)
+
+
+# Hashtags are indexed from post content and counted in the trending window
+class HashtagTests(APITestCase):
+    def setUp(self):
+        trending.clear()
+        self.viewer, self.author = make_users('viewer', 'author')
+        self.client.force_login(self.viewer)
+
+    def tag_posts(self, tag, **params):
+        return self.client.get(reverse('tag-posts', args=[tag]), params, HTTP_ACCEPT='application/json').json()
+
+    def test_posts_by_tag_newest_first(self):
+        posts = [Post.objects.create(user=self.author, content=f'Post {index} about #Django') for index in range(3)]
+        Post.objects.create(user=self.author, content='No tags, just c#code')
+        page = self.tag_posts('DJANGO', page_size=2)
+        self.assertEqual([post['id'] for post in page['results']], [posts[2].id, posts[1].id])
+        next_page = self.client.get(page['next'], HTTP_ACCEPT='application/json').json()
+        self.assertEqual([post['id'] for post in next_page['results']], [posts[0].id])
+        self.assertEqual(self.tag_posts('code')['results'], [])
+
+    def test_edits_replace_tags(self):
+        post = Post.objects.create(user=self.author, content='#one #two')
+        post.content = '#two #three'
+        post.save()
+        self.assertEqual(sorted(TaggedPost.objects.filter(content_object=post).values_list('tag__name', flat=True)), ['three', 'two'])
+
+    def test_trending_counts_new_posts_in_window(self):
+        for content in ['#python rocks', '#python and #django', '#django']:
+            Post.objects.create(user=self.author, content=content)
+        trending.add(['expired'], when=time.time() - 2 * 3600)
+        trending.add(['late'], when=time.time() - 600)
+        response = self.client.get(reverse('trending'), HTTP_ACCEPT='application/json').json()
+        self.assertEqual(response['trending'], [{'tag': 'django', 'count': 2}, {'tag': 'python', 'count': 2}, {'tag': 'late', 'count': 1}])
+
+        # Flushed counts are kept, summed with other processes' rows, when the window is reloaded
+        trending.flush()
+        self.assertEqual(sum(TagBucket.objects.filter(tag='python').values_list('count', flat=True)), 2)
+        TagBucket.objects.filter(tag='django').update(count=F('count') + 5)
+        trending.flush()
+        self.assertEqual(trending.top(1), [('django', 7)])
+
+
+# Admin changelists stay cheap on large tables
+@override_settings(ADMIN_COUNT_LIMIT=5, ADMIN_DELETE_CHUNK_SIZE=2)
+class AdminTests(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.users = make_users(*[f'user{index}' for index in range(4)])
+        for user in self.users:
+            Post.objects.bulk_create([Post(user=user, content=f'Post {index}') for index in range(3)])
+        self.client.force_login(self.admin)
+
+    def test_counts_are_bounded(self):
+        response = self.client.get(reverse('admin:social_post_changelist'))
+        self.assertEqual(response.context['cl'].result_count, Post.objects.order_by('-pk').first().pk)  # Largest pk: no statistics
+        response = self.client.get(reverse('admin:social_post_changelist'), {'username': 'user1'})
+        self.assertEqual(response.context['cl'].result_count, 3)
+        self.assertNotContains(response, 'href="?user__username=')  # No link per user in the sidebar
+
+    def test_filtered_lists_past_the_limit_can_be_paged(self):
+        url = reverse('admin:social_post_changelist')
+        with mock.patch.object(PostAdmin, 'list_per_page', 2):
+            response = self.client.get(url, {'q': 'Post'})
+            self.assertEqual(response.context['cl'].paginator.lower_bound, 5)
+            self.assertContains(response, '5+ results')
+            response = self.client.get(url, {'q': 'Post', 'p': 4})  # Past ADMIN_COUNT_LIMIT
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.context['cl'].result_list), 2)
+            self.assertEqual(response.context['cl'].paginator.num_pages, 5)  # The next page stays reachable
+            response = self.client.get(url, {'q': 'Post', 'p': 6})
+            self.assertIsNone(response.context['cl'].paginator.lower_bound)  # Counted exactly up to the end
+            self.assertEqual(response.context['cl'].result_count, 12)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        for follower in self.users[:2]:  # More rows than ADMIN_COUNT_LIMIT
+            Follow.objects.bulk_create([Follow(follower=follower, following=user) for user in self.users if user != follower])
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(reverse('admin:social_follow_changelist'))
+        for follower in self.users[2:]:
+            Follow.objects.bulk_create([Follow(follower=follower, following=user) for user in self.users if user != follower])
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(reverse('admin:social_follow_changelist'))
+        self.assertContains(response, 'user0 follows user1')
+        self.assertEqual(len(small), len(large))
+
+    def test_unfollow_action_deletes_in_chunks(self):
+        follower = self.users[0]
+        for user in self.users[1:]:
+            Follow.objects.create(follower=follower, following=user)
+        response = self.client.post(reverse('admin:social_follow_changelist'), {
+            'action': 'unfollow_selected_users',
+            '_selected_action': list(Follow.objects.values_list('pk', flat=True)),
+        }, follow=True)
+        self.assertContains(response, 'Successfully unfollowed 3 users.')
+        self.assertFalse(Follow.objects.exists())
+        self.assertEqual(Profile.objects.get(user=follower).following_count, 0)
+
+
+# Token bucket throttles: a burst of requests is allowed, then 429 with Retry-After
+@override_settings(THROTTLE_RATES={
+    'read': {'rate': '60/min', 'burst': 3},
+    'post': {'rate': '1/min', 'burst': 2},
+    'follow': {'rate': '1/h', 'burst': 1},
+})
+class ThrottleTests(APITestCase):
+    def setUp(self):
+        get_store().clear()
+        get_cache().clear()
+        clear_denylist()
+        self.user, self.other, self.third = make_users('user', 'other', 'third')
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'user', 'password': 'password'})
+        self.authorization = f"Bearer {response.json()['access']}"
+        self.client.credentials(HTTP_AUTHORIZATION=self.authorization)
+
+    def test_reads_are_throttled_without_queries(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get(reverse('profile-list')).status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('profile-list'))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_writes_have_their_own_buckets(self):
+        for content in ('First', 'Second'):
+            self.assertEqual(self.client.post(reverse('post-list'), {'content': content}).status_code, 201)
+        response = self.client.post(reverse('post-list'), {'content': 'Third'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+        self.assertEqual(Post.objects.filter(user=self.user).count(), 2)
+
+        self.assertEqual(self.client.post(reverse('follows-list'), {'following': self.other.id}).status_code, 201)
+        response = self.client.post(reverse('follows-list'), {'following': self.third.id})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '3600')
+        self.assertEqual(self.client.get(reverse('post-list')).status_code, 200)  # Reads are still allowed
+
+    def test_buckets_are_per_user_and_per_ip(self):
+        for _ in range(3):
+            self.client.get(reverse('profile-list'))
+        self.assertEqual(self.client.get(reverse('profile-list')).status_code, 429)
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.get(reverse('profile-list')).status_code, 200)
+
+        throttle, factory = TokenBucketThrottle(), RequestFactory()
+        for address, allowed in [('10.0.0.1', True)] * 3 + [('10.0.0.1', False), ('10.0.0.2', True)]:
+            request = factory.get('/', REMOTE_ADDR=address)
+            request.user = AnonymousUser()
+            self.assertEqual(throttle.allow_request(request, None), allowed)
+
+    def test_bulk_requests_take_a_token_per_item(self):
+        posts = [{'content': f'Post {index}'} for index in range(3)]
+        response = self.client.post(reverse('post-bulk-create'), {'posts': posts}, format='json')
+        self.assertEqual(response.status_code, 201)  # More than the burst: allowed with a full bucket, which is left in debt
+        response = self.client.post(reverse('post-list'), {'content': 'One more'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '120')  # The item over the burst is paid for first
+
+        response = self.client.post(reverse('follows-bulk-unfollow'), {'following': [self.other.id, self.third.id]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(reverse('follows-bulk-follow'), {'following': [self.other.id]}, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '7200')
+        self.assertFalse(Follow.objects.exists())
+
+    async def test_async_endpoints_share_the_buckets(self):
+        headers = {'Authorization': self.authorization}
+        response = await self.async_client.post(reverse('async-follows'), {'following': self.other.id},
+                                                 content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, 201)
+        response = await self.async_client.post(reverse('async-follows'), {'following': self.third.id},
+                                                 content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '3600')
+        follow = await Follow.objects.aget()
+        response = await self.async_client.delete(reverse('async-unfollow', args=[follow.id]), headers=headers)
+        self.assertEqual(response.status_code, 429)
+
+        for _ in range(3):
+            self.assertEqual((await self.async_client.get(reverse('async-profiles'), headers=headers)).status_code, 200)
+        response = await self.async_client.get(reverse('async-feed'), headers=headers)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(await sync_to_async(lambda: self.client.get(reverse('profile-list')).status_code)(), 429)
+
+    def test_tokens_refill_over_time(self):
+        self.assertEqual(take_token(None, 2, 1, now=100), ((1, 100), 0))
+        state, wait = take_token((0, 100), 2, 0.5, now=101)
+        self.assertEqual((state, wait), ((0.5, 101), 1))
+        self.assertEqual(take_token(state, 2, 0.5, now=110), ((1, 110), 0))  # Capped at the burst size
+        self.assertEqual(take_token((2, 100), 2, 1, now=100, cost=5), ((-3, 100), 0))  # Over the burst: needs a full bucket
+        self.assertEqual(take_token((1.5, 100), 2, 1, now=100, cost=5), ((1.5, 100), 0.5))
+
+
+# The values() fast path returns the same bytes as the DRF serializers and JSONRenderer
+class FastPathTests(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.viewer, self.author = make_users('viewer', 'author')
+        Follow.objects.create(follower=self.viewer, following=self.author)
+        asset = MediaAsset.objects.create(sha256='0' * 64, media_type='image', content_type='image/png', size=1,
+                                          variants={'original': 'media/a.png', 'thumbnail': 'media/a_thumb.png'})
+        Post.objects.create(user=self.author, content='Plain')
+        Post.objects.create(user=self.author, content='Quotes "\\" tabs\t\x01 é 😀 \u2028\u2029 </script>',
+                            media='https://example.com/a.png', media_type='image', asset=asset)
+        Profile.objects.filter(user=self.viewer).update(bio='Über ✓', profile_picture='https://example.com/p.png')
+        self.client.force_authenticate(self.viewer)
+
+    def test_feed_matches_serializer(self):
+        response = self.client.get(reverse('post-list'), HTTP_ACCEPT='application/json')
+        posts = feed_queryset(self.viewer.id).select_related('user', 'asset')
+        expected = {'next': None, 'previous': None, 'results': PostSerializer(posts, many=True).data}
+        self.assertEqual(response.content, JSONRenderer().render(expected))
+        self.assertIsNotNone(response.json()['results'][0]['variants'])
+        with timezone.override('Asia/Kolkata'):  # Datetimes are converted to the current time zone
+            rows = post_rows.many(post_rows.values(feed_queryset(self.viewer.id)))
+            self.assertEqual(FastJSONRenderer().render(rows), JSONRenderer().render(PostSerializer(posts, many=True).data))
+
+    def test_profiles_match_serializer(self):
+        response = self.client.get(reverse('profile-list'), HTTP_ACCEPT='application/json')
+        expected = ProfileSerializer(Profile.objects.filter(user=self.viewer), many=True).data
+        self.assertEqual(response.content, JSONRenderer().render(expected))
+
+    def test_renderer_falls_back_to_json(self):
+        for data in [{1: 'non-string key'}, {'big': 2 ** 70}, {'when': timezone.now()}, {'nested': [None, True, 'ok']}]:
+            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render({'a': 1}, 'application/json; indent=2'), b'{\n  "a": 1\n}')
+
+    def test_unsupported_fields_are_rejected(self):
+        with self.assertRaises(TypeError):
+            RowSerializer(PostSerializer).columns  # SerializerMethodField without a row function
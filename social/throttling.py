@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+from .backends import load_backend
+from .cache import get_cache
+
+# Token bucket rate limits for the API.
+#
+# Every client has one bucket per scope: 'read' for safe requests, and the scope a view
+# names in `write_throttle_scope` ('post', 'follow') for its writes. A bucket holds up to
+# `burst` tokens and refills at `rate`; each request takes a token, and a request finding
+# the bucket empty gets a 429 with Retry-After set to the time until the next token.
+# Bulk requests take one token per item (views name the count in `get_throttle_cost`);
+# one larger than the burst is let through when the bucket is full and leaves it in debt,
+# so items are limited to `rate` however they are grouped into requests. The async views,
+# which are not DRF views, take their tokens with consume_token().
+# Clients are identified by user id when authenticated and by IP address otherwise, both
+# known without a query. Buckets live in the store set by THROTTLE_STORE: in process
+# memory by default, or in the social cache (social.cache, e.g. backed by Redis) so that
+# several workers share them.
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+# Tokens per second for a rate such as '30/min'
+def parse_rate(rate):
+    count, period = rate.split('/')
+    return int(count) / PERIODS[period[0]]
+
+
+# Take cost tokens from a bucket stored as (tokens, time of the last update); returns the new state and the wait in seconds
+def take_token(state, capacity, refill_rate, now, cost=1):
+    tokens, updated = state if state is not None else (capacity, now)
+    tokens = min(capacity, tokens + (now - updated) * refill_rate)
+    needed = min(cost, capacity)  # A cost over the burst needs a full bucket, and the rest is owed
+    if tokens >= needed:
+        return (tokens - cost, now), 0
+    return (tokens, now), (needed - tokens) / refill_rate
+
+
+# Interface shared by all bucket stores
+class BaseBucketStore:
+    def __init__(self, **options):
+        pass
+
+    def consume(self, key, capacity, refill_rate, cost=1):
+        raise NotImplementedError  # Returns 0 if the tokens were taken, else the seconds until they are available
+
+    def clear(self):
+        raise NotImplementedError
+
+
+# Buckets in process memory, bounded to max_entries keys (the least recently used are dropped, i.e. refilled)
+class LocMemBucketStore(BaseBucketStore):
+    def __init__(self, max_entries=100000, **options):
+        super().__init__(**options)
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, refill_rate, cost=1):
+        with self._lock:
+            self._buckets[key], wait = take_token(self._buckets.get(key), capacity, refill_rate, time.monotonic(), cost)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+# Buckets in the social cache, shared by every worker using the same cache backend. The
+# read-modify-write is not atomic across processes, so concurrent requests from one client
+# on different workers can occasionally both take the last token.
+class CacheBucketStore(BaseBucketStore):
+    def __init__(self, **options):
+        super().__init__(**options)
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, refill_rate, cost=1):
+        cache = get_cache()
+        with self._lock:
+            state, wait = take_token(cache.get(key), capacity, refill_rate, time.time(), cost)
+            # A bucket untouched until it would be full again needs no entry
+            cache.set(key, state, timeout=int((capacity - state[0]) / refill_rate) + 1)
+        return wait
+
+    def clear(self):
+        pass  # Entries expire with the cache
+
+
+# Return the configured bucket store, creating it on first use
+def get_store():
+    return load_backend('THROTTLE_STORE', 'social.throttling.LocMemBucketStore')
+
+
+# Take cost tokens from the client's bucket for a scope; returns 0 if allowed, else the seconds to wait
+def consume_token(scope, ident, cost=1):
+    config = getattr(settings, 'THROTTLE_RATES', {}).get(scope)
+    if config is None:
+        return 0
+    return get_store().consume(f'throttle:{scope}:{ident}', config['burst'], parse_rate(config['rate']), cost)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    def get_scope(self, request, view):
+        if request.method in SAFE_METHODS:
+            return 'read'
+        return getattr(view, 'write_throttle_scope', None)  # Writes of other views are not limited
+
+    def get_cost(self, request, view):
+        get_throttle_cost = getattr(view, 'get_throttle_cost', None)
+        return get_throttle_cost(request) if get_throttle_cost else 1
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        scope = self.get_scope(request, view)
+        if scope not in getattr(settings, 'THROTTLE_RATES', {}):
+            return True
+        if request.user and request.user.is_authenticated:
+            ident = f'user:{request.user.id}'
+        else:
+            ident = f'ip:{self.get_ident(request)}'  # Honours NUM_PROXIES for X-Forwarded-For
+        wait = consume_token(scope, ident, self.get_cost(request, view))
+        if wait:
+            self.wait_seconds = wait
+            return False
+        return True
+
+    def wait(self):
+        return self.wait_seconds  # DRF rounds it up into the Retry-After header
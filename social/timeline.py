@@ -0,0 +1,174 @@
+import random
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import RowNumber
+from .cache import bump_versions
+from .models import Follow, Post, Profile, TimelineEntry
+
+# Materialized home timelines.
+#
+# Posts are copied into the TimelineEntry table of every follower when they are
+# created (fan-out-on-write), so reading a feed page is a single slice of the
+# (owner, -timestamp, -post) index, however long the user's history. Authors with more
+# than TIMELINE_FANOUT_LIMIT followers are flagged with Profile.fanout_on_read and their
+# posts are merged into the feed at read time instead, each from its own slice of the
+# Post (user, timestamp, id) index. Timelines keep their TIMELINE_MAX_ENTRIES newest
+# entries: older ones are trimmed as new posts arrive.
+
+
+def get_fanout_limit():
+    return getattr(settings, 'TIMELINE_FANOUT_LIMIT', 10000)
+
+
+def get_backfill_size():
+    return getattr(settings, 'TIMELINE_BACKFILL_SIZE', 200)
+
+
+def get_max_entries():
+    return getattr(settings, 'TIMELINE_MAX_ENTRIES', 1000)
+
+
+# Drop the entries past the TIMELINE_MAX_ENTRIES newest of each owner's timeline
+def trim_timelines(owner_ids, batch_size=1000):
+    if not owner_ids:
+        return
+    excess = list(
+        TimelineEntry.objects.filter(owner_id__in=owner_ids)
+        .annotate(position=Window(RowNumber(), partition_by=F('owner_id'), order_by=[F('timestamp').desc(), F('post_id').desc()]))
+        .filter(position__gt=get_max_entries()).values_list('id', flat=True)
+    )
+    for start in range(0, len(excess), batch_size):
+        TimelineEntry.objects.filter(id__in=excess[start:start + batch_size]).delete()
+
+
+def _create_entries(owner_ids, posts):
+    entries = [
+        TimelineEntry(owner_id=owner_id, post_id=post.id, author_id=post.user_id, timestamp=post.timestamp)
+        for owner_id in owner_ids
+        for post in posts
+    ]
+    TimelineEntry.objects.bulk_create(entries, batch_size=1000, ignore_conflicts=True)
+
+
+# Copy new posts by one author into the timelines of the author's followers
+def fan_out_posts(author_id, posts):
+    if Profile.objects.filter(user_id=author_id, fanout_on_read=True).exists():
+        return []  # Followers read this author's posts directly
+
+    limit = get_fanout_limit()
+    follower_ids = list(Follow.objects.filter(following_id=author_id).values_list('follower_id', flat=True)[:limit + 1])
+    if len(follower_ids) > limit:
+        # Too many followers to write to: switch the author to fan-out-on-read for good,
+        # so posts that were already fanned out and new ones never need reconciling
+        Profile.objects.filter(user_id=author_id).update(fanout_on_read=True)
+        return []
+
+    _create_entries(follower_ids, posts)
+    # Trimming every timeline on every post would double the cost of a fan-out: each one is trimmed
+    # once every TIMELINE_TRIM_INTERVAL new entries on average instead, so it stays close to the limit
+    chance = len(posts) / getattr(settings, 'TIMELINE_TRIM_INTERVAL', 100)
+    trim_timelines([follower_id for follower_id in follower_ids if random.random() < chance])
+    return follower_ids
+
+
+# Fill a new follower's timeline with the most recent posts of each followed user
+def backfill_follows(follower_id, following_ids):
+    on_read_ids = Profile.objects.filter(user_id__in=following_ids, fanout_on_read=True).values('user_id')
+    # Latest posts of every author in a single query, numbered per author
+    posts = (
+        Post.objects.filter(user_id__in=following_ids).exclude(user_id__in=on_read_ids)
+        .annotate(position=Window(RowNumber(), partition_by=F('user_id'), order_by=F('timestamp').desc()))
+        .filter(position__lte=get_backfill_size())
+        .only('id', 'user_id', 'timestamp')
+    )
+    _create_entries([follower_id], posts)
+    trim_timelines([follower_id])
+
+
+# Remove unfollowed users' posts from the follower's timeline
+def remove_follows(follower_id, following_ids):
+    TimelineEntry.objects.filter(owner_id=follower_id, author_id__in=following_ids).delete()
+
+
+# Followed authors whose posts are merged into the user's feed at read time
+def on_read_author_ids(user_id):
+    return Follow.objects.filter(follower_id=user_id, following__profile__fanout_on_read=True).values_list('following_id', flat=True)
+
+
+# Key sources of a user's home feed for KeysetPagination.paginate_sources, whose ordering is
+# (-timestamp, -id): the timeline, and the posts of every followed on-read author (async
+# callers pass the on-read author ids they fetched)
+def feed_sources(user_id, on_read_ids=None):
+    if on_read_ids is None:
+        on_read_ids = list(on_read_author_ids(user_id))
+    sources = [(TimelineEntry.objects.filter(owner_id=user_id), ('timestamp', 'post_id'))]
+    # One source per author, so each is read from its index; there are only ever a few such authors
+    sources += [(Post.objects.filter(user_id=author_id), ('timestamp', 'id')) for author_id in on_read_ids]
+    return sources
+
+
+# Rows of a Post queryset (values() rows) for the (timestamp, post id) keys of a feed page, in the keys' order
+def load_posts(queryset, keys):
+    rows = {row['id']: row for row in queryset.filter(id__in=[post_id for _, post_id in keys])}
+    return [rows[post_id] for _, post_id in keys if post_id in rows]  # Posts deleted since the keys were read are skipped
+
+
+async def aload_posts(queryset, keys):
+    rows = {row['id']: row async for row in queryset.filter(id__in=[post_id for _, post_id in keys])}
+    return [rows[post_id] for _, post_id in keys if post_id in rows]
+
+
+# Posts shown in a user's home feed, newest first (for lookups; pages are read with feed_sources)
+def feed_queryset(user_id, on_read_ids=None):
+    if on_read_ids is None:
+        on_read_ids = list(on_read_author_ids(user_id))
+    if not on_read_ids:
+        queryset = Post.objects.filter(timeline_entries__owner_id=user_id)
+    else:
+        materialized = TimelineEntry.objects.filter(owner_id=user_id).values('post_id')
+        queryset = Post.objects.filter(Q(id__in=materialized) | Q(user_id__in=on_read_ids))
+    return queryset.order_by('-timestamp', '-id')
+
+
+# Flag the authors (all of them, or the given ones) with more than TIMELINE_FANOUT_LIMIT followers as fan-out-on-read
+def mark_popular_authors(author_ids=None, batch_size=1000):
+    popular = Follow.objects.values('following_id').order_by().annotate(total=Count('id')).filter(total__gt=get_fanout_limit())
+    if author_ids is None:
+        Profile.objects.filter(user_id__in=list(popular.values_list('following_id', flat=True))).update(fanout_on_read=True)
+        return
+    author_ids = sorted(author_ids)
+    for start in range(0, len(author_ids), batch_size):
+        chunk = popular.filter(following_id__in=author_ids[start:start + batch_size]).values_list('following_id', flat=True)
+        Profile.objects.filter(user_id__in=list(chunk)).update(fanout_on_read=True)
+
+
+# Rebuild timelines from the Follow table: every one (used when enabling timelines), or those of the
+# given owners after some of their follows or the posts of authors they follow were written in bulk
+# (imports), checking only the given authors for the fan-out limit. Each batch of owners is deleted
+# and refilled in one transaction, so feeds are never read empty. Returns the number of follows read.
+def rebuild_timelines(batch_size=1000, owner_ids=None, author_ids=None):
+    if owner_ids is None:
+        Profile.objects.update(fanout_on_read=False)
+        mark_popular_authors()
+        owner_ids = set(Follow.objects.values_list('follower_id', flat=True).distinct())
+        owner_ids.update(TimelineEntry.objects.values_list('owner_id', flat=True).distinct())  # Emptied if they follow nobody
+    else:
+        mark_popular_authors(author_ids or (), batch_size)
+
+    rebuilt = 0
+    owner_ids = sorted(owner_ids)
+    for start in range(0, len(owner_ids), batch_size):
+        owners = owner_ids[start:start + batch_size]
+        follows = Follow.objects.filter(follower_id__in=owners).values_list('follower_id', 'following_id').order_by('follower_id')
+        with transaction.atomic():
+            TimelineEntry.objects.filter(owner_id__in=owners).delete()
+            for follower_id, rows in groupby(follows, key=itemgetter(0)):
+                following_ids = [following_id for _, following_id in rows]
+                backfill_follows(follower_id, following_ids)
+                rebuilt += len(following_ids)
+            bump_versions('feed', owners)
+    return rebuilt
@@ -0,0 +1,126 @@
+import heapq
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from .models import TagBucket
+
+# Trending hashtags over a sliding window of time buckets.
+#
+# Each process counts the hashtags of new posts in memory, per TRENDING_BUCKET_SECONDS
+# bucket, and keeps a running total over the last TRENDING_BUCKETS buckets: adding a use
+# is O(1), expiring a bucket subtracts its counts, and reading the top tags is a heap
+# selection over the totals, with no query. Every TRENDING_FLUSH_SECONDS the counts not
+# yet written are added to the TagBucket table and the window is reloaded from it, so
+# every process serves the totals of all of them (and they survive restarts).
+
+
+def _bucket_seconds():
+    return getattr(settings, 'TRENDING_BUCKET_SECONDS', 300)
+
+
+def _bucket_start(timestamp):
+    size = _bucket_seconds()
+    return int(timestamp // size * size)
+
+
+class TrendingCounter:
+    def __init__(self):
+        self._buckets = deque()  # (bucket start, Counter of tag uses), oldest first
+        self._totals = Counter()  # Sum of the buckets in the window
+        self._unflushed = defaultdict(Counter)  # Bucket start -> tag uses not yet written to the database
+        self._flushed_at = None  # Monotonic time of the last flush (None: the window was never loaded)
+        self._lock = threading.Lock()
+
+    def _window_start(self, now):
+        return _bucket_start(now) - (getattr(settings, 'TRENDING_BUCKETS', 12) - 1) * _bucket_seconds()
+
+    def _expire(self, now):
+        window_start = self._window_start(now)
+        while self._buckets and self._buckets[0][0] < window_start:
+            _, counts = self._buckets.popleft()
+            self._totals.subtract(counts)
+        self._totals = +self._totals  # Drop tags whose count fell to zero
+
+    # Count one use of each tag (one post), made at the given POSIX time (default: now)
+    def add(self, tags, when=None):
+        now = time.time()
+        start = _bucket_start(now if when is None else when)
+        if start < self._window_start(now):
+            return  # Already out of the window
+        with self._lock:
+            index = len(self._buckets)
+            while index and self._buckets[index - 1][0] > start:  # Late uses go to an earlier bucket
+                index -= 1
+            if index == 0 or self._buckets[index - 1][0] != start:
+                self._buckets.insert(index, (start, Counter()))
+                index += 1
+            self._buckets[index - 1][1].update(tags)
+            self._totals.update(tags)
+            self._unflushed[start].update(tags)
+        self._flush_if_due()
+
+    # The most used tags in the window, as (tag, count)
+    def top(self, limit=10, now=None):
+        self._flush_if_due()
+        with self._lock:
+            self._expire(time.time() if now is None else now)
+            return heapq.nsmallest(limit, self._totals.items(), key=lambda item: (-item[1], item[0]))
+
+    def _flush_if_due(self):
+        interval = getattr(settings, 'TRENDING_FLUSH_SECONDS', 10)
+        if self._flushed_at is None or time.monotonic() - self._flushed_at >= interval:
+            self.flush()
+
+    # Add the unwritten counts to TagBucket, drop expired rows and reload the window from the table
+    def flush(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            unflushed, self._unflushed = self._unflushed, defaultdict(Counter)
+            self._flushed_at = time.monotonic()
+        window_start = self._window_start(now)
+        rows = {
+            (tag, datetime.fromtimestamp(start, dt_timezone.utc)): count
+            for start, counts in unflushed.items() if start >= window_start
+            for tag, count in counts.items()
+        }
+        with transaction.atomic():
+            if rows:
+                # Create the missing rows, then increment all of them in place so concurrent flushes add up
+                TagBucket.objects.bulk_create([TagBucket(tag=tag, bucket=bucket) for tag, bucket in rows], ignore_conflicts=True)
+                existing = TagBucket.objects.filter(bucket__in={bucket for _, bucket in rows}, tag__in={tag for tag, _ in rows})
+                updates = []
+                for bucket in existing.only('id', 'tag', 'bucket'):
+                    if (bucket.tag, bucket.bucket) in rows:
+                        bucket.count = F('count') + rows[bucket.tag, bucket.bucket]
+                        updates.append(bucket)
+                TagBucket.objects.bulk_update(updates, ['count'])
+            window_start_time = datetime.fromtimestamp(window_start, dt_timezone.utc)
+            TagBucket.objects.filter(bucket__lt=window_start_time).delete()
+            stored = list(TagBucket.objects.filter(bucket__gte=window_start_time).order_by('bucket').values_list('bucket', 'tag', 'count'))
+
+        buckets = {}
+        for bucket, tag, count in stored:
+            buckets.setdefault(int(bucket.timestamp()), Counter())[tag] = count
+        with self._lock:
+            # Uses counted while the flush ran are still only in memory: keep them on top of the table's counts
+            for start, counts in self._unflushed.items():
+                buckets.setdefault(start, Counter()).update(counts)
+            self._buckets = deque(sorted(buckets.items()))
+            self._totals = Counter()
+            for _, counts in self._buckets:
+                self._totals.update(counts)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+            self._totals.clear()
+            self._unflushed.clear()
+            self._flushed_at = None
+
+
+trending = TrendingCounter()
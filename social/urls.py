@@ -1,7 +1,9 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import PostViewSet, FollowViewSet, ProfileViewSet, signup, home_redirect
+from .views import PostViewSet, FollowViewSet, ProfileViewSet, SearchView, TagPostsView, TrendingView, ExportView, MediaUploadView, TokenRevokeView, signup, home_redirect
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from django.contrib.auth import views as auth_views
+from . import async_views
 from django.shortcuts import redirect
 
 # Function to handle redirection based on authentication
@@ -21,6 +23,21 @@ router.register(r'profiles', ProfileViewSet)
 urlpatterns = [
     path('', home_redirect, name='home_redirect'),  # Redirect to login/admin based on authentication
     path('api/', include(router.urls)),  # API endpoints (for posts, followers, profiles)
+    # JWT access/refresh tokens for stateless API authentication
+    path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('api/token/revoke/', TokenRevokeView.as_view(), name='token_revoke'),
+    path('api/export/', ExportView.as_view(), name='export'),  # Streaming export of the user's data
+    path('api/media/', MediaUploadView.as_view(), name='media-upload'),  # Upload media for posts
+    path('api/search/', SearchView.as_view(), name='search'),  # Full-text search over posts and profiles
+    path('api/tags/<str:tag>/posts/', TagPostsView.as_view(), name='tag-posts'),  # Posts with a hashtag
+    path('api/trending/', TrendingView.as_view(), name='trending'),  # Most used hashtags right now
+    # Async versions of the feed, follow and profile endpoints (served without a thread per request under ASGI)
+    path('api/async/posts/', async_views.feed, name='async-feed'),
+    path('api/async/followers/', async_views.follows, name='async-follows'),
+    path('api/async/followers/<int:pk>/', async_views.unfollow, name='async-unfollow'),
+    path('api/async/profiles/', async_views.profiles, name='async-profiles'),
+    path('api/stream/posts/', async_views.feed_stream, name='feed-stream'),  # New posts pushed as Server-Sent Events (ASGI only)
     path('login/', auth_views.LoginView.as_view(redirect_authenticated_user=True), name='login'),  # Redirect logged-in users
     path('logout/', auth_views.LogoutView.as_view(), name='logout'),
     path('signup/', signup, name='signup'),  # Path for user signup
@@ -1,15 +1,38 @@
+from collections import defaultdict
+
 from rest_framework import viewsets, permissions, status, generics
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.decorators import action
+from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import BrowsableAPIRenderer
 from django.shortcuts import get_object_or_404, render, redirect
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth.models import User
 from rest_framework.exceptions import PermissionDenied
 from django.contrib.auth.decorators import login_required
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Max
+from django.http import HttpResponse, StreamingHttpResponse
 from .models import Post, Profile, Follow
-from .serializers import PostSerializer, ProfileSerializer, FollowSerializer
+from .serializers import PostSerializer, ProfileSerializer, FollowSerializer, MediaAssetSerializer
+from .timeline import feed_queryset, feed_sources, load_posts
+from .pagination import KeysetPagination, SearchPagination
+from .cache import cached_response
+from .conditional import conditional_response, page_summary
+from .fastpath import FastJSONRenderer, post_rows, profile_rows
+from .signals import posts_created, follows_created, follows_removed
+from .metrics import registry
+from .graph import graph
+from .trending import trending
+from .export import FORMATS as EXPORT_FORMATS, export_chunks
+from .authentication import get_user_instance, revoke_token
+from .media import HashingUploadHandler, store_upload
+from rest_framework.parsers import MultiPartParser
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import RefreshToken
 
 # Redirect to admin or login depending on user authentication status
 def home_redirect(request):
@@ -22,19 +45,80 @@ def signup(request):
     if request.method == 'POST':
         form = UserCreationForm(request.POST)
         if form.is_valid():
-            user = form.save()
+            with transaction.atomic():
+                user = form.save()  # The post_save signal creates the profile in the same transaction
             login(request, user)  # Automatically log the user in after signup
-            return redirect('posts')  # Redirect to posts or homepage
+            return redirect('post-list')  # Redirect to the posts API (there is no 'posts' route)
     else:
         form = UserCreationForm()
     return render(request, 'registration/signup.html', {'form': form})
 
-# Custom pagination for posts
-class FeedPagination(PageNumberPagination):
+# Read the list of items sent to a bulk endpoint, or return an error message
+def get_bulk_items(data, key):
+    items = data.get(key) if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return None, f"'{key}' must be a non-empty list."
+    limit = getattr(settings, 'BULK_MAX_ITEMS', 1000)
+    if len(items) > limit:
+        return None, f"At most {limit} items can be sent at once."
+    return items, None
+
+# Throttle cost of a request to a bulk endpoint: one token per item (invalid requests are rejected for one)
+def get_bulk_cost(data, key):
+    items, error = get_bulk_items(data, key)
+    return 1 if error else len(items)
+
+# Set the ids of one author's posts inserted with bulk_create on databases that do not return them (MySQL),
+# matching the rows by timestamp and content, in insertion order
+def read_back_post_ids(posts):
+    rows = (Post.objects.filter(user_id=posts[0].user_id, timestamp__in={post.timestamp for post in posts})
+            .order_by('id').values_list('id', 'timestamp', 'content'))
+    ids = defaultdict(list)
+    for post_id, timestamp, content in rows:
+        ids[timestamp, content].append(post_id)
+    for post in posts:
+        post.id = ids[post.timestamp, post.content].pop(0)
+
+# Read the user id sent to the follow endpoint (a string in form data), or return an error message
+def get_user_id(value):
+    try:
+        return int(value), None
+    except (TypeError, ValueError):
+        return None, "'following' must be a user id."
+
+# Read a list of user ids sent to a bulk follow endpoint, or return an error message
+def get_bulk_user_ids(data):
+    items, error = get_bulk_items(data, 'following')
+    if error:
+        return None, error
+    try:
+        return [int(item) for item in items], None
+    except (TypeError, ValueError):
+        return None, "'following' must be a list of user ids."
+
+# Renderers of the hot list endpoints: orjson when installed, with the same output as JSONRenderer
+FAST_RENDERERS = [FastJSONRenderer, BrowsableAPIRenderer]
+
+# Relations joined for PostSerializer and ProfileSerializer, and the columns they read
+POST_RELATED = ('user', 'asset')
+POST_FIELDS = ('id', 'content', 'timestamp', 'updated_at', 'media', 'media_type', 'user__id', 'user__username', 'asset__variants')
+PROFILE_RELATED = ('user',)
+PROFILE_FIELDS = ('id', 'bio', 'profile_picture', 'followers_count', 'following_count', 'posts_count', 'updated_at', 'user__id', 'user__username')
+
+# Custom pagination for posts: an opaque cursor keyed on (timestamp, id), so every page costs the same
+class FeedPagination(KeysetPagination):
+    ordering = ('-timestamp', '-id')  # Newest posts first
     page_size = 10  # You can set a custom page size here
     page_size_query_param = 'page_size'
     max_page_size = 100  # Optional limit on the maximum page size
 
+# Pagination for a hashtag's posts, keyed on the tag row's copy of the post timestamp so pages are read from its index
+class TagPagination(KeysetPagination):
+    ordering = ('-tagged_at', '-id')
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
 # View for displaying posts
 @login_required
 def posts(request):
@@ -47,21 +131,48 @@ class PostViewSet(viewsets.ModelViewSet):
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = FeedPagination
+    write_throttle_scope = 'post'
+    renderer_classes = FAST_RENDERERS
+
+    # Tokens taken from the 'post' bucket: one per post, also when they are created in bulk
+    def get_throttle_cost(self, request):
+        return get_bulk_cost(request.data, 'posts') if self.action == 'bulk_create' else 1
 
     def get_queryset(self):
-        user = self.request.user
-        followed_users = user.following.values_list('following', flat=True)
-        # Show posts from users the current user follows, or their own posts
-        return Post.objects.filter(user__in=followed_users).order_by('-timestamp')
+        # Show posts from users the current user follows, read from the precomputed timeline,
+        # joined to the author in the same query and limited to the columns the serializer needs
+        return feed_queryset(self.request.user.id).select_related(*POST_RELATED).only(*POST_FIELDS)
+
+    def list(self, request, *args, **kwargs):
+        # Serve feed pages from the cache until a post or follow change bumps the user's feed version;
+        # clients revalidating with the page's ETag get a 304 from the cache or, on a miss, after probing
+        # the page's keys and one aggregate over its posts
+        def probe():
+            post_ids = sorted(post_id for _, post_id in self.pagination_class().page_keys(feed_sources(request.user.id), request))
+            summary = Post.objects.filter(id__in=post_ids).aggregate(last=Max('updated_at'), count=Count('id'))
+            return post_ids, summary['last'], summary['count']
+
+        return conditional_response(
+            'feed', request, probe,
+            lambda: self._list(request),
+            lambda: [(post['id'], post['updated_at']) for post in self.paginator.rows],
+        )
+
+    def _list(self, request):
+        # The page's keys are read from the timeline index, then its posts as values() rows mapped to
+        # PostSerializer's output (see social/fastpath.py) without building model instances
+        rows = post_rows.values(Post.objects.all(), 'updated_at')
+        page = self.paginator.paginate_sources(feed_sources(request.user.id), request, lambda keys: load_posts(rows, keys))
+        return self.get_paginated_response(post_rows.many(page))
 
     def perform_create(self, serializer):
-        # Save the post with the current user as the author
-        serializer.save(user=self.request.user)
+        # Save the post with the current user as the author (the post_save signal fans it out to followers)
+        serializer.save(user=get_user_instance(self.request.user))
 
     def update(self, request, pk=None):
-        post = get_object_or_404(Post, pk=pk)
+        post = get_object_or_404(Post.objects.select_related(*POST_RELATED), pk=pk)
         # Ensure the user is only allowed to update their own posts
-        if post.user != request.user:
+        if post.user_id != request.user.id:
             raise PermissionDenied("You can only update your own posts.")
         serializer = PostSerializer(post, data=request.data, partial=True)
         if serializer.is_valid():
@@ -72,38 +183,162 @@ class PostViewSet(viewsets.ModelViewSet):
     def destroy(self, request, pk=None):
         post = get_object_or_404(Post, pk=pk)
         # Ensure the user is only allowed to delete their own posts
-        if post.user != request.user:
+        if post.user_id != request.user.id:
             raise PermissionDenied("You can only delete your own posts.")
         post.delete()
         return Response({"message": "Post deleted successfully."}, status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_create(self, request):
+        # Create many posts with a single INSERT, reporting the result of every item
+        items, error = get_bulk_items(request.data, 'posts')
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        results, posts = [], []
+        author = get_user_instance(request.user)
+        for index, item in enumerate(items):
+            serializer = PostSerializer(data=item)
+            if serializer.is_valid():
+                posts.append(Post(user=author, **serializer.validated_data))
+                results.append({"index": index, "status": "created"})
+            else:
+                results.append({"index": index, "status": "invalid", "errors": serializer.errors})
+
+        if posts:
+            with transaction.atomic():
+                Post.objects.bulk_create(posts)
+                if posts[0].id is None:
+                    read_back_post_ids(posts)  # Before the side effects and the response, which need them
+                posts_created(posts)  # bulk_create sends no post_save signals
+        created = iter(PostSerializer(posts, many=True).data)
+        for result in results:
+            if result["status"] == "created":
+                result["post"] = next(created)
+
+        response_status = status.HTTP_201_CREATED if posts else status.HTTP_400_BAD_REQUEST
+        return Response({"created": len(posts), "results": results}, status=response_status)
+
 # ViewSet for handling following/unfollowing users
 class FollowViewSet(viewsets.ViewSet):
     permission_classes = [permissions.IsAuthenticated]
+    write_throttle_scope = 'follow'
+    renderer_classes = FAST_RENDERERS
 
-    def create(self, request):
-        following_user_id = request.data.get('following')
-        following_user = User.objects.get(id=following_user_id)
+    # Tokens taken from the 'follow' bucket: one per user followed or unfollowed
+    def get_throttle_cost(self, request):
+        return get_bulk_cost(request.data, 'following') if self.action in ('bulk_follow', 'bulk_unfollow') else 1
 
+    def create(self, request):
+        following_user_id, error = get_user_id(request.data.get('following'))
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
         if request.user.id == following_user_id:
             return Response({"error": "You cannot follow yourself."}, status=status.HTTP_400_BAD_REQUEST)
+        following_user = User.objects.filter(id=following_user_id).only('id', 'username').first()
+        if following_user is None:
+            return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        follow, created = Follow.objects.get_or_create(follower=request.user, following=following_user)
+        follow, created = Follow.objects.get_or_create(follower_id=request.user.id, following=following_user)
         if created:
             return Response({"message": f"You are now following {following_user.username}."}, status=status.HTTP_201_CREATED)
         return Response({"message": f"You are already following {following_user.username}."}, status=status.HTTP_200_OK)
 
     def destroy(self, request, pk=None):
         try:
-            follow = Follow.objects.get(id=pk, follower=request.user)
+            follow = Follow.objects.get(id=pk, follower_id=request.user.id)
             follow.delete()
             return Response({"message": "You have unfollowed the user."}, status=status.HTTP_204_NO_CONTENT)
         except Follow.DoesNotExist:
             return Response({"error": "You are not following this user."}, status=status.HTTP_404_NOT_FOUND)
 
     def list(self, request):
-        follows = Follow.objects.filter(follower=request.user)
-        following_users = [follow.following.username for follow in follows]
+        return cached_response('follows', request, lambda: self._list(request))
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_follow(self, request):
+        # Follow many users: one query to validate the ids, one to find existing follows, one INSERT
+        user_ids, error = get_bulk_user_ids(request.data)
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        existing_ids = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+        followed_ids = set(Follow.objects.filter(follower_id=request.user.id, following_id__in=existing_ids).values_list('following_id', flat=True))
+
+        results, new_ids = [], []
+        for user_id in user_ids:
+            if user_id == request.user.id:
+                result = "cannot_follow_self"
+            elif user_id not in existing_ids:
+                result = "not_found"
+            elif user_id in followed_ids:
+                result = "already_following"
+            else:
+                result = "followed"
+                new_ids.append(user_id)
+                followed_ids.add(user_id)  # Report repeated ids in the request as already followed
+            results.append({"following": user_id, "status": result})
+
+        if new_ids:
+            with transaction.atomic():
+                Follow.objects.bulk_create(
+                    [Follow(follower_id=request.user.id, following_id=user_id) for user_id in new_ids],
+                    ignore_conflicts=True,
+                )
+                follows_created(request.user.id, new_ids)  # bulk_create sends no post_save signals
+        return Response({"followed": len(new_ids), "results": results}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='bulk-unfollow')
+    def bulk_unfollow(self, request):
+        # Unfollow many users: one query to find the follows, one DELETE
+        user_ids, error = get_bulk_user_ids(request.data)
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        follows = Follow.objects.filter(follower_id=request.user.id, following_id__in=user_ids)
+        followed_ids = set(follows.values_list('following_id', flat=True))
+        if followed_ids:
+            with transaction.atomic():
+                # A raw delete skips loading every row to send post_delete signals one by one;
+                # the side effects are applied to the whole batch instead
+                follows._raw_delete(follows.db)
+                follows_removed(request.user.id, list(followed_ids))
+
+        results = [
+            {"following": user_id, "status": "unfollowed" if user_id in followed_ids else "not_following"}
+            for user_id in user_ids
+        ]
+        return Response({"unfollowed": len(followed_ids), "results": results}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def suggestions(self, request):
+        # Users followed by the users you follow, ranked by how many of them follow each one (from the in-memory graph)
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 100)
+        except ValueError:
+            return Response({"error": "'limit' must be a number."}, status=status.HTTP_400_BAD_REQUEST)
+        ranked = graph.suggestions(request.user.id, limit=limit)
+        usernames = dict(User.objects.filter(id__in=[user_id for user_id, _ in ranked]).values_list('id', 'username'))
+        results = [
+            {"id": user_id, "username": usernames[user_id], "mutual_count": count}
+            for user_id, count in ranked if user_id in usernames
+        ]
+        return Response({"suggestions": results}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path=r'mutual/(?P<user_id>\d+)')
+    def mutual(self, request, user_id=None):
+        # Whether you follow the user, the user follows you, or both
+        other_id, error = get_user_id(user_id)
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+        low, high = connection.ops.integer_field_range(User._meta.pk.get_internal_type())
+        if not low <= other_id <= high:  # No user has this id, and the database would reject it
+            return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"user": other_id, **graph.relation(request.user.id, other_id)}, status=status.HTTP_200_OK)
+
+    def _list(self, request):
+        # Fetch the usernames in a single query instead of one query per follow
+        following_users = list(Follow.objects.filter(follower_id=request.user.id).values_list('following__username', flat=True))
         return Response({"following": following_users}, status=status.HTTP_200_OK)
 
 # ViewSet for managing user profiles
@@ -111,21 +346,137 @@ class ProfileViewSet(viewsets.ModelViewSet):
     queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = FAST_RENDERERS
 
     def get_queryset(self):
-        return Profile.objects.filter(user=self.request.user)
+        return Profile.objects.filter(user_id=self.request.user.id).select_related(*PROFILE_RELATED).only(*PROFILE_FIELDS)
+
+    def list(self, request, *args, **kwargs):
+        probe = lambda: page_summary(list(Profile.objects.filter(user_id=request.user.id).values_list('id', 'updated_at')))
+        return conditional_response('profile', request, probe, lambda: self._list(request), lambda: self.rows)
+
+    def _list(self, request):
+        # Same fast path as the feed: values() rows mapped to ProfileSerializer's output
+        profiles = list(profile_rows.values(Profile.objects.filter(user_id=request.user.id), 'id', 'updated_at'))
+        self.rows = [(profile['id'], profile['updated_at']) for profile in profiles]  # For the ETag
+        return Response(profile_rows.many(profiles))
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        serializer.save(user=get_user_instance(self.request.user))
+
+# View for full-text search over posts or profiles, best matches first
+class SearchView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    SEARCH_TYPES = {
+        'posts': ('post', Post, PostSerializer, POST_RELATED, POST_FIELDS),
+        'profiles': ('profile', Profile, ProfileSerializer, PROFILE_RELATED, PROFILE_FIELDS),
+    }
+
+    def get(self, request):
+        search_type = request.query_params.get('type', 'posts')
+        if search_type not in self.SEARCH_TYPES:
+            return Response({"error": "'type' must be 'posts' or 'profiles'."}, status=status.HTTP_400_BAD_REQUEST)
+        kind, model, serializer_class, related, fields = self.SEARCH_TYPES[search_type]
+
+        paginator = SearchPagination()
+        matches = paginator.paginate_search(kind, request.query_params.get('q', ''), request)
+        # Load the matched objects in one query and keep them in rank order
+        objects = model.objects.select_related(*related).only(*fields).in_bulk([match['object_id'] for match in matches])
+        results = [objects[match['object_id']] for match in matches if match['object_id'] in objects]
+        return paginator.get_paginated_response(serializer_class(results, many=True).data)
+
+# Posts with a hashtag, newest first (the tag is given without '#' and matched case-insensitively)
+class TagPostsView(generics.ListAPIView):
+    serializer_class = PostSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = TagPagination
+
+    def get_queryset(self):
+        # One join from the (tag, timestamp) index of the tag rows to the posts
+        return (
+            Post.objects.filter(tagged_items__tag__name=self.kwargs['tag'].lower())
+            .annotate(tagged_at=F('tagged_items__timestamp'))
+            .select_related(*POST_RELATED).only(*POST_FIELDS)
+        )
+
+# Most used hashtags of the last hour (or TRENDING_BUCKETS x TRENDING_BUCKET_SECONDS), read from the in-memory counters
+class TrendingView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 100)
+        except ValueError:
+            return Response({"error": "'limit' must be a number."}, status=status.HTTP_400_BAD_REQUEST)
+        window = getattr(settings, 'TRENDING_BUCKETS', 12) * getattr(settings, 'TRENDING_BUCKET_SECONDS', 300)
+        tags = [{"tag": tag, "count": count} for tag, count in trending.top(limit)]
+        return Response({"window_seconds": window, "trending": tags}, status=status.HTTP_200_OK)
+
+# Stream all of the user's data (account, profile, posts, follows) as NDJSON or, with ?output=csv, CSV
+class ExportView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        output_format = request.query_params.get('output', 'ndjson')  # Not "format", which DRF reserves
+        if output_format not in EXPORT_FORMATS:
+            return Response({"error": "'output' must be 'ndjson' or 'csv'."}, status=status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(export_chunks(output_format, user_id=request.user.id),
+                                         content_type=EXPORT_FORMATS[output_format][1])
+        response['Content-Disposition'] = f'attachment; filename="export-{request.user.id}.{output_format}"'
+        return response
+
+# Upload an image, video or audio file; returns the stored asset, to be attached to a post as `media_asset`
+class MediaUploadView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [MultiPartParser]
+
+    def initialize_request(self, request, *args, **kwargs):
+        # Stream the upload to disk and hash it on the way, instead of buffering it in memory
+        request.upload_handlers = [HashingUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            limit = getattr(settings, 'MEDIA_MAX_UPLOAD_SIZE', 50 * 1024 * 1024)
+            return Response({"error": f"Send a 'file' of at most {limit} bytes."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            asset, created = store_upload(upload, request.user.id)
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        response_status = status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        return Response(MediaAssetSerializer(asset).data, status=response_status)
+
+# Revoke a refresh token, and the access token the request was made with, until they expire
+class TokenRevokeView(APIView):
+    permission_classes = [permissions.AllowAny]  # Holding the refresh token is proof enough
+
+    def post(self, request):
+        try:
+            refresh = RefreshToken(request.data.get('refresh', ''))
+        except TokenError as error:
+            return Response({"error": str(error)}, status=status.HTTP_401_UNAUTHORIZED)
+        revoke_token(refresh)
+        if request.auth is not None:
+            revoke_token(request.auth)
+        return Response({"message": "Token revoked."}, status=status.HTTP_200_OK)
+
+# Prometheus endpoint with the per-route request metrics (protected by METRICS_TOKEN when it is set)
+def metrics(request):
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 # Post update view
 class PostUpdateView(generics.UpdateAPIView):
-    queryset = Post.objects.all()
+    queryset = Post.objects.select_related(*POST_RELATED)
     serializer_class = PostSerializer
     permission_classes = [IsAuthenticated]
+    write_throttle_scope = 'post'
 
     def get_object(self):
         post = super().get_object()
-        if post.user != self.request.user:
+        if post.user_id != self.request.user.id:
             raise PermissionDenied("You can only update your own posts.")
         return post
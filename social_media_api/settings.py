@@ -1,5 +1,6 @@
 import os
 from pathlib import Path
+from datetime import timedelta
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -22,10 +23,12 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',  # DRF for API functionality
+    'taggit',  # Hashtags on posts
     'social',  # Your custom app
 ]
 
 MIDDLEWARE = [
+    'social.middleware.MetricsMiddleware',  # First, so it times the whole request
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -33,6 +36,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'social.middleware.ReplicaPinningMiddleware',  # Read-your-writes routing to the primary database
 ]
 
 ROOT_URLCONF = 'social_media_api.urls'
@@ -56,14 +60,56 @@ TEMPLATES = [
 WSGI_APPLICATION = 'social_media_api.wsgi.application'
 
 
-# Database configuration
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Database configuration, read from the environment (defaults to the local SQLite file)
+#   DB_ENGINE: sqlite, postgresql or mysql
+#   DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT: connection settings of the primary
+#   DB_REPLICAS: comma-separated read replica hosts (for SQLite, replica file names)
+#   DB_CONN_MAX_AGE: seconds a connection is kept open between requests (0 closes it after each request)
+DB_ENGINES = {
+    'sqlite': 'django.db.backends.sqlite3',
+    'postgresql': 'django.db.backends.postgresql',
+    'mysql': 'mysql.connector.django',
+}
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+DB_NAME = os.environ.get('DB_NAME', str(BASE_DIR / 'db.sqlite3') if DB_ENGINE == 'sqlite' else 'social_media')
+
+
+def database_config(name, host):
+    config = {
+        'ENGINE': DB_ENGINES[DB_ENGINE],
+        'NAME': name,
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '60')),  # Reuse connections across requests
+        'CONN_HEALTH_CHECKS': True,  # Check a reused connection is still alive before the first query of a request
     }
+    if DB_ENGINE != 'sqlite':
+        config.update({
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': host,
+            'PORT': os.environ.get('DB_PORT', ''),
+        })
+    return config
+
+
+DATABASES = {
+    'default': database_config(DB_NAME, os.environ.get('DB_HOST', '')),
 }
 
+# Read replicas are named replica_1, replica_2, ... and mirror the primary in tests
+REPLICA_DATABASES = []
+for index, replica in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(',')), start=1):
+    alias = f'replica_{index}'
+    if DB_ENGINE == 'sqlite':
+        DATABASES[alias] = database_config(replica, '')
+    else:
+        DATABASES[alias] = database_config(DB_NAME, replica)
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    REPLICA_DATABASES.append(alias)
+
+# Send reads of the social app to the replicas and writes to the primary (see social/routers.py)
+DATABASE_ROUTERS = ['social.routers.PrimaryReplicaRouter']
+REPLICA_PIN_SECONDS = 5  # After a write, the user's reads go to the primary for this long (read-your-writes)
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -92,6 +138,7 @@ STATIC_URL = 'static/'
 # Media files configuration (important for handling profile pictures and post media)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_MAX_UPLOAD_SIZE = 50 * 1024 * 1024  # Largest accepted upload, in bytes
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -103,9 +150,87 @@ LOGOUT_REDIRECT_URL = '/'
 # Django Rest Framework settings (if you have any specific DRF configurations)
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
+        'social.authentication.StatelessJWTAuthentication',  # Bearer tokens, no session or user lookup
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'social.throttling.TokenBucketThrottle',  # Per user (or IP) token buckets, see THROTTLE_RATES
+    ],
+}
+
+# Token bucket limits per scope (social/throttling.py): 'rate' refills the bucket, 'burst' is its size
+THROTTLE_RATES = {
+    'read': {'rate': '600/min', 'burst': 120},  # Every GET of the API
+    'post': {'rate': '30/min', 'burst': 10},  # Creating and editing posts
+    'follow': {'rate': '60/min', 'burst': 30},  # Following and unfollowing
+}
+THROTTLE_STORE = {
+    'BACKEND': 'social.throttling.LocMemBucketStore',  # CacheBucketStore shares the buckets through SOCIAL_CACHE
+    'OPTIONS': {
+        'max_entries': 100000,
+    },
+}
+
+# JWT settings (see social.authentication)
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=15),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
+    'TOKEN_OBTAIN_SERIALIZER': 'social.authentication.SocialTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'social.authentication.DenylistTokenRefreshSerializer',
+}
+
+# In-memory follow graph (see social.graph)
+GRAPH_MAX_USERS = 100000  # Adjacency arrays kept in memory per process
+GRAPH_SUGGESTION_SOURCES = 500  # Followed users whose follows are counted for suggestions
+
+# Background jobs (see social.tasks): run inline under DEBUG, by `manage.py run_tasks` otherwise
+TASKS_EAGER = os.environ.get('TASKS_EAGER', '1' if DEBUG else '0') == '1'
+TASKS_MAX_ATTEMPTS = 5  # A job failing this many times is marked as failed
+TASKS_LOCK_SECONDS = 300  # A job running longer than this is assumed lost and run again
+
+# Home timeline settings
+TIMELINE_FANOUT_LIMIT = 10000  # Authors with more followers than this are merged into feeds at read time
+TIMELINE_BACKFILL_SIZE = 200  # Number of recent posts copied into a timeline when a user follows someone
+TIMELINE_MAX_ENTRIES = 1000  # Timelines keep this many of their newest entries
+TIMELINE_TRIM_INTERVAL = 100  # Timelines are trimmed about once every this many new entries
+
+# Cache for list endpoints (social.cache): LocMemLRUBackend, FileBackend or DjangoCacheBackend
+SOCIAL_CACHE = {
+    'BACKEND': 'social.cache.LocMemLRUBackend',
+    'TIMEOUT': 300,  # Seconds a cached page is kept at most
+    'OPTIONS': {
+        'max_entries': 10000,  # Least recently used pages are evicted past this size
+    },
+}
+
+# Real-time feed push (social/realtime.py); InProcessBroker only reaches clients of the writing process
+REALTIME_BROKER = {
+    'BACKEND': 'social.realtime.InProcessBroker',
+    'OPTIONS': {
+        'max_pending': 100,  # Messages buffered per client before it is told to resync
+        'queue_size': 10000,  # Messages waiting for the delivery thread before new ones are dropped (with a resync)
+    },
 }
+REALTIME_BATCH_SECONDS = 0.25  # New posts arriving within this window are sent as one event
+REALTIME_HEARTBEAT_SECONDS = 15  # Keep-alive comment sent on idle streams
+
+# Trending hashtags (social/trending.py): in-memory counts per time bucket, flushed to the TagBucket table
+TRENDING_BUCKET_SECONDS = 300  # Size of a time bucket
+TRENDING_BUCKETS = 12  # Buckets in the sliding window (one hour)
+TRENDING_FLUSH_SECONDS = 10  # How often each process writes its counts and reloads the window
+
+# Admin changelists (social/admin.py)
+ADMIN_COUNT_LIMIT = 10000  # Rows counted exactly; larger lists show an estimate, or "N+" when filtered
+ADMIN_DELETE_CHUNK_SIZE = 1000  # Follows deleted per transaction by the unfollow action
+
+# Largest number of items accepted by the bulk follow, unfollow and post endpoints
+BULK_MAX_ITEMS = 1000
+
+# Request metrics exported at /metrics (see social/metrics.py)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # If set, scrapers must send "Authorization: Bearer <token>"
+METRICS_SLOW_REQUEST_MS = 500  # Requests slower than this are logged with their SQL (None disables the log)
+METRICS_SLOW_REQUEST_SAMPLE_RATE = 1.0  # Fraction of slow requests that are logged
+METRICS_SLOW_REQUEST_MAX_SQL = 50  # Statements kept per request for the slow request log
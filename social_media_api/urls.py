@@ -1,9 +1,12 @@
 from django.contrib import admin
+from django.conf import settings
+from django.conf.urls.static import static
 from django.urls import path, include
-from social.views import home_redirect  # Import home_redirect function for root access redirection
+from social.views import home_redirect, metrics  # Import home_redirect function for root access redirection
 
 urlpatterns = [
     path('admin/', admin.site.urls),  # Admin panel access
     path('', home_redirect, name='home_redirect'),  # Redirect root URL based on authentication
     path('api/', include('social.urls')),  # Include 'social' app URLs (API, login, signup, etc.)
-]
+    path('metrics', metrics, name='metrics'),  # Prometheus metrics of the API
+] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)  # Uploaded media, served by Django in DEBUG only